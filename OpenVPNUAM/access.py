@@ -0,0 +1,217 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Access - Index of the users access time windows
+
+Each user may be restricted to a time window by its start and stop times.
+The windows are compiled once per database poll into a sorted list of the
+coming boundaries and the state of each user, then the index only moves
+forward through the boundaries as time passes. Checking a user is a single
+dictionary lookup and the time of the next state change is always known.
+"""
+
+# System imports
+import bisect
+import datetime
+import logging
+import threading
+import time
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.access')
+
+# the formats accepted for the string typed times
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+
+def parseAccessTime(value):
+  """Convert a start or stop time to a UNIX timestamp
+
+  @param value [datetime|date|str] the time as given by the adapter
+  @return [float] the UNIX timestamp
+          [None] if there is no time or if it cannot be read
+  """
+  if value is None:
+    return None
+  if isinstance(value, datetime.datetime):
+    return time.mktime(value.timetuple())
+  if isinstance(value, datetime.date):
+    return time.mktime(value.timetuple())
+  value = str(value).strip()
+  if len(value) == 0 or value.startswith('0000-00-00'):
+    return None
+  for fmt in TIME_FORMATS:
+    try:
+      return time.mktime(datetime.datetime.strptime(value, fmt).timetuple())
+    except ValueError:
+      pass
+  g_sys_log.error("Unable to read access time '%s'", value)
+  return None
+
+
+class AccessWindowIndex(object):
+  """This class answers if users are inside their access window
+  """
+
+  # constants for users states
+  STATE_ALLOWED = None
+  # these states are also the deny reasons of the authorization
+  STATE_NOT_STARTED = 'access-not-started'
+  STATE_STOPPED = 'access-stopped'
+
+  def __init__(self):
+    """Constructor : Build an empty index
+    """
+    self.__lock = threading.Lock()
+    # the state of restricted users by id, unrestricted users are absent
+    self.__d_state = dict()
+    # the (start, stop) timestamps of restricted users by id
+    self.__d_window = dict()
+    # the sorted (time, user_id, state) of the coming boundaries
+    self.__l_boundary = []
+    self.__position = 0
+    # the time of the next boundary, infinite if there is none
+    self.__next_time = float('inf')
+
+  def __len__(self):
+    """Return the number of restricted users
+
+    @return [int] the number of users with a window
+    """
+    return len(self.__d_window)
+
+  @property
+  def next_time(self):
+    """Return the time of the next state change
+
+    @return [float] the UNIX timestamp, infinite if there is none
+    """
+    return self.__next_time
+
+  def getWindow(self, user_id):
+    """Return the window of a user
+
+    @param user_id [int] the id of the user
+    @return [tuple] the (start, stop) timestamps, each one can be None
+    """
+    return self.__d_window.get(user_id, (None, None))
+
+  def update(self, l_user, now=None):
+    """Compile the windows of a user list
+
+    @param l_user [list<User>] the current list of users
+    @param now [float] OPTIONNAL : the current UNIX time
+    """
+    if now is None:
+      now = time.time()
+    d_window = dict()
+    d_state = dict()
+    l_boundary = []
+    for user in l_user:
+      start = parseAccessTime(user.start_time)
+      stop = parseAccessTime(user.stop_time)
+      if start is None and stop is None:
+        continue
+      d_window[user.id] = (start, stop)
+      d_state[user.id] = self.__stateAt(start, stop, now)
+      if start is not None and start > now:
+        l_boundary.append((start, user.id, self.__stateAt(start, stop, start)))
+      if stop is not None and stop > now:
+        l_boundary.append((stop, user.id, self.STATE_STOPPED))
+    l_boundary.sort()
+    with self.__lock:
+      self.__d_window = d_window
+      self.__d_state = d_state
+      self.__l_boundary = l_boundary
+      self.__position = 0
+      self.__next_time = l_boundary[0][0] if l_boundary else float('inf')
+
+  def __stateAt(self, start, stop, now):
+    """Compute the state of a window at a time
+
+    @param start [float] the start timestamp or None
+    @param stop [float] the stop timestamp or None
+    @param now [float] the UNIX time
+    @return [str] the state, see constants above
+    """
+    if stop is not None and now >= stop:
+      return self.STATE_STOPPED
+    if start is not None and now < start:
+      return self.STATE_NOT_STARTED
+    return self.STATE_ALLOWED
+
+  def advance(self, now=None):
+    """Apply the boundaries which have been reached
+
+    @param now [float] OPTIONNAL : the current UNIX time
+    @return [list<tuple>] the (user_id, state) changes in time order
+    """
+    if now is None:
+      now = time.time()
+    l_change = []
+    with self.__lock:
+      if now < self.__next_time:
+        return l_change
+      l_boundary = self.__l_boundary
+      end = bisect.bisect_right(l_boundary, (now, float('inf')))
+      if end <= self.__position:
+        return l_change
+      d_state = dict(self.__d_state)
+      for (t, user_id, state) in l_boundary[self.__position:end]:
+        if d_state.get(user_id) != state:
+          d_state[user_id] = state
+          l_change.append((user_id, state))
+      self.__position = end
+      self.__d_state = d_state
+      if end < len(l_boundary):
+        self.__next_time = l_boundary[end][0]
+      else:
+        self.__next_time = float('inf')
+    for (user_id, state) in l_change:
+      g_sys_log.debug("Access window of user %s : %s", user_id,
+                      'opened' if state is self.STATE_ALLOWED else state)
+    return l_change
+
+  def check(self, user_id, now=None):
+    """Check if a user is inside its access window
+
+    @param user_id [int] the id of the user
+    @param now [float] OPTIONNAL : the current UNIX time
+    @return [str] None if the user is allowed, the state otherwise
+    """
+    if now is None:
+      now = time.time()
+    if now >= self.__next_time:
+      self.advance(now)
+    return self.__d_state.get(user_id)
+
+  def isAllowed(self, user_id, now=None):
+    """Check if a user is allowed now
+
+    @param user_id [int] the id of the user
+    @param now [float] OPTIONNAL : the current UNIX time
+    @return [bool] True if the user is inside its access window
+    """
+    return self.check(user_id, now) is None
@@ -108,6 +108,71 @@ class Adapter(object):
     """
     raise NotImplementedError("getUserList")
 
+  def getCertificateSnapshot(self):
+    """Return the list of all certificates with their owners
+
+    This is a bulk read used to compare the storage with the certificate
+    files, each row is a dict with keys : id, hostname_id, user_id,
+    certificate_begin_time, certificate_end_time, revoked_time and
+    revoked_reason
+    @return [list<dict>] the list of all certificates rows
+            [None] if the database query fail
+    """
+    raise NotImplementedError("getCertificateSnapshot")
+
+  def getRevokedCertificateList(self, since=None):
+    """Return the list of revoked certificates
+
+    This default implementation filter the certificate snapshot, overload it
+    if your storage can select only the revoked certificates
+    @param since [datetime] OPTIONNAL : if set, only return certificates
+          revoked at or after this time
+    @return [list<dict>] the list of rows with keys id, revoked_time,
+          revoked_reason and certificate_end_time
+            [None] if the database query fail
+    """
+    l_row = self.getCertificateSnapshot()
+    if l_row is None:
+      return None
+    return [{'id': row['id'], 'revoked_time': row['revoked_time'],
+             'revoked_reason': row['revoked_reason'],
+             'certificate_end_time': row['certificate_end_time']}
+            for row in l_row
+            if (row['revoked_time'] is not None and
+                (since is None or row['revoked_time'] >= since))]
+
+  def rollupConnectionLog(self, start, end):
+    """Aggregate the connection log into hourly and daily summaries
+
+    The hourly summaries of the events between start and end are computed
+    again, then the daily summaries of the days which contain them. This
+    must be idempotent.
+    @param start [datetime] the first hour to aggregate
+    @param end [datetime] the end of the last hour to aggregate, excluded
+    @return [bool] True if the summaries have been written
+    """
+    raise NotImplementedError("rollupConnectionLog")
+
+  def maintainConnectionLogPartitions(self, oldest_month, newest_month):
+    """Create and drop the monthly partitions of the connection log
+
+    The partitions of the months before oldest_month are removed as a whole
+    and the ones until newest_month are created if missing
+    @param oldest_month [date] the first day of the oldest month to keep
+    @param newest_month [date] the first day of the last month to prepare
+    @return [bool] True if the partitions are up to date
+    """
+    raise NotImplementedError("maintainConnectionLogPartitions")
+
+  def purgeConnectionSummary(self, resolution, before):
+    """Remove the old summaries of a resolution
+
+    @param resolution [str] the resolution of summaries, 'hour' or 'day'
+    @param before [datetime] the summaries which start before are removed
+    @return [bool] True if the summaries have been removed
+    """
+    raise NotImplementedError("purgeConnectionSummary")
+
   def processUpdate(self, request):
     """Treat an update request
 
@@ -129,3 +194,46 @@ class Adapter(object):
           False if not
     """
     raise NotImplementedError("processInsert")
+
+  def reserveSerialRange(self, count):
+    """Reserve a range of consecutive certificate serial numbers
+
+    The range must start after all existing certificate ids and must never
+    be given again
+    @param count [int] the number of serial to reserve, if zero return the
+          first available serial without reserve it
+    @return [int] the first serial of the reserved range
+            [None] if the reservation fail
+    """
+    raise NotImplementedError("reserveSerialRange")
+
+  def getLastCertificateId(self):
+    """Return the greatest existing certificate id
+
+    This default implementation reads the whole certificate snapshot,
+    overload it if your storage can compute it directly
+    @return [int] the greatest certificate id, zero if there is none
+            [None] if the query fail
+    """
+    l_row = self.getCertificateSnapshot()
+    if l_row is None:
+      return None
+    return max([int(row['id']) for row in l_row], default=0)
+
+  def processInsertList(self, l_ins):
+    """Treat a list of insert requests which concern the same model
+
+    This default implementation process each insert one by one, overload it
+    if your storage support multiple rows insert. As the callers write the
+    whole list again after a failure, an overload should insert all rows or
+    none of them
+    @param l_ins [list<Database.DbInsert>] the list of insert
+    @return [bool] : the result of the operation
+          True if all inserts success
+          False if at least one of them fail
+    """
+    result = True
+    for ins in l_ins:
+      if not self.processInsert(ins):
+        result = False
+    return result
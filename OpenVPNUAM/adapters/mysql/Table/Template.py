@@ -32,6 +32,9 @@ class Table(object):
   primary = None
   foreign = None
   column_options = dict()
+  # the optional columns which are absent from the database schema, they are
+  # ignored by all queries
+  missing_columns = frozenset()
 
   COL_QUOTE = '`'
 
@@ -102,8 +105,32 @@ class Table(object):
   @classmethod
   def getColumnOptions(cls):
     """Return the column options of this class
+
+    The missing optional columns are not returned
+    """
+    if not cls.missing_columns:
+      return cls.column_options
+    return dict([(key, opts) for (key, opts) in cls.column_options.items()
+                 if key not in cls.missing_columns])
+
+  @classmethod
+  def getOptionalColumns(cls):
+    """Return the columns which can be absent from the database schema
+
+    These columns are added by schema upgrades and have the 'optional'
+    keyword set in their options
+    @return [list<str>] the names of the optional columns
+    """
+    return [key for (key, opts) in cls.column_options.items()
+            if opts.get('optional', False)]
+
+  @classmethod
+  def setMissingColumns(cls, l_col):
+    """Register the optional columns which are absent from the database
+
+    @param l_col [list<str>] the names of the missing columns
     """
-    return cls.column_options
+    cls.missing_columns = frozenset(l_col)
 
   @classmethod
   def getSelectColumns(cls, sep=","):
@@ -117,16 +144,17 @@ class Table(object):
     @param sep [str] : the field separator
     """
     str_col = ''
+    column_options = cls.getColumnOptions()
 
-    for key in cls.column_options:
+    for key in column_options:
       # if hide keyword is set => don't return this column in SELECT
-      if 'hide' in cls.column_options[key] and cls.column_options[key]['hide']:
+      if 'hide' in column_options[key] and column_options[key]['hide']:
         continue
 
       # if rename keyword is set => alias the column in SELECT
-      if 'rename' in cls.column_options[key]:
+      if 'rename' in column_options[key]:
         key = (cls.COL_QUOTE + key + cls.COL_QUOTE + " AS " + cls.COL_QUOTE +
-               cls.column_options[key]['rename'] + cls.COL_QUOTE)
+               column_options[key]['rename'] + cls.COL_QUOTE)
       else:
         key = cls.COL_QUOTE + key + cls.COL_QUOTE
 
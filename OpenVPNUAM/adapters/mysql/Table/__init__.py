@@ -24,4 +24,8 @@
 
 from .user import *
 from .hostname import *
-from .user_certificate import *
\ No newline at end of file
+from .user_certificate import *
+from .serial_sequence import *
+from .connection_log import *
+from .connection_summary import *
+from .bandwidth_sample import *
@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""This file contains the description of Bandwidth Sample table
+
+  CREATE TABLE `bandwidth_sample` (
+    `id_bandwidth_sample` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `fk_hostname_id` INT UNSIGNED NULL,
+    `common_name` VARCHAR(255) NOT NULL,
+    `period_start` DATETIME NOT NULL,
+    `resolution` INT UNSIGNED NOT NULL,
+    `bytes_received` BIGINT UNSIGNED NOT NULL,
+    `bytes_sent` BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (`id_bandwidth_sample`),
+    KEY (`period_start`, `fk_hostname_id`),
+    KEY (`fk_hostname_id`, `period_start`)
+  );
+"""
+
+# Project imports
+from .Template import Table
+
+
+class TableBandwidthSample(Table):
+  table = 'bandwidth_sample'
+  primary = 'id_bandwidth_sample'
+  foreign = 'fk_hostname_id'
+  column_options = {'id_bandwidth_sample': {'type': int, 'rename': 'id'},
+                    'fk_hostname_id': {'type': int, 'hide': True},
+                    'common_name': {'type': str},
+                    'period_start': {'type': str},
+                    'resolution': {'type': int},
+                    'bytes_received': {'type': int},
+                    'bytes_sent': {'type': int},
+                    }
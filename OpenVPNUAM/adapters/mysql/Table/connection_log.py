@@ -0,0 +1,66 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""This file contains the description of Connection Log table
+
+The table is partitioned by month on the event time, so old events are
+removed by dropping whole partitions. The partitions of the coming months
+are created by the adapter from the catch-all 'pmax' partition.
+  CREATE TABLE `connection_log` (
+    `id_connection_log` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+    `fk_hostname_id` INT UNSIGNED NULL,
+    `event` VARCHAR(16) NOT NULL,
+    `common_name` VARCHAR(255) NOT NULL,
+    `real_address` VARCHAR(64) NULL,
+    `virtual_address` VARCHAR(64) NULL,
+    `bytes_received` BIGINT UNSIGNED NULL,
+    `bytes_sent` BIGINT UNSIGNED NULL,
+    `event_time` DATETIME NOT NULL,
+    PRIMARY KEY (`id_connection_log`, `event_time`),
+    KEY (`fk_hostname_id`, `event_time`)
+  )
+  PARTITION BY RANGE (TO_DAYS(`event_time`)) (
+    PARTITION `pmax` VALUES LESS THAN MAXVALUE
+  );
+"""
+
+# Project imports
+from .Template import Table
+
+
+class TableConnectionLog(Table):
+  table = 'connection_log'
+  primary = 'id_connection_log'
+  foreign = 'fk_hostname_id'
+  column_options = {'id_connection_log': {'type': int, 'rename': 'id'},
+                    'fk_hostname_id': {'type': int, 'hide': True},
+                    'event': {'type': str},
+                    'common_name': {'type': str},
+                    'real_address': {'type': str},
+                    'virtual_address': {'type': str},
+                    'bytes_received': {'type': int},
+                    'bytes_sent': {'type': int},
+                    'event_time': {'type': str},
+                    }
@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""This file contains the description of Connection Summary table
+
+This table holds the hourly and daily aggregates of the connection log by
+user, it is filled by the rollup of the connection log :
+  CREATE TABLE `connection_summary` (
+    `resolution` ENUM('hour', 'day') NOT NULL,
+    `period_start` DATETIME NOT NULL,
+    `fk_user_id` INT UNSIGNED NOT NULL,
+    `connections` INT UNSIGNED NOT NULL,
+    `disconnections` INT UNSIGNED NOT NULL,
+    `bytes_received` BIGINT UNSIGNED NOT NULL,
+    `bytes_sent` BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (`resolution`, `period_start`, `fk_user_id`),
+    KEY (`fk_user_id`, `resolution`, `period_start`)
+  );
+"""
+
+# Project imports
+from .Template import Table
+
+
+class TableConnectionSummary(Table):
+  table = 'connection_summary'
+  foreign = 'fk_user_id'
+  column_options = {'resolution': {'type': str},
+                    'period_start': {'type': str},
+                    'fk_user_id': {'type': int},
+                    'connections': {'type': int},
+                    'disconnections': {'type': int},
+                    'bytes_received': {'type': int},
+                    'bytes_sent': {'type': int},
+                    }
@@ -22,6 +22,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+"""This file contains the description of Hostname table
+
+The key_type column stores the private key type of each hostname. On a
+database created before it, the column is ignored and all hostnames use the
+configured key type until it is created with :
+  ALTER TABLE `hostname` ADD `key_type` VARCHAR(16) NULL;
+"""
+
 # Project imports
 from .Template import Table
 
@@ -34,6 +42,7 @@ class TableHostname(Table):
                     'fk_user_id': {'type': int, 'hide': True},
                     'hostname': {'type': str, 'rename': 'name'},
                     'period_days': {'type': int},
+                    'key_type': {'type': str, 'optional': True},
                     'is_enabled': {'type': bool},
                     'creation_time': {'type': str},
                     'update_time': {'type': str},
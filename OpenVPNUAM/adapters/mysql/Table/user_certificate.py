@@ -22,7 +22,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-"""This file contains the description of User table"""
+"""This file contains the description of User table
+
+The key_creation_time column stores the creation time of the private key of
+each certificate, a renewal can only re-sign a key whose creation time is
+known. On a database created before it, the column is ignored and renewals
+always build a new key until it is created with :
+  ALTER TABLE `user_certificate` ADD `key_creation_time` DATETIME NULL;
+"""
 
 # Project imports
 from .Template import Table
@@ -39,4 +46,5 @@ class TableUserCertificate(Table):
                     'revoked_time': {'type': str},
                     'certificate_begin_time': {'type': str},
                     'certificate_end_time': {'type': str},
+                    'key_creation_time': {'type': str, 'optional': True},
                     }
\ No newline at end of file
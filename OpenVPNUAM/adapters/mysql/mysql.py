@@ -43,6 +43,7 @@ parameter as the initial connection and will restart to return data
 """
 
 # System import
+import datetime
 import logging
 import time
 
@@ -67,6 +68,8 @@ class Connector(Adapter):
   the database
   """
   CONNECTION_ERROR_CODE = [MySQLdb.constants.CR.CONNECTION_ERROR]
+  # maximum number of rows sent in a single multiple rows insert
+  INSERT_CHUNK_SIZE = 500
 
   def __init__(self):
     """Build a new non-initialised mysql adapter"""
@@ -79,6 +82,9 @@ class Connector(Adapter):
     self.__connection_wait_ref = 0.0
     # default parameter to use during database opening
     self.__param = dict(charset='utf8mb4')
+    # the gap between two auto increment values of a multiple rows insert
+    # None if the server does not guarantee consecutive values
+    self.__autoinc_increment = None
 
   def load(self, config):
     """Load the MySQL settings and check it
@@ -139,6 +145,8 @@ class Connector(Adapter):
       # update the reference time by now
       try:
         self.__connection = MySQLdb.connect(**self.__param)
+        self.__checkOptionalColumns()
+        self.__checkAutoIncrement()
         return True
       except MySQLdb.MySQLError as e:
         # initialise the timer to prevent to attack server with new
@@ -171,6 +179,52 @@ class Connector(Adapter):
       self.__connection = None
       return False
 
+  def __checkOptionalColumns(self):
+    """Look for the optional columns which are absent from the schema
+
+    The columns added by schema upgrades are ignored by all queries until
+    they are created, with a warning at each connection
+    """
+    for model in [TableUser, TableHostname, TableUserCertificate]:
+      l_col = model.getOptionalColumns()
+      if len(l_col) == 0:
+        continue
+      cur = self.__queryDict(
+          'SELECT `COLUMN_NAME` AS `name`' +
+          ' FROM `information_schema`.`COLUMNS`' +
+          ' WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s',
+          (model.getName(False),))
+      if cur is None:
+        continue
+      s_present = set([row['name'] for row in cur])
+      cur.close()
+      l_missing = [col for col in l_col if col not in s_present]
+      for col in l_missing:
+        g_sys_log.warning("Column '%s' is missing from table '%s', it is " +
+                          "ignored until the schema is upgraded",
+                          col, model.getName(False))
+      model.setMissingColumns(l_missing)
+
+  def __checkAutoIncrement(self):
+    """Look if multiple rows inserts receive consecutive auto increment values
+
+    With the interleaved lock mode, concurrent inserts can take values in the
+    middle of a multiple rows insert
+    """
+    self.__autoinc_increment = None
+    cur = self.__queryDict(
+        'SELECT @@auto_increment_increment AS `increment`' +
+        ', @@innodb_autoinc_lock_mode AS `lock_mode`')
+    if cur is None:
+      return
+    row = cur.fetchone()
+    cur.close()
+    if int(row['lock_mode']) == 2:
+      g_sys_log.warning("The InnoDB auto increment lock mode is interleaved," +
+                        " rows without id are inserted one by one")
+      return
+    self.__autoinc_increment = int(row['increment'])
+
   def __queryHelper(self, cursor, query, args=None):
     """Execute a basic query on the given cursor
 
@@ -298,6 +352,10 @@ class Connector(Adapter):
       return TableHostname
     elif req.source_type == 'Certificate':
       return TableUserCertificate
+    elif req.source_type == 'ConnectionLog':
+      return TableConnectionLog
+    elif req.source_type == 'BandwidthSample':
+      return TableBandwidthSample
     else:
       req.is_error = True
       req.error_msg = "Not implemented source request"
@@ -406,6 +464,204 @@ class Connector(Adapter):
     cur.close()
     return l_cert
 
+  def getCertificateSnapshot(self):
+    """Query the database to retrieve all certificates with their owners
+
+    @return [list<dict>] the list of all certificates rows
+            [None] if the database query fail
+    """
+    cur = self.__queryDict(
+        'SELECT c.' + TableUserCertificate.getPrimary() + ' AS id' +
+        ', c.' + TableUserCertificate.getForeign() + ' AS hostname_id' +
+        ', h.' + TableHostname.getForeign() + ' AS user_id' +
+        ', c.`certificate_begin_time`, c.`certificate_end_time`' +
+        ', c.`revoked_time`, c.`revoked_reason`' +
+        ' FROM ' + TableUserCertificate.getName() + ' c' +
+        ' JOIN ' + TableHostname.getName() + ' h' +
+        ' ON c.' + TableUserCertificate.getForeign() +
+        ' = h.' + TableHostname.getPrimary())
+    if cur is None:
+      return None
+    l_row = list(cur)
+    cur.close()
+    # Commit to prevent MySQL isolation
+    self.__connection.commit()
+    return l_row
+
+  def getRevokedCertificateList(self, since=None):
+    """Query the database to retrieve the revoked certificates
+
+    @param since [datetime] OPTIONNAL : if set, only return certificates
+          revoked at or after this time
+    @return [list<dict>] the list of rows with keys id, revoked_time,
+          revoked_reason and certificate_end_time
+            [None] if the database query fail
+    """
+    query = ('SELECT ' + TableUserCertificate.getPrimary() + ' AS id' +
+             ', `revoked_time`, `revoked_reason`, `certificate_end_time`' +
+             ' FROM ' + TableUserCertificate.getName() +
+             ' WHERE `revoked_time` IS NOT NULL')
+    args = None
+    if since is not None:
+      query += ' AND `revoked_time` >= %s'
+      args = (since,)
+    cur = self.__queryDict(query, args)
+    if cur is None:
+      return None
+    l_row = list(cur)
+    cur.close()
+    # Commit to prevent MySQL isolation
+    self.__connection.commit()
+    return l_row
+
+  def rollupConnectionLog(self, start, end):
+    """Aggregate the connection log into hourly and daily summaries
+
+    The summaries are computed by the server with INSERT ... SELECT queries,
+    the existing rows of the same periods are replaced
+    @param start [datetime] the first hour to aggregate
+    @param end [datetime] the end of the last hour to aggregate, excluded
+    @return [bool] True if the summaries have been written
+    """
+    summary = TableConnectionSummary
+    l_col = ['resolution', 'period_start', 'fk_user_id', 'connections',
+             'disconnections', 'bytes_received', 'bytes_sent']
+    insert = ('INSERT INTO ' + summary.getName() +
+              ' (' + ', '.join([summary.quote(c) for c in l_col]) + ') ')
+    update = (' ON DUPLICATE KEY UPDATE ' +
+              ', '.join([summary.quote(c) + ' = VALUES(' + summary.quote(c) +
+                         ')' for c in l_col[3:]]))
+    hour = ('TIMESTAMP(DATE(c.`event_time`),' +
+            ' MAKETIME(HOUR(c.`event_time`), 0, 0))')
+    l_query = [
+        (insert +
+         'SELECT \'hour\', ' + hour + ' AS `period`' +
+         ', h.' + TableHostname.getForeign() +
+         ', SUM(c.`event` = \'connect\'), SUM(c.`event` = \'disconnect\')' +
+         ', COALESCE(SUM(c.`bytes_received`), 0)' +
+         ', COALESCE(SUM(c.`bytes_sent`), 0)' +
+         ' FROM ' + TableConnectionLog.getName() + ' c' +
+         ' JOIN ' + TableHostname.getName() + ' h' +
+         ' ON c.' + TableConnectionLog.getForeign() +
+         ' = h.' + TableHostname.getPrimary() +
+         ' WHERE c.`event_time` >= %s AND c.`event_time` < %s' +
+         ' GROUP BY `period`, h.' + TableHostname.getForeign() + update,
+         (start, end)),
+        (insert +
+         'SELECT \'day\', DATE(`period_start`) AS `period`, `fk_user_id`' +
+         ', SUM(`connections`), SUM(`disconnections`)' +
+         ', SUM(`bytes_received`), SUM(`bytes_sent`)' +
+         ' FROM ' + summary.getName() +
+         ' WHERE `resolution` = \'hour\'' +
+         ' AND `period_start` >= %s AND `period_start` < %s' +
+         ' GROUP BY `period`, `fk_user_id`' + update,
+         (datetime.datetime.combine(start.date(), datetime.time()),
+          datetime.datetime.combine(end.date(), datetime.time()) +
+          datetime.timedelta(days=1))),
+    ]
+    for (query, args) in l_query:
+      cur = self.__queryDict(query, args)
+      if cur is None:
+        if self.__connection:
+          self.__connection.rollback()
+        return False
+      cur.close()
+    # Commit to validate modification
+    self.__connection.commit()
+    return True
+
+  def maintainConnectionLogPartitions(self, oldest_month, newest_month):
+    """Create and drop the monthly partitions of the connection log
+
+    Partitions are named pYYYYMM and hold the events of their month, the
+    new ones are split from the empty 'pmax' partition
+    @param oldest_month [date] the first day of the oldest month to keep
+    @param newest_month [date] the first day of the last month to prepare
+    @return [bool] True if the partitions are up to date
+    """
+    cur = self.__queryDict(
+        'SELECT `PARTITION_NAME` AS `name`' +
+        ' FROM `information_schema`.`PARTITIONS`' +
+        ' WHERE `TABLE_SCHEMA` = DATABASE() AND `TABLE_NAME` = %s' +
+        ' AND `PARTITION_NAME` IS NOT NULL',
+        (TableConnectionLog.getName(False),))
+    if cur is None:
+      return False
+    l_name = [row['name'] for row in cur]
+    cur.close()
+    if 'pmax' not in l_name:
+      g_sys_log.error("Table %s is not partitioned by month",
+                      TableConnectionLog.getName())
+      return False
+    l_month = sorted([datetime.date(int(n[1:5]), int(n[5:7]), 1)
+                      for n in l_name if len(n) == 7 and n[1:].isdigit()])
+
+    # split the catch-all partition for each missing month
+    l_partition = []
+    month = datetime.date.today().replace(day=1)
+    if len(l_month) > 0:
+      month = max(month, self.__nextMonth(l_month[-1]))
+    while month <= newest_month:
+      l_partition.append(
+          'PARTITION `p' + month.strftime('%Y%m') + '` VALUES LESS THAN' +
+          ' (TO_DAYS(\'' + self.__nextMonth(month).isoformat() + '\'))')
+      month = self.__nextMonth(month)
+    if len(l_partition) > 0:
+      cur = self.__queryDict(
+          'ALTER TABLE ' + TableConnectionLog.getName() +
+          ' REORGANIZE PARTITION `pmax` INTO (' + ', '.join(l_partition) +
+          ', PARTITION `pmax` VALUES LESS THAN MAXVALUE)')
+      if cur is None:
+        return False
+      cur.close()
+      g_sys_log.info("%d partitions added to %s", len(l_partition),
+                     TableConnectionLog.getName())
+
+    # drop whole partitions instead of deleting their rows
+    l_old = ['`p' + m.strftime('%Y%m') + '`' for m in l_month
+             if m < oldest_month]
+    if len(l_old) > 0:
+      cur = self.__queryDict(
+          'ALTER TABLE ' + TableConnectionLog.getName() +
+          ' DROP PARTITION ' + ', '.join(l_old))
+      if cur is None:
+        return False
+      cur.close()
+      g_sys_log.info("%d partitions dropped from %s", len(l_old),
+                     TableConnectionLog.getName())
+    return True
+
+  def purgeConnectionSummary(self, resolution, before):
+    """Remove the old summaries of a resolution
+
+    @param resolution [str] the resolution of summaries, 'hour' or 'day'
+    @param before [datetime] the summaries which start before are removed
+    @return [bool] True if the summaries have been removed
+    """
+    cur = self.__queryDict(
+        'DELETE FROM ' + TableConnectionSummary.getName() +
+        ' WHERE `resolution` = %s AND `period_start` < %s',
+        (resolution, before))
+    if cur is None:
+      if self.__connection:
+        self.__connection.rollback()
+      return False
+    cur.close()
+    # Commit to validate modification
+    self.__connection.commit()
+    return True
+
+  @staticmethod
+  def __nextMonth(month):
+    """Return the first day of the month after the given one
+
+    @param month [date] the first day of a month
+    @return [date] the first day of the next month
+    """
+    if month.month == 12:
+      return datetime.date(month.year + 1, 1, 1)
+    return datetime.date(month.year, month.month + 1, 1)
+
   def processUpdate(self, up):
     """Treat an update request
 
@@ -485,7 +741,7 @@ class Connector(Adapter):
         name = cols_opts[col]['rename']
       if hasattr(ins.source, name):
         if getattr(ins.source, name) is not None:
-          heads_col += " " + name
+          heads_col += " " + col
           heads_val += " %(" + name + ")s"
           values[name] = getattr(ins.source, name)
     # treat an optionnal foreign key
@@ -513,4 +769,208 @@ class Connector(Adapter):
     cur.close()
     # Commit to validate modification
     self.__connection.commit()
-    return True
\ No newline at end of file
+    return True
+
+  def reserveSerialRange(self, count):
+    """Reserve a range of consecutive certificate serial numbers
+
+    The next available serial is stored into the sequence table, it is never
+    lower than the greatest existing certificate id plus one
+    @param count [int] the number of serial to reserve
+    @return [int] the first serial of the reserved range
+            [None] if the reservation fail
+    """
+    col = TableSerialSequence.quote('next_serial')
+    cur = self.__queryDict(
+        'UPDATE ' + TableSerialSequence.getName() +
+        ' SET ' + col + ' = LAST_INSERT_ID(GREATEST(' + col + ',' +
+        ' (SELECT COALESCE(MAX(' + TableUserCertificate.getPrimary() + '), 0)' +
+        ' + 1 FROM ' + TableUserCertificate.getName() + ')) + %s)',
+        (count,))
+    # check MySQL error
+    if cur is None:
+      if self.__connection:
+        self.__connection.rollback()
+      return None
+    cur.close()
+    cur = self.__queryDict('SELECT LAST_INSERT_ID() AS `next_serial`')
+    if cur is None:
+      if self.__connection:
+        self.__connection.rollback()
+      return None
+    next_serial = int(cur.fetchone()['next_serial'])
+    cur.close()
+    # Commit to validate modification
+    self.__connection.commit()
+    return next_serial - count
+
+  def getLastCertificateId(self):
+    """Return the greatest existing certificate id
+
+    @return [int] the greatest certificate id, zero if there is none
+            [None] if the query fail
+    """
+    cur = self.__queryDict(
+        'SELECT COALESCE(MAX(' + TableUserCertificate.getPrimary() + '), 0)' +
+        ' AS `last_id` FROM ' + TableUserCertificate.getName())
+    if cur is None:
+      return None
+    last_id = int(cur.fetchone()['last_id'])
+    cur.close()
+    # Commit to prevent MySQL isolation
+    self.__connection.commit()
+    return last_id
+
+  def processInsertList(self, l_ins):
+    """Treat a list of insert requests with multiple rows inserts
+
+    All requests must concern the same model. Rows are grouped by the set of
+    columns they define, so an unset column always receives its DEFAULT
+    value, then each group is sent by chunk of INSERT_CHUNK_SIZE rows in a
+    single transaction.
+    Rows with a preset identifier, like reserved serials, are always sent by
+    multiple rows inserts. The identifiers of the other rows are computed from
+    the first one returned by the server only when the server gives
+    consecutive auto increment values, otherwise these rows are inserted one
+    by one
+    @param l_ins [list<Database.DbInsert>] the list of insert
+    @return [bool] : the result of the operation
+          True if all inserts success
+          False if not, in this case none of the rows are inserted
+    """
+    if len(l_ins) == 0:
+      return True
+    model = Connector.extractModelFromRequest(l_ins[0])
+    if not model:
+      return False
+    assert model is not None
+
+    # group the rows by the list of columns they set
+    d_group = dict()
+    cols_opts = model.getColumnOptions()
+    for ins in l_ins:
+      assert ins.source_type == l_ins[0].source_type
+      l_col = []
+      for col in cols_opts:
+        name = col
+        if 'rename' in cols_opts[col]:
+          name = cols_opts[col]['rename']
+        if getattr(ins.source, name, None) is not None:
+          l_col.append((col, name))
+      key = (tuple(l_col), ins.parent is not None)
+      d_group.setdefault(key, []).append(ins)
+
+    l_result = []
+    for ((l_col, with_parent), l_group) in d_group.items():
+      chunk_size = self.INSERT_CHUNK_SIZE
+      # without a preset id, each row id must be read back from the server
+      if (l_group[0].source.id is None and
+          self.__autoinc_increment is None):
+        chunk_size = 1
+      for i in range(0, len(l_group), chunk_size):
+        chunk = l_group[i:i + chunk_size]
+        l_id = self.__insertRows(model, l_col, with_parent, chunk)
+        if l_id is None:
+          if self.__connection:
+            self.__connection.rollback()
+          return False
+        l_result.extend(zip(chunk, l_id))
+    # Commit to validate modification
+    self.__connection.commit()
+
+    for (ins, id_) in l_result:
+      if ins.source.id is None:
+        ins.source.id = id_
+    return True
+
+  def __insertRows(self, model, l_col, with_parent, l_ins):
+    """Insert rows which set the same columns with a single query
+
+    The transaction is neither committed nor rolled back
+    @param model [Table] the model of the rows
+    @param l_col [list<tuple>] the pairs of column and attribute names
+    @param with_parent [bool] if the rows have a foreign key to their parent
+    @param l_ins [list<Database.DbInsert>] the list of insert
+    @return [list<int>] the auto increment identifiers of the rows
+            [None] if the query fail
+    """
+    heads_col = [model.quote(col) for (col, name) in l_col]
+    if with_parent:
+      heads_col.append(model.getForeign())
+    row = "(" + ", ".join(["%s"] * len(heads_col)) + ")"
+    values = []
+    for ins in l_ins:
+      for (col, name) in l_col:
+        values.append(getattr(ins.source, name))
+      if with_parent:
+        values.append(ins.parent.id)
+
+    # EXECUTE INSERT QUERY
+    cur = self.__queryDict(
+        'INSERT INTO ' + model.getName() +
+        " (" + ", ".join(heads_col) + ")" +
+        " VALUES " + ", ".join([row] * len(l_ins)),
+        tuple(values))
+    # check MySQL error
+    if cur is None:
+      return None
+    # a multiple rows insert receives consecutive auto increment values
+    increment = self.__autoinc_increment or 1
+    l_id = [cur.lastrowid + j * increment for j in range(len(l_ins))]
+    cur.close()
+    return l_id
+    model = Connector.extractModelFromRequest(l_ins[0])
+    if not model:
+      return False
+    assert model is not None
+
+    # use each column which is set in at least one of the source object
+    l_col = []
+    cols_opts = model.getColumnOptions()
+    for col in cols_opts:
+      name = col
+      if 'rename' in cols_opts[col]:
+        name = cols_opts[col]['rename']
+      for ins in l_ins:
+        if getattr(ins.source, name, None) is not None:
+          l_col.append((col, name))
+          break
+    heads_col = [model.quote(col) for (col, name) in l_col]
+    # treat an optionnal foreign key
+    with_parent = any([ins.parent is not None for ins in l_ins])
+    if with_parent:
+      heads_col.append(model.getForeign())
+    row = "(" + ", ".join(["%s"] * len(heads_col)) + ")"
+
+    l_id = []
+    for i in range(0, len(l_ins), self.INSERT_CHUNK_SIZE):
+      chunk = l_ins[i:i + self.INSERT_CHUNK_SIZE]
+      values = []
+      for ins in chunk:
+        assert ins.source_type == l_ins[0].source_type
+        for (col, name) in l_col:
+          values.append(getattr(ins.source, name, None))
+        if with_parent:
+          values.append(ins.parent.id if ins.parent is not None else None)
+
+      # EXECUTE INSERT QUERY
+      cur = self.__queryDict(
+          'INSERT INTO ' + model.getName() +
+          " (" + ", ".join(heads_col) + ")" +
+          " VALUES " + ", ".join([row] * len(chunk)),
+          tuple(values))
+      # check MySQL error
+      if cur is None:
+        if self.__connection:
+          self.__connection.rollback()
+        return False
+      for j in range(len(chunk)):
+        l_id.append(cur.lastrowid + j)
+      cur.close()
+    # Commit to validate modification
+    self.__connection.commit()
+
+    for (ins, id_) in zip(l_ins, l_id):
+      if ins.source.id is None:
+        ins.source.id = id_
+    return True
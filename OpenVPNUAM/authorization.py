@@ -0,0 +1,472 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Authorization
+
+This file contains the classes which answer the authorization requests of
+OpenVPN hooks. The daemon keeps an index of all common names built from
+its cached user list, and serves it on a UNIX socket with a line based
+protocol :
+  request  : AUTHORIZE <common_name> <serial>
+  response : ALLOW
+             DENY <reason>
+The hooks also report the connection events of clients :
+  request  : EVENT <kind> <common_name> <real_address> <virtual_address>
+                   <bytes_received> <bytes_sent>
+  response : OK
+where unknown values are given as '-'.
+Several requests can be sent over the same connection.
+
+The index can also be published as a binary snapshot file which hook
+processes map in memory and search without any request to the daemon.
+Snapshot format, little endian :
+  header : magic (8s), record count (I), record size (I), build time (q)
+  record : serial (Q), common name hash (Q), start time (q), stop time (q),
+           flags (B), padding (7x)
+Records are sorted by serial. The common name hash is the first 8 bytes of
+the SHA-1 of the common name, times are UNIX timestamps.
+"""
+
+# System imports
+import collections
+import hashlib
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+# Project imports
+from .access import AccessWindowIndex
+from .models import ConnectionLog
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.authorization')
+
+# The authorization state of a common name
+AuthorizationEntry = collections.namedtuple(
+    'AuthorizationEntry',
+    ['user_id', 'user_enabled', 'hostname_enabled', 'start_time', 'stop_time',
+     'serials'])
+
+
+class AuthorizationIndex(object):
+  """This class answers to authorization requests from the user list
+
+  The index is rebuilt after each poll of the database and replaced in a
+  single assignment, so readers never need any lock
+  """
+
+  # constants for deny reasons
+  DENY_UNKNOWN = 'unknown-common-name'
+  DENY_USER_DISABLED = 'user-disabled'
+  DENY_HOSTNAME_DISABLED = 'hostname-disabled'
+  DENY_NOT_STARTED = 'access-not-started'
+  DENY_STOPPED = 'access-stopped'
+  DENY_SERIAL = 'invalid-serial'
+  DENY_REVOKED = 'certificate-revoked'
+
+  def __init__(self):
+    """Constructor : Build an empty index
+    """
+    # the (entries by common name, set of revoked serials, access windows of
+    # users) published together, so a reader never mixes two updates
+    self.__state = (dict(), frozenset(), AccessWindowIndex())
+
+  def __len__(self):
+    """Return the number of known common names
+
+    @return [int] the number of entries
+    """
+    return len(self.__state[0])
+
+  def __iter__(self):
+    """Iterate over all entries
+
+    @return [iterator] the iterator over (common_name, AuthorizationEntry)
+    """
+    return iter(self.__state[0].items())
+
+  def update(self, l_user, revoked=None, windows=None):
+    """Rebuild the index from a user list
+
+    @param l_user [list<User>] the current list of users
+    @param revoked [RevokedSerialSet] OPTIONNAL : the set of revoked serials
+    @param windows [AccessWindowIndex] OPTIONNAL : the access windows of the
+                users, compiled from the user list if not given
+    """
+    if revoked is None:
+      revoked = self.__state[1]
+    if windows is None:
+      windows = AccessWindowIndex()
+      windows.update(l_user)
+    d_entry = dict()
+    for user in l_user:
+      for hostname in user.getHostnameList():
+        serials = frozenset(
+            [cert.id for cert in (hostname.getCertificateValidList() +
+                                  hostname.getCertificateSoonExpiredList())
+             if cert.revoked_time is None and cert.id not in revoked])
+        (start, stop) = windows.getWindow(user.id)
+        d_entry[user.cuid + "_" + hostname.name] = AuthorizationEntry(
+            user.id, bool(user.is_enabled), bool(hostname.is_enabled),
+            start, stop, serials)
+    self.__state = (d_entry, revoked, windows)
+    g_sys_log.debug("Authorization index rebuilt with %d common names",
+                    len(d_entry))
+
+  def authorize(self, common_name, serial=None, now=None):
+    """Decide if a client can connect now
+
+    @param common_name [str] the common name of the client certificate
+    @param serial [int] OPTIONNAL : the serial of the client certificate
+    @param now [float] OPTIONNAL : the UNIX time of the connection
+    @return [tuple] the (decision, reason) where reason is None if the
+                    client is allowed
+    """
+    (d_entry, revoked, windows) = self.__state
+    entry = d_entry.get(common_name)
+    if entry is None:
+      return (False, self.DENY_UNKNOWN)
+    if not entry.user_enabled:
+      return (False, self.DENY_USER_DISABLED)
+    if not entry.hostname_enabled:
+      return (False, self.DENY_HOSTNAME_DISABLED)
+    state = windows.check(entry.user_id, now)
+    if state is not None:
+      return (False, state)
+    if serial is not None and serial not in entry.serials:
+      if serial in revoked:
+        return (False, self.DENY_REVOKED)
+      return (False, self.DENY_SERIAL)
+    return (True, None)
+
+
+class AuthorizationSnapshot(object):
+  """This class publishes the authorization index as a binary file
+  """
+
+  MAGIC = b'UAMACL1\0'
+  HEADER = struct.Struct('<8sIIq')
+  RECORD = struct.Struct('<QQqqB7x')
+  # constants for record flags
+  FLAG_USER_ENABLED = 0x01
+  FLAG_HOSTNAME_ENABLED = 0x02
+  # the time bounds used when there is no start or stop time
+  TIME_MIN = -2 ** 63
+  TIME_MAX = 2 ** 63 - 1
+
+  def __init__(self, path, mode=0o644):
+    """Constructor : Build a new snapshot publisher
+
+    @param path [str] the path of the snapshot file
+    @param mode [int] OPTIONNAL : the permissions of the snapshot file
+    """
+    self.__path = path
+    self.__mode = mode
+
+  @staticmethod
+  def hashCommonName(common_name):
+    """Return the hash of a common name as stored into records
+
+    @param common_name [str] the common name
+    @return [int] the 64 bits hash
+    """
+    return struct.unpack('<Q', hashlib.sha1(common_name.encode()).digest()[:8])[0]
+
+  @staticmethod
+  def __toTimestamp(timestamp, default):
+    """Convert an optional UNIX time to a record time
+
+    @param timestamp [float] the UNIX time or None
+    @param default [int] the value to use if there is no time
+    @return [int] the timestamp
+    """
+    if timestamp is None:
+      return default
+    return int(timestamp)
+
+  def write(self, index):
+    """Replace atomically the snapshot file with the content of an index
+
+    @param index [AuthorizationIndex] the index to publish
+    @return [bool] True if the snapshot has been replaced
+    """
+    l_record = []
+    for (common_name, entry) in index:
+      cn_hash = self.hashCommonName(common_name)
+      flags = 0
+      if entry.user_enabled:
+        flags |= self.FLAG_USER_ENABLED
+      if entry.hostname_enabled:
+        flags |= self.FLAG_HOSTNAME_ENABLED
+      start = self.__toTimestamp(entry.start_time, self.TIME_MIN)
+      stop = self.__toTimestamp(entry.stop_time, self.TIME_MAX)
+      for serial in entry.serials:
+        l_record.append((serial, cn_hash, start, stop, flags))
+    l_record.sort()
+
+    buf = bytearray(self.HEADER.size + len(l_record) * self.RECORD.size)
+    self.HEADER.pack_into(buf, 0, self.MAGIC, len(l_record), self.RECORD.size,
+                          int(time.time()))
+    offset = self.HEADER.size
+    for record in l_record:
+      self.RECORD.pack_into(buf, offset, *record)
+      offset += self.RECORD.size
+    try:
+      with open(self.__path + '.tmp', 'wb') as f:
+        f.write(buf)
+        f.flush()
+        os.fsync(f.fileno())
+      os.chmod(self.__path + '.tmp', self.__mode)
+      # readers which have mapped the previous file keep it until they exit
+      os.rename(self.__path + '.tmp', self.__path)
+    except (IOError, OSError) as e:
+      g_sys_log.error("Unable to write authorization snapshot '%s' : %s",
+                      self.__path, str(e))
+      return False
+    return True
+
+
+class AuthorizationServer(object):
+  """This class serves the authorization index on a UNIX socket
+  """
+
+  def __init__(self, confparser, events=None):
+    """Constructor : Build a new authorization server
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    @param events [ConnectionLogBuffer] OPTIONNAL : the buffer which
+                receives the connection events reported by the hooks
+    """
+    self.__cp = confparser
+    self.__events = events
+    self.__index = AuthorizationIndex()
+    # the path of the UNIX socket, None if the server is disabled
+    self.__socket_path = None
+    # the permissions of the UNIX socket
+    self.__socket_mode = 0o660
+    # the publisher of the snapshot file, None if it is disabled
+    self.__snapshot = None
+    # number of seconds after which an unchanged snapshot is written again,
+    # so the hooks can detect a stopped daemon, and time of the last write
+    self.__acl_refresh_time = 60.0
+    self.__acl_write_time = 0.0
+    self.__server = None
+    self.__thread = None
+
+  @property
+  def index(self):
+    """Return the authorization index
+
+    @return [AuthorizationIndex] the index
+    """
+    return self.__index
+
+  @property
+  def enabled(self):
+    """Return the activation status of the server
+
+    @return [bool] True if the socket is served
+    """
+    return self.__socket_path is not None
+
+  def load(self):
+    """Load the server configuration
+
+    @return [bool] True if the configuration is valid
+    """
+    section = self.__cp.AUTHORIZATION_SECTION
+    if not self.__cp.has_section(section):
+      g_sys_log.info("No authorization section, authorization server" +
+                     " disabled")
+      return True
+    path = self.__cp.get(section, 'acl_file', fallback='')
+    if len(path) > 0:
+      try:
+        mode = int(self.__cp.get(section, 'acl_mode', fallback='644'), 8)
+      except ValueError:
+        g_sys_log.fatal("Option 'acl_mode' must be an octal number")
+        return False
+      self.__snapshot = AuthorizationSnapshot(path, mode)
+      self.__acl_refresh_time = self.__cp.getfloat(
+          section, 'acl_refresh_time', fallback=self.__acl_refresh_time)
+
+    path = self.__cp.get(section, 'socket', fallback='')
+    if len(path) == 0:
+      return True
+    self.__socket_path = path
+    try:
+      self.__socket_mode = int(self.__cp.get(section, 'socket_mode',
+                                             fallback='660'), 8)
+    except ValueError:
+      g_sys_log.fatal("Option 'socket_mode' must be an octal number")
+      return False
+    return True
+
+  def start(self):
+    """Open the socket and serve it from a background thread
+
+    @return [bool] True if the server is running
+    """
+    if not self.enabled or self.__server is not None:
+      return True
+    # remove the socket of a previous run
+    if os.path.exists(self.__socket_path):
+      try:
+        os.remove(self.__socket_path)
+      except OSError as e:
+        g_sys_log.error("Unable to remove old socket '%s' : %s",
+                        self.__socket_path, str(e))
+        return False
+    try:
+      self.__server = _AuthorizationSocketServer(self.__socket_path,
+                                                 self.__index,
+                                                 self.__events)
+      os.chmod(self.__socket_path, self.__socket_mode)
+    except OSError as e:
+      g_sys_log.error("Unable to listen on socket '%s' : %s",
+                      self.__socket_path, str(e))
+      self.__server = None
+      return False
+    self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                     name='authorization-server',
+                                     daemon=True)
+    self.__thread.start()
+    g_sys_log.info("Authorization server listening on '%s'",
+                   self.__socket_path)
+    return True
+
+  def stop(self):
+    """Stop the server and remove its socket
+    """
+    if self.__server is None:
+      return
+    self.__server.shutdown()
+    self.__server.server_close()
+    self.__thread.join()
+    self.__server = None
+    self.__thread = None
+    try:
+      os.remove(self.__socket_path)
+    except OSError:
+      pass
+
+  def update(self, l_user, revoked=None, windows=None):
+    """Rebuild the authorization index from a user list
+
+    The snapshot file is published again if it is enabled
+    @param l_user [list<User>] the current list of users
+    @param revoked [RevokedSerialSet] OPTIONNAL : the set of revoked serials
+    @param windows [AccessWindowIndex] OPTIONNAL : the access windows
+    """
+    self.__index.update(l_user, revoked, windows)
+    if self.__snapshot is not None:
+      self.__snapshot.write(self.__index)
+      self.__acl_write_time = time.time()
+
+  def refresh(self):
+    """Write the snapshot file again if it is older than the refresh time
+
+    The generation time of the snapshot is then updated even when the users
+    state does not change
+    """
+    if (self.__snapshot is not None and self.__acl_refresh_time > 0 and
+        time.time() - self.__acl_write_time >= self.__acl_refresh_time):
+      self.__snapshot.write(self.__index)
+      self.__acl_write_time = time.time()
+
+
+class _AuthorizationRequestHandler(socketserver.StreamRequestHandler):
+  """This class handles one client connection of the authorization socket
+  """
+
+  def handle(self):
+    """Answer to each request line until the client closes the connection
+    """
+    for line in self.rfile:
+      fields = line.decode('utf-8', 'replace').split()
+      if len(fields) == 7 and fields[0] == 'EVENT':
+        self.wfile.write(self.__handleEvent(fields[1:]))
+        continue
+      if len(fields) not in [2, 3] or fields[0] != 'AUTHORIZE':
+        self.wfile.write(b'ERROR invalid-request\n')
+        continue
+      serial = None
+      if len(fields) == 3:
+        try:
+          serial = int(fields[2])
+        except ValueError:
+          self.wfile.write(b'ERROR invalid-serial\n')
+          continue
+      (allowed, reason) = self.server.index.authorize(fields[1], serial)
+      if allowed:
+        self.wfile.write(b'ALLOW\n')
+      else:
+        g_sys_log.info("Deny connection of '%s' (%s) : %s",
+                       fields[1], serial, reason)
+        self.wfile.write(('DENY ' + reason + '\n').encode())
+      self.wfile.flush()
+
+  def __handleEvent(self, fields):
+    """Give a connection event to the events buffer
+
+    @param fields [list<str>] the fields of the request after EVENT
+    @return [bytes] the response line
+    """
+    if self.server.events is None:
+      return b'OK\n'
+    l_value = [None if value == '-' else value for value in fields]
+    for i in [4, 5]:
+      if l_value[i] is not None:
+        if not l_value[i].isdigit():
+          return b'ERROR invalid-request\n'
+        l_value[i] = int(l_value[i])
+    if l_value[0] not in ConnectionLog.EVENTS or l_value[1] is None:
+      return b'ERROR invalid-request\n'
+    self.server.events.add(*l_value)
+    return b'OK\n'
+
+
+class _AuthorizationSocketServer(socketserver.ThreadingMixIn,
+                                 socketserver.UnixStreamServer):
+  """This class is the threaded UNIX socket server of the authorization
+  """
+
+  daemon_threads = True
+
+  def __init__(self, path, index, events=None):
+    """Constructor : Open the UNIX socket
+
+    @param path [str] the path of the socket
+    @param index [AuthorizationIndex] the index which answers to requests
+    @param events [ConnectionLogBuffer] OPTIONNAL : the buffer of events
+    """
+    self.index = index
+    self.events = events
+    socketserver.UnixStreamServer.__init__(self, path,
+                                           _AuthorizationRequestHandler)
@@ -0,0 +1,369 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Bandwidth - Accounting of the traffic of each hostname
+
+The byte counters of sessions, read from the status file or received from
+the management interface, are turned into traffic amounts by difference
+with their previous values. Amounts are kept by common name into ring
+buffers of several resolutions, so the traffic of a recent window can be
+summed without any raw sample. The completed periods of one resolution are
+written to the database by batches.
+"""
+
+# System imports
+import array
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+# Project imports
+from .models import BandwidthSample
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.bandwidth')
+
+
+class RingSeries(object):
+  """This class is a fixed size time series of traffic amounts
+  """
+
+  def __init__(self, step, size):
+    """Constructor : Build an empty series
+
+    @param step [int] the number of seconds of each period
+    @param size [int] the number of periods kept
+    """
+    self.step = step
+    self.size = size
+    # the period number stored in each slot, -1 for an empty slot
+    self.__period = array.array('q', [-1]) * size
+    self.__received = array.array('Q', [0]) * size
+    self.__sent = array.array('Q', [0]) * size
+
+  def add(self, timestamp, received, sent):
+    """Add traffic amounts into the period of a time
+
+    @param timestamp [float] the UNIX time of the traffic
+    @param received [int] the number of received bytes
+    @param sent [int] the number of sent bytes
+    """
+    period = int(timestamp // self.step)
+    i = period % self.size
+    if self.__period[i] != period:
+      self.__period[i] = period
+      self.__received[i] = 0
+      self.__sent[i] = 0
+    self.__received[i] += received
+    self.__sent[i] += sent
+
+  def iterate(self, first, last):
+    """Iterate over the known periods of a range
+
+    @param first [int] the first period number
+    @param last [int] the last period number, excluded
+    @return [iterator] the iterator over (period, received, sent)
+    """
+    first = max(first, last - self.size)
+    for period in range(first, last):
+      i = period % self.size
+      if self.__period[i] == period:
+        yield (period, self.__received[i], self.__sent[i])
+
+  def sum(self, first, last):
+    """Sum the traffic of a range of periods
+
+    @param first [int] the first period number
+    @param last [int] the last period number, excluded
+    @return [tuple] the (received, sent) amounts
+    """
+    received = 0
+    sent = 0
+    for (period, r, s) in self.iterate(first, last):
+      received += r
+      sent += s
+    return (received, sent)
+
+
+class BandwidthAccounting(object):
+  """This class accounts the traffic of each common name
+  """
+
+  # the (step, size) of the series of each common name
+  RESOLUTIONS = [(10, 90), (60, 120), (3600, 48)]
+
+  def __init__(self, confparser):
+    """Constructor : Build an empty accounting
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    # disabled by default, the traffic table does not exist on older databases
+    self.__enabled = False
+    # the resolution of the periods written to the database
+    self.__store_resolution = 60
+    # number of seconds between two writes to the database
+    self.__flush_interval = 300.0
+    self.__lock = threading.Lock()
+    # the last (received, sent) counters by session
+    self.__d_counter = dict()
+    # the series by common name
+    self.__d_series = dict()
+    # the time of the last sample by common name
+    self.__d_last_time = dict()
+    # the status file sessions are all known after the first read
+    self.__status_seeded = False
+    # the first period not yet written to the database
+    self.__flush_period = None
+    self.__flush_time = time.time()
+
+  @property
+  def enabled(self):
+    """Return the activation status of the accounting
+
+    @return [bool] True if the traffic is accounted
+    """
+    return self.__enabled
+
+  def load(self):
+    """Load the accounting configuration
+
+    @return [bool] True if the configuration is valid
+    """
+    section = self.__cp.DATABASE_SECTION
+    self.__enabled = self.__cp.getboolean(section, 'bandwidth_accounting',
+                                          fallback=self.__enabled)
+    self.__store_resolution = self.__cp.getint(
+        section, 'bandwidth_store_resolution',
+        fallback=self.__store_resolution)
+    self.__flush_interval = self.__cp.getfloat(
+        section, 'bandwidth_flush_interval', fallback=self.__flush_interval)
+    l_step = [step for (step, size) in self.RESOLUTIONS]
+    if self.__store_resolution not in l_step:
+      g_sys_log.error("Option 'bandwidth_store_resolution' must be one of %s",
+                      ', '.join([str(s) for s in l_step]))
+      return False
+    return True
+
+  def addSample(self, common_name, session, bytes_received, bytes_sent,
+                new_session=False, timestamp=None):
+    """Account a new sample of the counters of a session
+
+    This function can be called from any thread
+    @param common_name [str] the common name of the client
+    @param session [object] a hashable key which identify the session
+    @param bytes_received [int] the received bytes counter of the session
+    @param bytes_sent [int] the sent bytes counter of the session
+    @param new_session [bool] OPTIONNAL : True if the counters started with
+                this session, otherwise its first sample is only a reference
+    @param timestamp [float] OPTIONNAL : the UNIX time of the sample
+    """
+    if not self.__enabled:
+      return
+    if timestamp is None:
+      timestamp = time.time()
+    with self.__lock:
+      previous = self.__d_counter.get(session)
+      self.__d_counter[session] = (bytes_received, bytes_sent)
+      if previous is None:
+        if not new_session:
+          return
+        previous = (0, 0)
+      # a lower counter means it has been reset
+      received = bytes_received - previous[0]
+      if received < 0:
+        received = bytes_received
+      sent = bytes_sent - previous[1]
+      if sent < 0:
+        sent = bytes_sent
+      l_series = self.__d_series.get(common_name)
+      if l_series is None:
+        l_series = [RingSeries(step, size) for (step, size) in
+                    self.RESOLUTIONS]
+        self.__d_series[common_name] = l_series
+      for series in l_series:
+        series.add(timestamp, received, sent)
+      self.__d_last_time[common_name] = timestamp
+
+  def removeSession(self, session):
+    """Forget the counters of a closed session
+
+    @param session [object] the key of the session
+    """
+    with self.__lock:
+      self.__d_counter.pop(session, None)
+
+  def addStatusClients(self, d_client, changes=None):
+    """Account the counters of the status file sessions
+
+    @param d_client [dict] the StatusClient by session key, see
+                StatusFileReader.clients
+    @param changes [tuple] OPTIONNAL : the (l_connect, l_disconnect) of the
+                last read, None if the file has not changed
+    """
+    if changes is None:
+      return
+    (l_connect, l_disconnect) = changes
+    s_new = set()
+    # the sessions of the first read were opened before the daemon
+    if self.__status_seeded:
+      s_new = set([(c.common_name, c.real_address) for c in l_connect])
+    self.__status_seeded = True
+    for client in l_disconnect:
+      self.removeSession(('status', client.common_name, client.real_address))
+    for key, client in d_client.items():
+      self.addSample(client.common_name, ('status',) + key,
+                     client.bytes_received, client.bytes_sent, key in s_new)
+
+  def removeStatusClients(self):
+    """Forget the counters of all status file sessions
+
+    Their next samples are only references, so the traffic accounted from
+    another source meanwhile is not counted again
+    """
+    with self.__lock:
+      for session in [s for s in self.__d_counter if s[0] == 'status']:
+        del self.__d_counter[session]
+
+  def __getSeries(self, window):
+    """Return the index of the finest resolution which covers a window
+
+    @param window [int] the number of seconds of the window
+    @return [int] the index of the resolution
+    """
+    for i, (step, size) in enumerate(self.RESOLUTIONS):
+      if step * size >= window:
+        return i
+    return len(self.RESOLUTIONS) - 1
+
+  def getRate(self, common_name, window=60, now=None):
+    """Compute the mean rate of a common name on the last complete periods
+
+    @param common_name [str] the common name of the client
+    @param window [int] OPTIONNAL : the number of seconds of the window
+    @param now [float] OPTIONNAL : the current UNIX time
+    @return [tuple] the (received, sent) rates in bytes per second
+    """
+    if now is None:
+      now = time.time()
+    i = self.__getSeries(window)
+    step = self.RESOLUTIONS[i][0]
+    with self.__lock:
+      l_series = self.__d_series.get(common_name)
+      if l_series is None:
+        return (0.0, 0.0)
+      last = int(now // step)
+      count = max(1, window // step)
+      (received, sent) = l_series[i].sum(last - count, last)
+    return (received / float(count * step), sent / float(count * step))
+
+  def getTopTalkers(self, window=3600, count=10, now=None):
+    """Return the common names with the most traffic on a recent window
+
+    @param window [int] OPTIONNAL : the number of seconds of the window
+    @param count [int] OPTIONNAL : the maximum number of results
+    @param now [float] OPTIONNAL : the current UNIX time
+    @return [list<tuple>] the (common_name, received, sent) sorted by
+                decreasing total traffic
+    """
+    if now is None:
+      now = time.time()
+    i = self.__getSeries(window)
+    step = self.RESOLUTIONS[i][0]
+    # the current period is included as it is not complete
+    last = int(now // step) + 1
+    first = last - max(1, window // step)
+    l_total = []
+    with self.__lock:
+      for (common_name, l_series) in self.__d_series.items():
+        if self.__d_last_time[common_name] < first * step:
+          continue
+        (received, sent) = l_series[i].sum(first, last)
+        if received + sent > 0:
+          l_total.append((common_name, received, sent))
+    return heapq.nlargest(count, l_total, key=lambda t: t[1] + t[2])
+
+  def flush(self, db, force=False, now=None):
+    """Write the completed periods to the database
+
+    This function must be called from the thread which owns the database
+    @param db [Database] the database to write into
+    @param force [bool] OPTIONNAL : if True write the completed periods now
+    @param now [float] OPTIONNAL : the current UNIX time
+    @return [int] the number of written samples
+    """
+    if not self.__enabled:
+      return 0
+    if now is None:
+      now = time.time()
+    if not force and now - self.__flush_time < self.__flush_interval:
+      return 0
+    self.__flush_time = now
+    i = [step for (step, size) in self.RESOLUTIONS].index(
+        self.__store_resolution)
+    (step, size) = self.RESOLUTIONS[i]
+    last = int(now // step)
+    first = self.__flush_period
+    if first is None:
+      first = last - size
+    if first >= last:
+      return 0
+
+    l_sample = []
+    with self.__lock:
+      # forget the common names without traffic since the oldest period
+      horizon = now - max([s * n for (s, n) in self.RESOLUTIONS])
+      for common_name in [cn for (cn, t) in self.__d_last_time.items()
+                          if t < horizon]:
+        del self.__d_series[common_name]
+        del self.__d_last_time[common_name]
+      for (common_name, l_series) in self.__d_series.items():
+        for (period, received, sent) in l_series[i].iterate(first, last):
+          sample = BandwidthSample(
+              common_name, datetime.datetime.fromtimestamp(period * step),
+              step)
+          sample.load({'bytes_received': received, 'bytes_sent': sent})
+          l_sample.append(sample)
+    if len(l_sample) == 0:
+      self.__flush_period = last
+      return 0
+
+    # link the samples to their hostname when the common name is known
+    d_hostname = dict()
+    for user in db.getUserList():
+      for hostname in user.getHostnameList():
+        d_hostname[user.cuid + "_" + hostname.name] = hostname
+    l_obj = [(s, d_hostname.get(s.common_name)) for s in l_sample]
+    # all samples are written by a single call, so a failed write leaves no
+    # row and the retry cannot write a sample twice
+    if not db.insertList(l_obj, realtime=True):
+      g_sys_log.error("Unable to write %d bandwidth samples, retry at " +
+                      "the next flush", len(l_obj))
+      return 0
+    self.__flush_period = last
+    g_sys_log.debug("%d bandwidth samples written", len(l_sample))
+    return len(l_sample)
@@ -58,6 +58,9 @@ class OVPNUAMConfigParser(ConfigParser):
   DATABASE_SECTION = 'database'
   PKI_SECTION = 'pki'
   EVENT_SECTION = 'event'
+  AUTHORIZATION_SECTION = 'authorization'
+  MANAGEMENT_SECTION = 'management'
+  SCHEDULER_SECTION = 'scheduler'
 
   def __init__(self):
     """Constructor : init a new config parser
@@ -0,0 +1,323 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Connections - Buffer of the clients connection events
+
+The connection events come from the OpenVPN hooks through the authorization
+socket or from the status file reader. They are kept in memory and written
+to the connection log by multiple rows inserts, when enough events are
+pending or when the oldest one has waited long enough, so a burst of
+connections does not cost one commit per event.
+The history is then aggregated into hourly and daily summaries by user and
+the old months of the log are removed by dropping their partitions.
+"""
+
+# System imports
+import collections
+import datetime
+import logging
+import threading
+import time
+
+# Project imports
+from .models import ConnectionLog
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.connections')
+
+
+class ConnectionLogBuffer(object):
+  """This class buffers connection events before writing them in database
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build an empty buffer
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    # disabled by default, the table does not exist on older databases
+    self.__enabled = False
+    # number of pending events which triggers a write
+    self.__batch_size = 500
+    # number of seconds after which the oldest pending event is written
+    self.__flush_interval = 5.0
+    # maximum number of pending events, the oldest are dropped beyond
+    self.__max_pending = 100000
+    self.__lock = threading.Lock()
+    self.__queue = collections.deque()
+    # the time of the oldest pending event
+    self.__first_time = None
+    self.__dropped = 0
+
+  def __len__(self):
+    """Return the number of pending events
+
+    @return [int] the number of events
+    """
+    return len(self.__queue)
+
+  @property
+  def enabled(self):
+    """Return the activation status of the connection log
+
+    @return [bool] True if events are recorded
+    """
+    return self.__enabled
+
+  def load(self):
+    """Load the buffer configuration
+
+    @return [bool] True if the configuration is valid
+    """
+    section = self.__cp.DATABASE_SECTION
+    self.__enabled = self.__cp.getboolean(section, 'connection_log',
+                                          fallback=self.__enabled)
+    self.__batch_size = self.__cp.getint(section,
+                                         'connection_log_batch_size',
+                                         fallback=self.__batch_size)
+    self.__flush_interval = self.__cp.getfloat(
+        section, 'connection_log_flush_interval',
+        fallback=self.__flush_interval)
+    self.__max_pending = self.__cp.getint(section,
+                                          'connection_log_max_pending',
+                                          fallback=self.__max_pending)
+    if self.__batch_size < 1 or self.__max_pending < self.__batch_size:
+      g_sys_log.error("Option 'connection_log_max_pending' must be greater" +
+                      " than 'connection_log_batch_size' which must be " +
+                      "positive")
+      return False
+    return True
+
+  def add(self, event, common_name, real_address=None, virtual_address=None,
+          bytes_received=None, bytes_sent=None, event_time=None):
+    """Append a new event to the buffer
+
+    This function can be called from any thread
+    @param event [str] the kind of event, see ConnectionLog constants
+    @param common_name [str] the common name of the client
+    @param real_address [str] OPTIONNAL : the remote address of the client
+    @param virtual_address [str] OPTIONNAL : the VPN address of the client
+    @param bytes_received [int] OPTIONNAL : the number of received bytes
+    @param bytes_sent [int] OPTIONNAL : the number of sent bytes
+    @param event_time [datetime] OPTIONNAL : the time of the event
+    """
+    if not self.__enabled:
+      return
+    entry = ConnectionLog(event, common_name, event_time)
+    entry.load({'real_address': real_address,
+                'virtual_address': virtual_address,
+                'bytes_received': bytes_received,
+                'bytes_sent': bytes_sent})
+    with self.__lock:
+      if len(self.__queue) >= self.__max_pending:
+        self.__queue.popleft()
+        self.__dropped += 1
+      if len(self.__queue) == 0:
+        self.__first_time = time.time()
+      self.__queue.append(entry)
+
+  def addStatusChanges(self, changes):
+    """Append the sessions changes of the status file reader
+
+    @param changes [tuple] the (l_connect, l_disconnect) lists of
+                StatusClient, or None
+    """
+    if changes is None:
+      return
+    (l_connect, l_disconnect) = changes
+    for client in l_disconnect:
+      self.add(ConnectionLog.EVENT_DISCONNECT, client.common_name,
+               client.real_address, client.virtual_address,
+               client.bytes_received, client.bytes_sent)
+    for client in l_connect:
+      self.add(ConnectionLog.EVENT_CONNECT, client.common_name,
+               client.real_address, client.virtual_address)
+
+  def flush(self, db, force=False):
+    """Write the pending events if the batch is full or old enough
+
+    This function must be called from the thread which owns the database
+    @param db [Database] the database to write into
+    @param force [bool] OPTIONNAL : if True write all pending events now
+    @return [int] the number of written events
+    """
+    with self.__lock:
+      if len(self.__queue) == 0:
+        return 0
+      if (not force and len(self.__queue) < self.__batch_size and
+              time.time() - self.__first_time < self.__flush_interval):
+        return 0
+      l_entry = list(self.__queue)
+      self.__queue.clear()
+      self.__first_time = None
+      dropped = self.__dropped
+      self.__dropped = 0
+    if dropped > 0:
+      g_sys_log.warning("%d connection events dropped because the " +
+                        "connection log is full", dropped)
+
+    # link the entries to their hostname when the common name is known
+    d_hostname = dict()
+    for user in db.getUserList():
+      for hostname in user.getHostnameList():
+        d_hostname[user.cuid + "_" + hostname.name] = hostname
+    l_obj = [(entry, d_hostname.get(entry.common_name))
+             for entry in l_entry]
+    # a multiple rows insert require the same parent kind for all rows
+    l_linked = [obj for obj in l_obj if obj[1] is not None]
+    l_alone = [obj for obj in l_obj if obj[1] is None]
+    written = 0
+    for l_part in (l_linked, l_alone):
+      if len(l_part) == 0:
+        continue
+      if db.insertList(l_part, realtime=True):
+        written += len(l_part)
+      else:
+        g_sys_log.error("Unable to write %d connection events, keep them " +
+                        "for the next flush", len(l_part))
+        with self.__lock:
+          if len(self.__queue) == 0:
+            self.__first_time = time.time()
+          self.__queue.extendleft(reversed([e for (e, p) in l_part]))
+          while len(self.__queue) > self.__max_pending:
+            self.__queue.popleft()
+            self.__dropped += 1
+    if written > 0:
+      g_sys_log.debug("%d connection events written", written)
+    return written
+
+
+class ConnectionLogMaintenance(object):
+  """This class aggregates and expires the connection history
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build a new maintenance job
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    # follows the connection log, which is disabled by default
+    self.__enabled = False
+    # number of months of raw events to keep, 0 to keep all of them
+    self.__retention_months = 12
+    # number of days of hourly summaries to keep, 0 to keep all of them
+    self.__hourly_retention_days = 90
+    # number of months of partitions created in advance
+    self.__months_ahead = 2
+    # the start of the first hour not yet aggregated
+    self.__rollup_ref = None
+    # the day of the last partitions maintenance
+    self.__maintenance_day = None
+
+  @property
+  def enabled(self):
+    """Return the activation status of the job
+
+    @return [bool] True if the job is active
+    """
+    return self.__enabled
+
+  def load(self):
+    """Load the job configuration
+
+    @return [bool] True if the configuration is valid
+    """
+    section = self.__cp.DATABASE_SECTION
+    self.__enabled = self.__cp.getboolean(section, 'connection_log',
+                                          fallback=self.__enabled)
+    self.__retention_months = self.__cp.getint(
+        section, 'connection_log_retention_months',
+        fallback=self.__retention_months)
+    self.__hourly_retention_days = self.__cp.getint(
+        section, 'connection_summary_hourly_retention_days',
+        fallback=self.__hourly_retention_days)
+    if self.__retention_months < 0 or self.__hourly_retention_days < 0:
+      g_sys_log.error("Retention options of the connection log must be " +
+                      "positive")
+      return False
+    return True
+
+  @staticmethod
+  def __addMonths(month, count):
+    """Return the first day of a month relative to another
+
+    @param month [date] a day of the reference month
+    @param count [int] the number of months to add, can be negative
+    @return [date] the first day of the month
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+  def run(self, db, now=None):
+    """Aggregate the new events and expire the old history
+
+    The hours since the last run are aggregated, the current one included
+    so it is computed again at the next run. The partitions are maintained
+    once a day.
+    @param db [Database] the database to work on
+    @param now [datetime] OPTIONNAL : the current time
+    @return [bool] True if all operations succeed
+    """
+    if not self.__enabled:
+      return True
+    if now is None:
+      now = datetime.datetime.today()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    if self.__rollup_ref is None:
+      # events of the previous hour may have been written after its rollup
+      self.__rollup_ref = hour - datetime.timedelta(hours=1)
+    result = True
+    try:
+      if db.rollupConnectionLog(self.__rollup_ref,
+                                hour + datetime.timedelta(hours=1)):
+        self.__rollup_ref = hour
+      else:
+        g_sys_log.error("Unable to aggregate the connection log")
+        result = False
+
+      if self.__maintenance_day != now.date():
+        today = now.date()
+        oldest = datetime.date.min
+        if self.__retention_months > 0:
+          oldest = self.__addMonths(today, -self.__retention_months)
+        if not db.maintainConnectionLogPartitions(
+                oldest, self.__addMonths(today, self.__months_ahead)):
+          g_sys_log.error("Unable to maintain the connection log partitions")
+          result = False
+        elif (self.__hourly_retention_days > 0 and
+              not db.purgeConnectionSummary(
+                  'hour', hour - datetime.timedelta(
+                      days=self.__hourly_retention_days))):
+          g_sys_log.error("Unable to remove old hourly summaries")
+          result = False
+        else:
+          self.__maintenance_day = today
+    except NotImplementedError as e:
+      g_sys_log.warning("The database adapter does not support the " +
+                        "connection history maintenance (%s)", str(e))
+      self.__enabled = False
+    return result
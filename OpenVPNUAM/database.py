@@ -35,12 +35,16 @@ where no longer to able to get us new data.
 """
 
 # System imports
+import collections
+import datetime
 import logging
 import time
 import queue
 
 # Project imports
 from .adapters import Adapter
+from .access import AccessWindowIndex
+from .revocation import RevokedSerialSet
 
 # Global project declarations
 g_sys_log = logging.getLogger('openvpn-uam.database')
@@ -285,6 +289,20 @@ class Database(object):
     # this value will not be use in this class but must be read from another
     # overclass
     self.__db_wait_time = 30
+    # The set of revoked certificate serials, updated incrementally after
+    # each poll and fully rebuilt every revoked_full_poll_count polls
+    self.__revoked = RevokedSerialSet()
+    self.__revoked_full_poll_count = 24
+    self.__revoked_poll_count = 0
+    # number of seconds between two reads of the new revocations, which are
+    # also read between two polls of the users, and the time of the last read
+    self.__revoked_poll_time = 10.0
+    self.__revoked_poll_ref = 0.0
+    # number of seconds before the last known revocation which are read again
+    # by each incremental read, to catch the backdated revocations
+    self.__revoked_overlap_time = 3600.0
+    # The access windows of users, compiled after each poll
+    self.__access = AccessWindowIndex()
     # This queue store the list of update to perform in real database
     # Each item in this, must be send to the adapter for being executed in
     # database backend. Note that, while there is at least one item in this
@@ -293,6 +311,8 @@ class Database(object):
     self.__queue_update = queue.Queue()
     self.__queue_insert = queue.Queue()
     self.__queue_error = queue.Queue()
+    # the functions called after each update request
+    self.__l_listener = []
 
   def load(self):
     """Load parameter from config
@@ -315,6 +335,19 @@ class Database(object):
                                              'db_wait_time',
                                              fallback=self.__db_wait_time)
 
+    self.__revoked_full_poll_count = self.__cp.getint(
+        self.__cp.DATABASE_SECTION, 'revoked_full_poll_count',
+        fallback=self.__revoked_full_poll_count)
+    self.__revoked_poll_time = self.__cp.getfloat(
+        self.__cp.DATABASE_SECTION, 'revoked_poll_time',
+        fallback=self.__revoked_poll_time)
+    self.__revoked_overlap_time = self.__cp.getfloat(
+        self.__cp.DATABASE_SECTION, 'revoked_overlap_time',
+        fallback=self.__revoked_overlap_time)
+    if self.__revoked_overlap_time < 0:
+      g_sys_log.error("Option 'revoked_overlap_time' must be a positive number")
+      return False
+
     # instanciate a new Adapter object to be use during this session
     self.__adapter = self.__newAdapter()
     if self.__adapter is None:
@@ -474,6 +507,27 @@ class Database(object):
         row.db = self
     return l
 
+  def __updateRevokedSerials(self):
+    """Call the adapter to update the set of revoked serials
+
+    Only the revocations since the last known one, minus an overlap window
+    for the revocations recorded with an earlier time, are read, except every
+    revoked_full_poll_count polls where the whole set is read again
+    """
+    self.__revoked_poll_ref = time.time()
+    full = (self.__revoked.last_time is None or
+            self.__revoked_poll_count >= self.__revoked_full_poll_count)
+    since = None
+    if not full:
+      since = self.__revoked.last_time - datetime.timedelta(
+          seconds=self.__revoked_overlap_time)
+    l_row = self.__adapter.getRevokedCertificateList(since)
+    if l_row is None:
+      g_sys_log.error("Unable to fetch revoked certificates from adapter")
+      return
+    self.__revoked.update(l_row, full)
+    self.__revoked_poll_count = 0 if full else self.__revoked_poll_count + 1
+
   def api(func):
     """Decorator for all API functions
 
@@ -484,7 +538,7 @@ class Database(object):
 
       This function makes some background tasks for the database :
         * check data's cache validity
-        * process update on required
+        * process update and insert on required
       """
       assert self.__status == self.OPEN
 
@@ -493,7 +547,7 @@ class Database(object):
       # csheck if the last poll have been realized from sufficient amount
       # of time
       if ((time.time() - self.__db_poll_ref >= self.__db_poll_time) and
-         self.__queue_update.empty()):
+         self.__queue_update.empty() and self.__queue_insert.empty()):
         g_sys_log.debug("=> Pull data from the adapter")
         l_u = self.__getUserListFromAdapter()
         # error in data retrieving from DB
@@ -501,10 +555,17 @@ class Database(object):
           self.__db_poll_ref = time.time()
           # set the reference to self into all user entities
           self.__l_user = l_u
+          self.__access.update(l_u)
+          self.__updateRevokedSerials()
         else:
           g_sys_log.error("Unable to fetch data from adapter. Use local data")
+      # the revocations are read more often than the users
+      elif (self.__revoked_poll_time > 0 and
+            time.time() - self.__revoked_poll_ref >= self.__revoked_poll_time):
+        self.__updateRevokedSerials()
 
       self.__processUpdate()
+      self.__processInsert()
       return func(self, *args, **kwargs)
     return backgroundTask
 
@@ -545,30 +606,48 @@ class Database(object):
     if ins:
       return self.__adapter.processInsert(ins)
 
+    # group pending inserts by kind to give them to adapter in a single call
+    d_ins = collections.OrderedDict()
     for i in range(self.__queue_insert.qsize()):
       try:
         ins = self.__queue_insert.get_nowait()
       except queue.Empty:
-        return
+        break
 
-      # if it is not the time for the update to be performed
-      if not insert.hasToBeExecuted():
+      # if it is not the time for the insert to be performed
+      if not ins.hasToBeExecuted():
         self.__queue_insert.put_nowait(ins)
       else:
-        # if update failed into adapter
-        ins.execute()
-        if not self.__adapter.processInsert(ins):
-          # an error mean the update has been performed but incorrectly
+        d_ins.setdefault((ins.source_type, ins.parent is None),
+                         []).append(ins)
+
+    for l_ins in d_ins.values():
+      # if insert failed into adapter
+      if not self.__processInsertList(l_ins):
+        for ins in l_ins:
+          # an error mean the insert has been performed but incorrectly
           if ins.is_error:
             g_sys_log.error("Error during insert query : %s", str(ins))
-            # push the update query into error queue
+            # push the insert query into error queue
             self.__queue_error.put(ins)
-          # no error means that the update has not been performed
+          # no error means that the insert has not been performed
           else:
-            g_sys_log.error("Error with adapter during update query : %s",
+            g_sys_log.error("Error with adapter during insert query : %s",
                             str(ins))
-            # push the update query into error queue
-            self.__queue_update.put_nowait(ins)
+            # push the insert query back into insert queue
+            self.__queue_insert.put_nowait(ins)
+
+  def __processInsertList(self, l_ins):
+    """Treat a list of insert request of the same kind in a single call
+
+    @param l_ins [list<DbInsert>] the insert requests to process
+    @return [bool] True if all objects have been inserted
+    """
+    if len(l_ins) == 0:
+      return True
+    for ins in l_ins:
+      ins.execute()
+    return self.__adapter.processInsertList(l_ins)
 
 # API DATABASE
   @api
@@ -579,6 +658,22 @@ class Database(object):
     """
     return self.__l_user
 
+  @api
+  def getRevokedSerialSet(self):
+    """Return the set of revoked certificate serials
+
+    @return [RevokedSerialSet] the current set of revoked serials
+    """
+    return self.__revoked
+
+  @api
+  def getAccessWindowIndex(self):
+    """Return the compiled access windows of users
+
+    @return [AccessWindowIndex] the index of the current user list
+    """
+    return self.__access
+
   def getEnabledUserList(self):
     """Return only the enabled user list
 
@@ -617,6 +712,18 @@ class Database(object):
     update.expected_change = count
     self.__queue_update.put(update)
     self.__processUpdate()
+    for listener in self.__l_listener:
+      listener(field, value, obj)
+
+  def addUpdateListener(self, listener):
+    """Register a function to call after each update request
+
+    The listeners apply a change of the model, like a disabled user, without
+    waiting for the next poll of the database
+    @param listener [callable] the function, called with the field, the
+                    value and the object of the update
+    """
+    self.__l_listener.append(listener)
 
   def insert(self, obj, parent=None, realtime=False):
     """Queue a insert request
@@ -625,16 +732,114 @@ class Database(object):
     This function call the adapter to perform the insert request to the
     storage engine.
     @param obj [MIX] : the object (from model) to insert.
-          Be sure that his primary attribute is not set
+          Be sure that his primary attribute is not set, unless it have been
+          reserved before, in this case the insert can be delayed
     @param parent [MIX] OPTIONNAL : the reference to a optionnal parent object.
             This is usefull to link the obj to his parent by a foreign link
-    @param realtime [bool] :
+    @param realtime [bool] : if True the insert is performed immediatly,
+            otherwise it is queued until the next flush
+    @return [bool] the result of the realtime insert
     """
-    assert obj.id is None
+    assert obj.id is None or not realtime
     insert = Database.DbInsert(obj, parent, realtime)
     # if set, the insert will be performed immediatly
     if realtime:
       return self.__processInsert(insert)
 
     self.__queue_insert.put(insert)
+    return True
+
+  def insertList(self, l_obj, realtime=False):
+    """Queue a list of insert requests of the same kind
+
+    Attempt to insert all given new objects into the database storage. If
+    realtime is set, they are all given to the adapter in one call which
+    allow it to perform a single multi rows insert.
+    @param l_obj [list<tuple>] : the list of (obj, parent) to insert. Each
+          obj must be of the same model and not have his primary attribute set
+          unless the inserts are delayed. The parent of some of them can be
+          None, they are then inserted without foreign link
+    @param realtime [bool] : if True all inserts are performed immediatly,
+          otherwise they are queued until the next flush
+    @return [bool] the result of the realtime insert
+    """
+    l_ins = []
+    for (obj, parent) in l_obj:
+      assert obj.id is None or not realtime
+      l_ins.append(Database.DbInsert(obj, parent, realtime))
+    # if set, inserts will be performed immediatly
+    if realtime:
+      return self.__processInsertList(l_ins)
+
+    for ins in l_ins:
+      self.__queue_insert.put(ins)
+    return True
+
+  def flush(self):
+    """Give all pending update and insert requests to the adapter
+    """
+    assert self.__status == self.OPEN
+    self.__processUpdate()
     self.__processInsert()
+
+  def getCertificateSnapshot(self):
+    """Read all certificates rows from the adapter in a single call
+
+    @return [list<dict>] the list of certificates rows, see Adapter
+            [None] if the adapter query failed
+    """
+    assert self.__status == self.OPEN
+    return self.__adapter.getCertificateSnapshot()
+
+  def rollupConnectionLog(self, start, end):
+    """Aggregate the connection log into hourly and daily summaries
+
+    @param start [datetime] the first hour to aggregate
+    @param end [datetime] the end of the last hour to aggregate, excluded
+    @return [bool] True if the summaries have been written
+    """
+    assert self.__status == self.OPEN
+    return self.__adapter.rollupConnectionLog(start, end)
+
+  def maintainConnectionLogPartitions(self, oldest_month, newest_month):
+    """Create and drop the monthly partitions of the connection log
+
+    @param oldest_month [date] the first day of the oldest month to keep
+    @param newest_month [date] the first day of the last month to prepare
+    @return [bool] True if the partitions are up to date
+    """
+    assert self.__status == self.OPEN
+    return self.__adapter.maintainConnectionLogPartitions(oldest_month,
+                                                          newest_month)
+
+  def purgeConnectionSummary(self, resolution, before):
+    """Remove the old summaries of a resolution
+
+    @param resolution [str] the resolution of summaries, 'hour' or 'day'
+    @param before [datetime] the summaries which start before are removed
+    @return [bool] True if the summaries have been removed
+    """
+    assert self.__status == self.OPEN
+    return self.__adapter.purgeConnectionSummary(resolution, before)
+
+  def reserveSerialRange(self, count):
+    """Reserve a range of consecutive certificate serial numbers
+
+    The reserved serials will never be given again by the adapter and can be
+    used as certificate ids without any insert
+    @param count [int] : the number of serial to reserve, with zero no serial
+          is reserved but the first available one is still returned
+    @return [int] the first serial of the range
+            [None] if the adapter failed to reserve the range
+    """
+    assert self.__status == self.OPEN
+    return self.__adapter.reserveSerialRange(count)
+
+  def getLastCertificateId(self):
+    """Return the greatest certificate id known by the adapter
+
+    @return [int] the greatest certificate id, zero if there is none
+            [None] if the adapter query failed
+    """
+    assert self.__status == self.OPEN
+    return self.__adapter.getLastCertificateId()
@@ -0,0 +1,67 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Handlers - Event handlers
+
+Each event handler is a module of this package which contains a class named
+Handler, extending BaseHandler. The handler is enabled by putting the module
+name into the 'handlers' option of the event section, and it receives its
+own configuration section of the same name.
+"""
+
+# System imports
+import logging
+
+
+class BaseHandler(object):
+  """This class is the base of all event handlers
+  """
+
+  class CAP(object):
+    """The capabilities that a handler can provide
+    """
+    # the handler can send messages
+    CAP_MESSAGE = 'message'
+    # the handler can send files, like new certificates, to users
+    CAP_FILE = 'file'
+
+  def __init__(self, name, capabilities=None):
+    """Constructor : Build a new handler
+
+    @param name [str] the name of the handler, which must match its module
+    @param capabilities [list<str>] OPTIONNAL : the capabilities of the
+                handler, see CAP
+    """
+    self.name = name
+    self.capabilities = capabilities or []
+    # set by the event receiver before load()
+    self.logger = logging.getLogger('openvpn-uam.event')
+    self.configuration = dict()
+
+  def load(self):
+    """Load the handler from its configuration
+
+    @return [bool] True if the handler is usable
+    """
+    return True
@@ -0,0 +1,535 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Management - OpenVPN management interface client
+
+This module keeps a connection to the management interface of the OpenVPN
+server, by TCP or UNIX socket, and follows the >CLIENT: notifications to
+know which hostnames are online. A single 'status 3' command seed the
+sessions after each connection, then only notifications are used.
+The client runs an asyncio event loop in a background thread, the others
+threads only talk to it through the loop.
+When the server use --management-client-auth, the connection requests are
+answered with the authorization index.
+The byte counters of sessions can also be requested periodically from the
+server for the bandwidth accounting.
+"""
+
+# System imports
+import asyncio
+import collections
+import logging
+import threading
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.management')
+
+# The state of a client session
+Session = collections.namedtuple('Session', ['cid', 'common_name', 'serial'])
+
+
+class ManagementClient(object):
+  """This class follows the sessions of the OpenVPN server
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build a new management client
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    # the address of the interface, a (host, port) tuple or a socket path,
+    # None if the client is disabled
+    self.__address = None
+    self.__password = None
+    self.__reconnect_time = 5.0
+    self.__command_timeout = 10.0
+    # number of seconds between two byte counters notifications, 0 to
+    # disable them
+    self.__bytecount_interval = 0
+    # the bandwidth accounting which receives the byte counters
+    self.__bandwidth = None
+    # the client ids of sessions opened before the connection
+    self.__s_seeded = set()
+    # the authorization index used to answer connection requests
+    self.__index = None
+    # the sessions by client id and the environment of pending notifications
+    self.__d_session = dict()
+    self.__d_env = dict()
+    # the client ids of sessions already asked to be killed
+    self.__s_killed = set()
+    # the hostnames by common name
+    self.__d_hostname = dict()
+    # the pending commands, as (future, multiline) tuples
+    self.__pending = collections.deque()
+    self.__loop = None
+    self.__thread = None
+    self.__writer = None
+    self.__stopped = None
+
+  @property
+  def enabled(self):
+    """Return the activation status of the client
+
+    @return [bool] True if the management interface is used
+    """
+    return self.__address is not None
+
+  @property
+  def connected(self):
+    """Return the connection status of the client
+
+    @return [bool] True if the client is connected to the interface
+    """
+    return self.__writer is not None
+
+  @property
+  def counting(self):
+    """Return the status of the byte counters notifications
+
+    @return [bool] True if the server sends the byte counters of sessions
+                to the bandwidth accounting
+    """
+    return (self.__writer is not None and self.__bandwidth is not None and
+            self.__bytecount_interval > 0)
+
+  def load(self):
+    """Load the client configuration
+
+    @return [bool] True if the configuration is valid
+    """
+    section = self.__cp.MANAGEMENT_SECTION
+    if not self.__cp.has_section(section):
+      g_sys_log.info("No management section, session tracking disabled")
+      return True
+    address = self.__cp.get(section, 'address', fallback='')
+    if len(address) == 0:
+      return True
+    if address.startswith('/'):
+      self.__address = address
+    else:
+      host, sep, port = address.rpartition(':')
+      if not sep or not port.isdigit():
+        g_sys_log.fatal("Option 'address' must be a socket path or a " +
+                        "host:port pair")
+        return False
+      self.__address = (host.strip('[]'), int(port))
+    self.__password = self.__cp.get(section, 'password', fallback=None)
+    self.__reconnect_time = self.__cp.getfloat(
+        section, 'reconnect_time', fallback=self.__reconnect_time)
+    self.__command_timeout = self.__cp.getfloat(
+        section, 'command_timeout', fallback=self.__command_timeout)
+    self.__bytecount_interval = self.__cp.getint(
+        section, 'bytecount_interval', fallback=self.__bytecount_interval)
+    return True
+
+  def start(self, index=None, bandwidth=None):
+    """Run the client in a background thread
+
+    @param index [AuthorizationIndex] OPTIONNAL : the index used to answer
+                the connection requests of the server
+    @param bandwidth [BandwidthAccounting] OPTIONNAL : the accounting which
+                receives the byte counters of sessions
+    """
+    if not self.enabled or self.__thread is not None:
+      return
+    self.__index = index
+    self.__bandwidth = bandwidth
+    self.__loop = asyncio.new_event_loop()
+    self.__thread = threading.Thread(target=self.__run,
+                                     name='management-client', daemon=True)
+    self.__thread.start()
+
+  def stop(self):
+    """Stop the client and wait for its thread
+    """
+    if self.__thread is None:
+      return
+    self.__loop.call_soon_threadsafe(lambda: self.__stopped.set())
+    self.__thread.join()
+    self.__loop.close()
+    self.__thread = None
+    self.__loop = None
+
+  def update(self, l_user, revoked=None, windows=None):
+    """Apply the current users state to the sessions
+
+    The online status of hostnames is refreshed and the sessions of disabled
+    users or hostnames, of users outside their access window or of revoked
+    certificates, are killed
+    @param l_user [list<User>] the current list of users
+    @param revoked [RevokedSerialSet] OPTIONNAL : the set of revoked serials
+    @param windows [AccessWindowIndex] OPTIONNAL : the access windows
+    """
+    if self.__loop is None:
+      return
+    d_hostname = dict()
+    for user in l_user:
+      for hostname in user.getHostnameList():
+        d_hostname[user.cuid + "_" + hostname.name] = (user, hostname)
+    self.__loop.call_soon_threadsafe(self.__applyUpdate, d_hostname, revoked,
+                                     windows)
+
+  def kill(self, common_name):
+    """Ask the server to kill all sessions of a common name
+
+    @param common_name [str] the common name of the client
+    """
+    if self.__loop is not None:
+      self.__loop.call_soon_threadsafe(self.__killCommonName, common_name)
+
+  def onUpdate(self, field, value, obj):
+    """Kill the sessions of a user or a hostname as soon as it is disabled
+
+    This function is registered as a database update listener, so the
+    sessions are killed without waiting for the next database poll
+    @param field [str] the name of the updated attribute
+    @param value [object] the new value of the attribute
+    @param obj [object] the updated model instance
+    """
+    if field != 'is_enabled' or value:
+      return
+    # the hostnames dict is replaced, never modified, by the client thread
+    for (common_name, (user, hostname)) in list(self.__d_hostname.items()):
+      if user is obj or hostname is obj:
+        self.kill(common_name)
+
+  def getOnlineList(self):
+    """Return the common names which have at least one session
+
+    @return [list<str>] the list of online common names
+    """
+    return sorted(set([s.common_name for s in list(self.__d_session.values())]))
+
+  def __run(self):
+    """Entry point of the client thread
+    """
+    asyncio.set_event_loop(self.__loop)
+    self.__stopped = asyncio.Event()
+    self.__loop.run_until_complete(self.__main())
+
+  async def __main(self):
+    """Keep a connection to the management interface until stop
+    """
+    while not self.__stopped.is_set():
+      try:
+        if isinstance(self.__address, str):
+          reader, writer = await asyncio.open_unix_connection(self.__address)
+        else:
+          reader, writer = await asyncio.open_connection(*self.__address)
+      except OSError as e:
+        g_sys_log.error("Unable to connect to management interface : %s",
+                        str(e))
+      else:
+        g_sys_log.info("Connected to management interface")
+        await self.__serve(reader, writer)
+        g_sys_log.warning("Disconnected from management interface")
+      try:
+        await asyncio.wait_for(self.__stopped.wait(), self.__reconnect_time)
+      except asyncio.TimeoutError:
+        pass
+
+  async def __serve(self, reader, writer):
+    """Handle a connection until it is closed or the client is stopped
+
+    @param reader [asyncio.StreamReader] the reading side of the connection
+    @param writer [asyncio.StreamWriter] the writing side of the connection
+    """
+    self.__writer = writer
+    read_task = self.__loop.create_task(self.__readLoop(reader))
+    stop_task = self.__loop.create_task(self.__stopped.wait())
+    seed_task = self.__loop.create_task(self.__seed())
+    try:
+      await asyncio.wait([read_task, stop_task],
+                         return_when=asyncio.FIRST_COMPLETED)
+    finally:
+      for task in (read_task, stop_task, seed_task):
+        task.cancel()
+      self.__writer = None
+      while len(self.__pending) > 0:
+        future, multiline = self.__pending.popleft()
+        if not future.done():
+          future.set_exception(ConnectionError('connection closed'))
+      writer.close()
+      # sessions are not known anymore until the next seed
+      if self.__bandwidth is not None:
+        for cid in self.__d_session:
+          self.__bandwidth.removeSession(('management', cid))
+      self.__d_session.clear()
+      self.__d_env.clear()
+      self.__s_killed.clear()
+      self.__s_seeded.clear()
+      self.__refreshOnline()
+
+  async def __seed(self):
+    """Authenticate and read the current sessions from the server
+    """
+    try:
+      if self.__password is not None:
+        await self.__command(self.__password)
+      lines = await self.__command('status 3', multiline=True)
+      if self.__bandwidth is not None and self.__bytecount_interval > 0:
+        await self.__command('bytecount ' + str(self.__bytecount_interval))
+    except (ConnectionError, asyncio.TimeoutError) as e:
+      g_sys_log.error("Unable to read the sessions from management " +
+                      "interface : %s", str(e))
+      return
+    l_column = []
+    for line in lines:
+      fields = line.split('\t')
+      if fields[0] == 'HEADER' and len(fields) > 1 and fields[1] == 'CLIENT_LIST':
+        l_column = fields[2:]
+      elif fields[0] == 'CLIENT_LIST' and l_column:
+        row = dict(zip(l_column, fields[1:]))
+        cid = row.get('Client ID')
+        if cid is not None and cid.isdigit():
+          self.__d_session[int(cid)] = Session(int(cid),
+                                               row.get('Common Name'), None)
+          self.__s_seeded.add(int(cid))
+    self.__refreshOnline()
+    g_sys_log.debug("Management interface reports %d sessions",
+                    len(self.__d_session))
+
+  async def __readLoop(self, reader):
+    """Read the lines sent by the server until the connection is closed
+
+    @param reader [asyncio.StreamReader] the reading side of the connection
+    """
+    l_lines = []
+    while True:
+      line = await reader.readline()
+      if not line:
+        return
+      line = line.decode(errors='replace').rstrip('\r\n')
+      # the password prompt is not terminated by a newline
+      if line.startswith('ENTER PASSWORD:'):
+        line = line[len('ENTER PASSWORD:'):]
+        if len(line) == 0:
+          continue
+      if line.startswith('>'):
+        self.__handleNotification(line[1:])
+        continue
+      if len(self.__pending) == 0:
+        continue
+      future, multiline = self.__pending[0]
+      if multiline:
+        if line != 'END':
+          l_lines.append(line)
+          continue
+        result = l_lines
+        l_lines = []
+      else:
+        result = line
+      self.__pending.popleft()
+      if not future.done():
+        if not multiline and line.startswith('ERROR:'):
+          future.set_exception(ConnectionError(line))
+        else:
+          future.set_result(result)
+
+  async def __command(self, command, multiline=False):
+    """Send a command and wait for its response
+
+    @param command [str] the command line
+    @param multiline [bool] OPTIONNAL : True if the response is a list of
+                lines terminated by END
+    @return [str] the response line
+            [list<str>] the response lines if multiline is True
+    """
+    if self.__writer is None:
+      raise ConnectionError('not connected')
+    future = self.__loop.create_future()
+    self.__pending.append((future, multiline))
+    self.__writer.write((command + '\n').encode())
+    return await asyncio.wait_for(future, self.__command_timeout)
+
+  def __send(self, command):
+    """Send a command without waiting for its response
+
+    @param command [str] the command line
+    """
+    if self.__writer is None:
+      return
+    future = self.__loop.create_future()
+    # the failure of these commands is only logged
+    future.add_done_callback(
+        lambda f: f.exception() and g_sys_log.warning(
+            "Management command '%s' failed : %s", command.split()[0],
+            str(f.exception())))
+    self.__pending.append((future, False))
+    self.__writer.write((command + '\n').encode())
+
+  def __handleNotification(self, line):
+    """Handle a real time notification of the server
+
+    @param line [str] the notification line without the leading '>'
+    """
+    kind, sep, data = line.partition(':')
+    if kind == 'BYTECOUNT_CLI':
+      self.__handleByteCount(data.split(','))
+      return
+    if kind != 'CLIENT':
+      return
+    event, sep, args = data.partition(',')
+    l_arg = args.split(',')
+    if event == 'ENV':
+      # the environment belongs to the last CONNECT/REAUTH/ESTABLISHED
+      if self.__d_env.get(None) is not None:
+        if args == 'END':
+          self.__handleClientEvent(*self.__d_env.pop(None))
+        else:
+          name, sep, value = args.partition('=')
+          self.__d_env[None][2][name] = value
+      return
+    if event in ['CONNECT', 'REAUTH', 'ESTABLISHED']:
+      if not l_arg[0].isdigit():
+        return
+      kid = l_arg[1] if len(l_arg) > 1 else None
+      self.__d_env[None] = (event, (int(l_arg[0]), kid), dict())
+    elif event == 'DISCONNECT':
+      if l_arg[0].isdigit():
+        self.__d_env[None] = (event, (int(l_arg[0]), None), dict())
+
+  def __handleClientEvent(self, event, ids, d_env):
+    """Handle a complete client notification with its environment
+
+    @param event [str] the kind of the notification
+    @param ids [tuple] the (client id, key id) of the session
+    @param d_env [dict] the environment of the notification
+    """
+    cid, kid = ids
+    common_name = d_env.get('common_name')
+    serial = d_env.get('tls_serial_0')
+    serial = int(serial) if serial and serial.isdigit() else None
+    if event in ['CONNECT', 'REAUTH']:
+      self.__authorizeClient(cid, kid, common_name, serial)
+    elif event == 'ESTABLISHED':
+      self.__d_session[cid] = Session(cid, common_name, serial)
+      self.__refreshOnline(common_name)
+      g_sys_log.debug("Session %d of '%s' established", cid, common_name)
+    elif event == 'DISCONNECT':
+      session = self.__d_session.pop(cid, None)
+      self.__s_killed.discard(cid)
+      self.__s_seeded.discard(cid)
+      if self.__bandwidth is not None:
+        self.__bandwidth.removeSession(('management', cid))
+      if session is not None:
+        self.__refreshOnline(session.common_name)
+        g_sys_log.debug("Session %d of '%s' closed", cid,
+                        session.common_name)
+
+  def __handleByteCount(self, l_arg):
+    """Give the byte counters of a session to the bandwidth accounting
+
+    @param l_arg [list<str>] the client id, received and sent bytes
+    """
+    if (self.__bandwidth is None or len(l_arg) != 3 or
+            not all([arg.isdigit() for arg in l_arg])):
+      return
+    cid = int(l_arg[0])
+    session = self.__d_session.get(cid)
+    if session is None:
+      return
+    self.__bandwidth.addSample(session.common_name, ('management', cid),
+                               int(l_arg[1]), int(l_arg[2]),
+                               cid not in self.__s_seeded)
+
+  def __authorizeClient(self, cid, kid, common_name, serial):
+    """Answer a connection request with the authorization index
+
+    @param cid [int] the client id
+    @param kid [str] the key id
+    @param common_name [str] the common name of the client
+    @param serial [int] the serial of the client certificate or None
+    """
+    if self.__index is None:
+      self.__send('client-auth-nt ' + str(cid) + ' ' + str(kid))
+      return
+    allowed, reason = self.__index.authorize(common_name, serial)
+    if allowed:
+      self.__send('client-auth-nt ' + str(cid) + ' ' + str(kid))
+    else:
+      g_sys_log.info("Deny connection of '%s' : %s", common_name, reason)
+      self.__send('client-deny ' + str(cid) + ' ' + str(kid) + ' "' +
+                  reason + '"')
+
+  def __killCommonName(self, common_name):
+    """Kill all sessions of a common name
+
+    @param common_name [str] the common name of the client
+    """
+    l_cid = [s.cid for s in self.__d_session.values()
+             if s.common_name == common_name]
+    for cid in l_cid:
+      self.__killSession(cid)
+    if len(l_cid) > 0:
+      g_sys_log.info("Kill %d sessions of '%s'", len(l_cid), common_name)
+
+  def __refreshOnline(self, common_name=None):
+    """Set the online status of hostnames from the sessions
+
+    The status is set without database update, it is only a runtime state
+    @param common_name [str] OPTIONNAL : only refresh this common name
+    """
+    s_online = set([s.common_name for s in self.__d_session.values()])
+    if common_name is not None:
+      l_cn = [common_name]
+    else:
+      l_cn = self.__d_hostname.keys()
+    for cn in l_cn:
+      if cn in self.__d_hostname:
+        self.__d_hostname[cn][1].setOnline(cn in s_online)
+
+  def __applyUpdate(self, d_hostname, revoked, windows):
+    """Apply a new users state in the client thread
+
+    @param d_hostname [dict] the (user, hostname) by common name
+    @param revoked [RevokedSerialSet] the set of revoked serials or None
+    @param windows [AccessWindowIndex] the access windows or None
+    """
+    self.__d_hostname = d_hostname
+    self.__refreshOnline()
+    for session in list(self.__d_session.values()):
+      kill = False
+      if session.common_name in d_hostname:
+        user, hostname = d_hostname[session.common_name]
+        kill = not user.is_enabled or not hostname.is_enabled
+        if windows is not None and not windows.isAllowed(user.id):
+          kill = True
+      if (revoked is not None and session.serial is not None and
+              session.serial in revoked):
+        kill = True
+      if kill and session.cid not in self.__s_killed:
+        g_sys_log.info("Kill session %d of '%s'", session.cid,
+                       session.common_name)
+        self.__killSession(session.cid)
+
+  def __killSession(self, cid):
+    """Ask the server to kill a session
+
+    @param cid [int] the client id of the session
+    """
+    self.__s_killed.add(cid)
+    self.__send('client-kill ' + str(cid))
@@ -29,5 +29,8 @@ These class describes models for database entities used by program
 from .user import User
 from .hostname import Hostname
 from .certificate import Certificate
+from .connection_log import ConnectionLog
+from .bandwidth_sample import BandwidthSample
 
-__all__ = ['user', 'hostname', 'certificate']
+__all__ = ['user', 'hostname', 'certificate', 'connection_log',
+           'bandwidth_sample']
@@ -0,0 +1,106 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Models/BandwidthSample
+
+This file contains class for bandwidth samples.
+A sample is the amount of traffic of a hostname during a fixed period,
+samples are only inserted and never updated.
+"""
+
+# System imports
+import logging
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.model.bandwidth_sample')
+
+
+class BandwidthSample(object):
+  """Build an instance of the bandwidth sample program class
+  """
+
+  def __init__(self, common_name, period_start, resolution):
+    """Constructor: Build a new bandwidth sample
+
+    @param common_name [str] the common name of the client certificate
+    @param period_start [datetime] the start of the sample period
+    @param resolution [int] the number of seconds of the sample period
+    """
+    # database model
+    self._id = None
+    self._common_name = common_name
+    self._period_start = period_start
+    self._resolution = resolution
+    self._bytes_received = 0
+    self._bytes_sent = 0
+
+  def load(self, attributes):
+    """Load a bandwidth sample with attributes
+
+    @param attributes [dict] : a key-value dict which contains attributs
+    to set to this BandwidthSample object
+    """
+    assert self._id is None
+    assert isinstance(attributes, dict)
+    # loop for each given attributes
+    for key in attributes:
+      if hasattr(self, "_" + key):
+        object.__setattr__(self, "_" + key, attributes[key])
+      else:
+        g_sys_log.error('Unknown attribute from source "' + key + '"')
+
+# Getters methods
+  def __getattr__(self, key):
+    """Upgrade default getter to allow get semi-private attributes
+    """
+    try:
+      return object.__getattribute__(self, "_" + key)
+    except AttributeError:
+      pass
+    return object.__getattribute__(self, key)
+
+# Setters methods
+  def __setattr__(self, key, value):
+    """Upgrade default setter to set semi-private attributes
+
+    Samples are never updated so no database update is triggered
+    """
+    if hasattr(self, "_" + key):
+      object.__setattr__(self, "_" + key, value)
+    else:
+      object.__setattr__(self, key, value)
+
+# DEBUG methods
+  def __str__(self):
+    """[DEBUG] Produce a description string for this bandwidth sample
+
+    @return [str] a formatted string that describe this sample
+    """
+    return ("BANDWIDTH SAMPLE (" + str(self._id) + ")" +
+            "\n      COMMON NAME = " + str(self._common_name) +
+            "\n      PERIOD START = " + str(self._period_start) +
+            "\n      RESOLUTION = " + str(self._resolution) +
+            "\n      BYTES RECEIVED = " + str(self._bytes_received) +
+            "\n      BYTES SENT = " + str(self._bytes_sent))
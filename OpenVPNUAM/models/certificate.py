@@ -51,6 +51,7 @@ class Certificate(object):
     self._revoked_time = None
     self._certificate_begin_time = begin
     self._certificate_end_time = end
+    self._key_creation_time = None
     # This is the reference to the main database class
     # it is used to perform self object update call
     # Exemple if you want to update a attribut of an instance of this class
@@ -131,5 +132,6 @@ class Certificate(object):
                "\n      REVOKED REASON = " + str(self.revoked_reason) +
                "\n      REVOKED TIME = " + str(self.revoked_time) +
                "\n      NOT BEFORE = " + str(self.certificate_begin_time) +
-               "\n      NOT AFTER = " + str(self.certificate_end_time))
+               "\n      NOT AFTER = " + str(self.certificate_end_time) +
+               "\n      KEY CREATED ON = " + str(self.key_creation_time))
     return content
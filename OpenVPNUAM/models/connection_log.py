@@ -0,0 +1,121 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Models/ConnectionLog
+
+This file contains class for connection log entries.
+An entry records a single connection event of an OpenVPN client, entries
+are only inserted and never updated.
+"""
+
+# System imports
+import datetime
+import logging
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.model.connection_log')
+
+
+class ConnectionLog(object):
+  """Build an instance of the connection log program class
+  """
+
+  # constants for event kinds
+  EVENT_CONNECT = 'connect'
+  EVENT_DISCONNECT = 'disconnect'
+  EVENT_LEARN_ADDRESS = 'learn-address'
+  EVENTS = [EVENT_CONNECT, EVENT_DISCONNECT, EVENT_LEARN_ADDRESS]
+
+  def __init__(self, event, common_name, event_time=None):
+    """Constructor: Build a new connection log entry
+
+    @param event [str] the kind of event, see constants above
+    @param common_name [str] the common name of the client certificate
+    @param event_time [datetime] OPTIONNAL : the time of the event, default
+                to now
+    """
+    assert event in self.EVENTS
+    # database model
+    self._id = None
+    self._event = event
+    self._common_name = common_name
+    self._real_address = None
+    self._virtual_address = None
+    self._bytes_received = None
+    self._bytes_sent = None
+    if event_time is None:
+      event_time = datetime.datetime.today()
+    self._event_time = event_time
+
+  def load(self, attributes):
+    """Load a connection log entry with attributes
+
+    @param attributes [dict] : a key-value dict which contains attributs
+    to set to this ConnectionLog object
+    """
+    assert self._id is None
+    assert isinstance(attributes, dict)
+    # loop for each given attributes
+    for key in attributes:
+      if hasattr(self, "_" + key):
+        object.__setattr__(self, "_" + key, attributes[key])
+      else:
+        g_sys_log.error('Unknown attribute from source "' + key + '"')
+
+# Getters methods
+  def __getattr__(self, key):
+    """Upgrade default getter to allow get semi-private attributes
+    """
+    try:
+      return object.__getattribute__(self, "_" + key)
+    except AttributeError:
+      pass
+    return object.__getattribute__(self, key)
+
+# Setters methods
+  def __setattr__(self, key, value):
+    """Upgrade default setter to set semi-private attributes
+
+    Entries are never updated so no database update is triggered
+    """
+    if hasattr(self, "_" + key):
+      object.__setattr__(self, "_" + key, value)
+    else:
+      object.__setattr__(self, key, value)
+
+# DEBUG methods
+  def __str__(self):
+    """[DEBUG] Produce a description string for this connection log entry
+
+    @return [str] a formatted string that describe this entry
+    """
+    return ("CONNECTION LOG (" + str(self._id) + ")" +
+            "\n      EVENT = " + str(self._event) +
+            "\n      COMMON NAME = " + str(self._common_name) +
+            "\n      REAL ADDRESS = " + str(self._real_address) +
+            "\n      VIRTUAL ADDRESS = " + str(self._virtual_address) +
+            "\n      BYTES RECEIVED = " + str(self._bytes_received) +
+            "\n      BYTES SENT = " + str(self._bytes_sent) +
+            "\n      TIME = " + str(self._event_time))
@@ -54,6 +54,7 @@ class Hostname(object):
     self._id = None
     self._name = name
     self._period_days = None
+    self._key_type = None
     self._is_enabled = False
     self._is_online = False
     self._creation_time = datetime.datetime.today()
@@ -191,6 +192,21 @@ class Hostname(object):
     """
     return self.__l_certificate_soon_expired
 
+  def getLatestCertificate(self):
+    """Return the not yet expired certificate which ends the latest
+
+    @return [Certificate] the latest certificate
+            [None] if there is no available certificate
+    """
+    latest = None
+    for cert in (self.__l_certificate_soon_valid +
+                 self.__l_certificate_valid +
+                 self.__l_certificate_soon_expired):
+      if (latest is None or
+          latest.certificate_end_time < cert.certificate_end_time):
+        latest = cert
+    return latest
+
   def getCertificateValidCount(self):
     """Compute the total amount of certificate currently valid
 
@@ -201,6 +217,14 @@ class Hostname(object):
             len(self.__l_certificate_soon_expired))
 
 # Setters methods
+  def setOnline(self, online):
+    """Set the online status of this hostname
+
+    The online status is a runtime state which is not stored into database
+    @param online [bool] True if the hostname has at least one session
+    """
+    self._is_online = online
+
   def __setattr__(self, key, value):
     """Upgrade default setter to trigger database update
     """
@@ -254,16 +278,18 @@ class Hostname(object):
 
     self.loadCertificate(lst_all)
 
-  def addCertificate(self, cert):
+  def addCertificate(self, cert, realtime=True):
     """Try to add the given certificate into the local storage
 
     @param cert [Certificate] the certificate to add
+    @param realtime [bool] if False, the certificate id must have been
+          reserved before and its insert is queued into the database
     @return [bool] True is add success, False otherwise
     """
     # check if the certificate have already been given to database
-    if cert.id is None:
+    if cert.id is None or not realtime:
       cert.db = self.db
-      if not self.db.insert(cert, self, True):
+      if not self.db.insert(cert, self, realtime):
         return False
 
     # insert into local collection
@@ -279,6 +305,7 @@ class Hostname(object):
     content = ("  HOSTNAME (" + str(self._id) + ")" +
                "\n    NAME = " + str(self._name) +
                "\n    PERIOD (DAY) = " + str(self._period_days) +
+               "\n    KEY TYPE = " + str(self._key_type) +
                "\n    STATUS = " + str(self._is_enabled) +
                "\n    ONLINE STATUS = " + str(self._is_online) +
                "\n    CREATED ON = " + str(self._creation_time) +
@@ -39,10 +39,18 @@ import time
 
 # Projet Imports
 try:
+  from .authorization import AuthorizationServer
+  from .bandwidth import BandwidthAccounting
   from .config import OVPNUAMConfigParser
+  from .connections import ConnectionLogBuffer
+  from .connections import ConnectionLogMaintenance
   from .database import Database
+  from .management import ManagementClient
   from .pki import PublicKeyInfrastructure
   from .event import EventReceiver
+  from .scheduler import Scheduler
+  from .scheduler import ScheduledTask
+  from .status import StatusFileReader
 except Exception as e:
   print(str(e), file=sys.stderr)
   print("A project's module failed to be import", file=sys.stderr)
@@ -76,6 +84,15 @@ class OpenVPNUAM(object):
     self.__log_level = None
     self.__log_target = None
 
+    # the last published user list, the time of the next access window
+    # boundary and the generation of the revoked serials set, the users state
+    # is published again when one of them change
+    self.__l_user = None
+    self.__window_time = float('inf')
+    self.__revoked_generation = None
+    # the scheduler of the running main loop, stopped by the signals
+    self.__scheduler = None
+
   def load(self, config):
     """Load configuration function
 
@@ -157,6 +174,13 @@ class OpenVPNUAM(object):
     db = Database(self.cp)
     pki = PublicKeyInfrastructure(self.cp)
     ev = EventReceiver(self.cp)
+    events = ConnectionLogBuffer(self.cp)
+    auth = AuthorizationServer(self.cp, events)
+    mgmt = ManagementClient(self.cp)
+    bandwidth = BandwidthAccounting(self.cp)
+    maintenance = ConnectionLogMaintenance(self.cp)
+    scheduler = Scheduler(self.cp)
+    reader = None
 
 # INIT, CHECK REQUIREMENT, LOADING
     if not ev.load():
@@ -175,6 +199,31 @@ class OpenVPNUAM(object):
       g_sys_log.fatal('Error with PKI requirements')
       return
 
+    if not auth.load():
+      g_sys_log.fatal('Error during authorization server loading')
+      return
+
+    if not mgmt.load():
+      g_sys_log.fatal('Error during management client loading')
+      return
+
+    if not events.load() or not maintenance.load():
+      g_sys_log.fatal('Error during connection log loading')
+      return
+
+    if not bandwidth.load():
+      g_sys_log.fatal('Error during bandwidth accounting loading')
+      return
+
+    if not scheduler.load():
+      g_sys_log.fatal('Error during scheduler loading')
+      return
+
+    status_file = self.cp.get(self.cp.MANAGEMENT_SECTION, 'status_file',
+                              fallback='')
+    if len(status_file) > 0:
+      reader = StatusFileReader(status_file)
+
     # try to open database until it successfully open
     while not db.open():
       g_sys_log.error('Unable to access to database, wait for %s seconds',
@@ -183,17 +232,137 @@ class OpenVPNUAM(object):
 
 # MAIN RUNTIME LOOP
     try:
-
-
+      # publish the users state before answering to OpenVPN
+      self.__publishUsers(db, auth, mgmt)
+      if not auth.start():
+        g_sys_log.fatal('Error during authorization server starting')
+        return
+      mgmt.start(auth.index, bandwidth)
+      # apply the disabled users and hostnames without waiting for a poll
+      db.addUpdateListener(mgmt.onUpdate)
+      db.addUpdateListener(self.__onUpdate)
+
+      # register the periodic tasks, (name, function, interval, jitter,
+      # missed runs policy, delay before the first run)
+      l_task = [
+          ('poll', lambda: self.__publishUsers(db, auth, mgmt),
+           5.0, 0.0, ScheduledTask.MISSED_RUN_ONCE, None),
+          ('flush', lambda: self.__flushQueues(db, events, bandwidth),
+           5.0, 0.0, ScheduledTask.MISSED_RUN_ONCE, None),
+          ('renewal', lambda: pki.renewCertificates(db),
+           300.0, 30.0, ScheduledTask.MISSED_RUN_ONCE, 0.0),
+          ('crl', lambda: pki.publishRevocations(db),
+           300.0, 30.0, ScheduledTask.MISSED_RUN_ONCE, 0.0),
+          ('archive', lambda: pki.archiveExpiredCertificates(db),
+           86400.0, 3600.0, ScheduledTask.MISSED_SKIP, None),
+          ('reconcile', lambda: pki.reconcile(db),
+           86400.0, 3600.0, ScheduledTask.MISSED_SKIP, None),
+      ]
+      if reader is not None:
+        l_task.append(('status',
+                       lambda: self.__ingestStatus(reader, events, bandwidth,
+                                                   mgmt),
+                       10.0, 0.0, ScheduledTask.MISSED_RUN_ONCE, 0.0))
+      if maintenance.enabled:
+        l_task.append(('maintenance', lambda: maintenance.run(db),
+                       300.0, 30.0, ScheduledTask.MISSED_RUN_ONCE, None))
+      for (name, function, interval, jitter, missed, delay) in l_task:
+        if scheduler.addTask(name, function, interval, jitter, missed,
+                             delay) is None:
+          g_sys_log.fatal("Error during scheduling of task '%s'", name)
+          return
+
+      self.__scheduler = scheduler
+      scheduler.run()
     except SystemExit:
       return
     except KeyboardInterrupt:
       g_sys_log.error('## Abnormal termination ##')
     finally:
-      # close properly the database
+      self.__scheduler = None
+      # stop following the OpenVPN sessions
+      mgmt.stop()
+      # stop answering to OpenVPN hooks
+      auth.stop()
+      scheduler.logMetrics()
+      # stop PKI background activities
+      pki.stop()
+      # write the pending requests and close properly the database
       if db.status == db.OPEN:
+        try:
+          self.__flushQueues(db, events, bandwidth, True)
+        except Exception as e:
+          g_sys_log.error("Unable to write pending data : %s", str(e))
         db.close()
 
+  def __publishUsers(self, db, auth, mgmt):
+    """Publish the users state to the OpenVPN hooks and sessions
+
+    The authorization index is built again only when the database has been
+    polled again or when an access window boundary has been reached,
+    otherwise only the authorization snapshot is refreshed
+    @param db [Database] the database to read the users from
+    @param auth [AuthorizationServer] the server of the OpenVPN hooks
+    @param mgmt [ManagementClient] the client of the management interface
+    """
+    l_user = db.getUserList()
+    revoked = db.getRevokedSerialSet()
+    now = time.time()
+    if l_user is None or (l_user is self.__l_user and
+                          now < self.__window_time and
+                          revoked.generation == self.__revoked_generation):
+      auth.refresh()
+      return
+    windows = db.getAccessWindowIndex()
+    windows.advance(now)
+    auth.update(l_user, revoked, windows)
+    mgmt.update(l_user, revoked, windows)
+    self.__l_user = l_user
+    self.__window_time = windows.next_time
+    self.__revoked_generation = revoked.generation
+
+  def __onUpdate(self, field, value, obj):
+    """Publish the users state again at the next poll after a status change
+
+    @param field [str] the name of the updated attribute
+    @param value [object] the new value of the attribute
+    @param obj [object] the updated model instance
+    """
+    if field == 'is_enabled':
+      self.__l_user = None
+
+  def __flushQueues(self, db, events, bandwidth, force=False):
+    """Write the pending database requests, events and traffic
+
+    @param db [Database] the database to write into
+    @param events [ConnectionLogBuffer] the buffer of connection events
+    @param bandwidth [BandwidthAccounting] the traffic accounting
+    @param force [bool] OPTIONNAL : if True write the buffers even if they
+                are not full or old enough
+    """
+    db.flush()
+    events.flush(db, force)
+    bandwidth.flush(db, force)
+
+  def __ingestStatus(self, reader, events, bandwidth, mgmt):
+    """Read the sessions changes of the OpenVPN status file
+
+    The traffic of the status file is only accounted while the management
+    interface does not send the byte counters of the same sessions
+    @param reader [StatusFileReader] the reader of the status file
+    @param events [ConnectionLogBuffer] the buffer of connection events
+    @param bandwidth [BandwidthAccounting] the traffic accounting
+    @param mgmt [ManagementClient] the client of the management interface
+    """
+    changes = reader.read()
+    if changes is None:
+      return
+    events.addStatusChanges(changes)
+    if mgmt.counting:
+      bandwidth.removeStatusClients()
+    else:
+      bandwidth.addStatusClients(reader.clients, changes)
+
   def stop(self):
     """Stop properly the server after signal received
 
@@ -212,6 +381,10 @@ class OpenVPNUAM(object):
     """Make the program terminate after receving system signal
     """
     g_sys_log.debug("Caught system signal %d", signum)
+    # let the main loop end its current task
+    if self.__scheduler is not None:
+      self.__scheduler.stop()
+      return
     sys.exit(1)
 
   def __downgrade(self):
@@ -0,0 +1,294 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Expired certificate archival program class
+
+This class moves the files of long expired certificates out of the
+certificate directory. Files are packed by throttled batches into
+compressed tar archives, one or more per month of expiration, and each
+archived file is recorded into an append-only index before the loose files
+are removed.
+
+Index line format, tab separated :
+  serial extension archive member
+"""
+
+# System imports
+import collections
+import datetime
+import logging
+import os
+import tarfile
+import time
+
+# Project imports
+from .pki_manifest import PKIManifest, ManifestEntry
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.archive')
+
+# The place of an archived file
+ArchiveEntry = collections.namedtuple('ArchiveEntry', ['archive', 'member'])
+
+
+class PKIArchiver(object):
+  """Build an instance of the expired certificate archiver
+
+  This instance must be loaded by the PKI class
+  """
+
+  # the available compressions and the suffix of their archives
+  COMPRESSIONS = {'xz': '.tar.xz', 'gz': '.tar.gz'}
+
+  def __init__(self, confparser, filetree):
+    """Constructor : Build a new archiver
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    @param filetree [PKIFileTree] the certificate file tree
+    """
+    self.__cp = confparser
+    self.__ft = filetree
+    # the number of days after the expiration before archiving a certificate
+    # zero disable the archival
+    self.__retention_days = 0
+    # the directory into which archives are written
+    self.__directory = "archives/"
+    # the compression of archives
+    self.__compression = "xz"
+    # the maximum number of certificates archived in one batch
+    self.__batch_size = 200
+    # the number of seconds to wait between two batches
+    self.__batch_pause = 1.0
+    # the index of archived files by (serial, extension)
+    self.__d_index = dict()
+    self.__index_file = None
+
+  def load(self):
+    """Load the archival settings and the archive index
+
+    @return [bool] True if the archiver is ready to use
+    """
+    self.__retention_days = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'archive_retention_days',
+        fallback=self.__retention_days)
+    if self.__retention_days < 0:
+      g_sys_log.fatal("Option 'archive_retention_days' must be a positive" +
+                      " number")
+      return False
+
+    self.__compression = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'archive_compression',
+        fallback=self.__compression)
+    if self.__compression not in self.COMPRESSIONS:
+      g_sys_log.fatal("Invalid archive compression '%s', must be one of %s",
+                      self.__compression, ', '.join(self.COMPRESSIONS))
+      return False
+
+    self.__batch_size = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'archive_batch_size',
+        fallback=self.__batch_size)
+    self.__batch_pause = self.__cp.getfloat(
+        self.__cp.PKI_SECTION,
+        'archive_batch_pause',
+        fallback=self.__batch_pause)
+    if self.__batch_size <= 0 or self.__batch_pause < 0:
+      g_sys_log.fatal("Invalid archive batch settings")
+      return False
+
+    self.__directory = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'archive_directory',
+        fallback=self.__directory).rstrip('/') + '/'
+    if not os.path.isabs(self.__directory):
+      self.__directory = self.__ft.getCertificateDirectory() + self.__directory
+
+    if not self.enabled:
+      return True
+    if not self.__ft.makePath(self.__directory):
+      g_sys_log.fatal("Archive directory is invalid")
+      return False
+    try:
+      self.__loadIndex()
+    except (IOError, OSError) as e:
+      g_sys_log.fatal("Unable to load archive index : %s", str(e))
+      return False
+    return True
+
+  def close(self):
+    """Close the archive index
+    """
+    if self.__index_file is not None:
+      self.__index_file.close()
+      self.__index_file = None
+
+  @property
+  def enabled(self):
+    """Return the activation status of the archival
+
+    @return [bool] True if expired certificates are archived
+    """
+    return self.__retention_days > 0
+
+  def getArchiveEntry(self, serial, extension):
+    """Return the place of an archived file
+
+    @param serial [int] the certificate serial
+    @param extension [str] the type of the file (key, csr or crt)
+    @return [ArchiveEntry] the archive path and the member name of the file
+            [None] if the file is not archived
+    """
+    return self.__d_index.get((serial, extension))
+
+# Tools
+  def __loadIndex(self):
+    """Read the archive index and open it for appending
+    """
+    path = self.__directory + 'index'
+    self.__d_index.clear()
+    if os.path.exists(path):
+      with open(path, 'r') as f:
+        for line in f:
+          fields = line.rstrip('\n').split('\t')
+          if not line.endswith('\n') or len(fields) != 4:
+            g_sys_log.warning("Ignore invalid archive index line '%s'",
+                              line.rstrip('\n'))
+            continue
+          self.__d_index[(int(fields[0]), fields[1])] = ArchiveEntry(
+              self.__directory + fields[2], fields[3])
+    self.__index_file = open(path, 'a')
+
+  def __newArchivePath(self, month):
+    """Return the path of a new archive for the given month
+
+    @param month [str] the month of expiration, as YYYY-MM
+    @return [str] the name of the new archive
+    """
+    suffix = self.COMPRESSIONS[self.__compression]
+    part = 0
+    while True:
+      name = "certificates-{}-{:04d}{}".format(month, part, suffix)
+      if not os.path.exists(self.__directory + name):
+        return name
+      part += 1
+
+  def __archiveBatch(self, month, l_entry):
+    """Pack a batch of files into a new archive then remove them
+
+    @param month [str] the month of expiration, as YYYY-MM
+    @param l_entry [list<ManifestEntry>] the files to archive
+    @return [int] the number of archived files
+    """
+    name = self.__newArchivePath(month)
+    path = self.__directory + name
+    l_archived = []
+    try:
+      with tarfile.open(path + '.tmp', 'w:' + self.__compression) as tar:
+        for entry in l_entry:
+          member = "{}/{}/{}.{}".format(entry.user_id, entry.hostname_id,
+                                        entry.serial, entry.extension)
+          try:
+            tar.add(self.__ft.getManifestEntryPath(entry), arcname=member)
+          except (IOError, OSError) as e:
+            g_sys_log.error("Unable to archive file '%s' : %s",
+                            self.__ft.getManifestEntryPath(entry), str(e))
+            continue
+          l_archived.append((entry, member))
+      with open(path + '.tmp', 'rb') as f:
+        os.fsync(f.fileno())
+      os.rename(path + '.tmp', path)
+    except (IOError, OSError, tarfile.TarError) as e:
+      g_sys_log.error("Unable to write archive '%s' : %s", path, str(e))
+      try:
+        os.remove(path + '.tmp')
+      except OSError:
+        pass
+      return 0
+
+    # the index must be on disk before the loose files are removed
+    self.__index_file.write(''.join([
+        "{}\t{}\t{}\t{}\n".format(entry.serial, entry.extension, name, member)
+        for (entry, member) in l_archived]))
+    self.__index_file.flush()
+    os.fsync(self.__index_file.fileno())
+    for (entry, member) in l_archived:
+      self.__d_index[(entry.serial, entry.extension)] = ArchiveEntry(path,
+                                                                    member)
+    self.__ft.removePKIUserFiles([entry for (entry, member) in l_archived])
+    return len(l_archived)
+
+# API
+  def run(self, l_row):
+    """Archive the files of all certificates expired since the retention period
+
+    @param l_row [list<dict>] the certificates rows, see
+                              Adapter.getCertificateSnapshot
+    @return [int] the number of archived files
+    """
+    if not self.enabled:
+      return 0
+    self.__ft.flush()
+    manifest = self.__ft.manifest
+    limit = (datetime.datetime.today() -
+             datetime.timedelta(days=self.__retention_days))
+
+    # group the files to archive by month of expiration
+    d_month = collections.defaultdict(list)
+    for row in l_row:
+      end = row['certificate_end_time']
+      if not isinstance(end, datetime.datetime) or end >= limit:
+        continue
+      l_entry = []
+      for ext in PKIManifest.EXTENSIONS:
+        if manifest.enabled:
+          entry = manifest.getEntry(row['id'], ext)
+        else:
+          entry = ManifestEntry(row['user_id'], row['hostname_id'], row['id'],
+                                ext, None, None)
+          if not os.path.exists(self.__ft.getManifestEntryPath(entry)):
+            entry = None
+        if entry is not None:
+          l_entry.append(entry)
+      if len(l_entry) > 0:
+        d_month[end.strftime('%Y-%m')].append(l_entry)
+
+    count = 0
+    first = True
+    for month in sorted(d_month):
+      l_cert = d_month[month]
+      for i in range(0, len(l_cert), self.__batch_size):
+        # leave the file system to other tasks between two batches
+        if not first:
+          time.sleep(self.__batch_pause)
+        first = False
+        count += self.__archiveBatch(
+            month,
+            [entry for l_entry in l_cert[i:i + self.__batch_size]
+             for entry in l_entry])
+    if count > 0:
+      g_sys_log.info("Archived %d files of expired certificates", count)
+    return count
@@ -0,0 +1,443 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Certificate revocation list program class
+
+This class publishes the revoked certificates as CRLs. It is fed by the
+revoked serials set of the database and keeps the sorted list of revoked
+serials, it signs the full base CRL only when it becomes
+older than the rebuild interval. Between two rebuilds, revocations are
+published in a small delta CRL which only contains the certificates
+revoked since the base CRL.
+
+Revocations can also be published as a directory for the OpenVPN
+'crl-verify <dir> dir' mode, in which each revoked certificate is a file
+named after its decimal serial.
+"""
+
+# System imports
+import bisect
+import datetime
+import logging
+import os
+
+try:
+  from cryptography import x509
+  from cryptography.hazmat.backends import default_backend
+  from cryptography.hazmat.primitives import hashes
+  from cryptography.hazmat.primitives import serialization
+except ImportError:
+  x509 = None
+try:
+  from cryptography.hazmat.primitives.asymmetric import ed25519
+except ImportError:
+  ed25519 = None
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.crl')
+
+
+class PKICRLBuilder(object):
+  """Build an instance of the CRL publisher
+
+  This instance must be loaded by the PKI class
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build a new CRL publisher
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    # the path of the base CRL, None if CRLs are disabled
+    self.__crl_file = None
+    # the path of the delta CRL
+    self.__delta_file = None
+    # the number of hours between two rebuilds of the base CRL
+    self.__base_interval = 24
+    # the number of hours during which a published CRL is valid
+    self.__validity = 48
+    # the CA certificate and key as cryptography objects
+    self.__ca = None
+    self.__ca_key = None
+    self.__algorithm = None
+    # the last used CRL number
+    self.__crl_number = 0
+    # the CRL number and the signing time of the current base CRL
+    self.__base_number = None
+    self.__base_time = None
+    # the sorted list of serials contained into the base CRL
+    self.__l_base = []
+    # the sorted list of currently revoked serials
+    self.__l_revoked = []
+    # the revocation (time, reason) of each revoked serial
+    self.__d_revoked = dict()
+    # the sorted list of serials contained into the published delta CRL
+    self.__l_delta = []
+    # the generation of the revoked serials set of the last update
+    self.__generation = None
+
+  def load(self, ca, ca_key, digest):
+    """Load the CRL settings
+
+    @param ca [X509] the certificate authority
+    @param ca_key [PKey] the private key of the certificate authority
+    @param digest [str] the name of the signature digest
+    @return [bool] True if the settings are valid
+    """
+    path = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'crl_file',
+        fallback='')
+    if len(path) == 0:
+      return True
+    if x509 is None:
+      g_sys_log.fatal("Module cryptography is required to build CRLs")
+      return False
+    self.__crl_file = path
+    self.__delta_file = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'crl_delta_file',
+        fallback=os.path.splitext(path)[0] + '-delta.pem')
+
+    self.__base_interval = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'crl_base_interval',
+        fallback=self.__base_interval)
+    self.__validity = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'crl_validity',
+        fallback=self.__validity)
+    if self.__base_interval <= 0 or self.__validity < self.__base_interval:
+      g_sys_log.fatal("Option 'crl_validity' must be greater than" +
+                      " 'crl_base_interval'")
+      return False
+
+    self.__ca = ca.to_cryptography()
+    self.__ca_key = ca_key.to_cryptography_key()
+    if ed25519 is not None and isinstance(self.__ca_key,
+                                          ed25519.Ed25519PrivateKey):
+      self.__algorithm = None
+    else:
+      try:
+        self.__algorithm = getattr(hashes, digest.upper())()
+      except (AttributeError, TypeError):
+        g_sys_log.fatal("Digest '%s' cannot be used to sign CRLs", digest)
+        return False
+    self.__crl_number = self.__readCRLNumber()
+    return True
+
+  @property
+  def enabled(self):
+    """Return the activation status of the CRL publication
+
+    @return [bool] True if CRLs are published
+    """
+    return self.__crl_file is not None
+
+  @property
+  def revoked(self):
+    """Return the currently revoked serials
+
+    @return [list] the sorted list of revoked serials
+    """
+    return self.__l_revoked
+
+# Tools
+  def __readCRLNumber(self):
+    """Read the last used CRL number
+
+    @return [int] the last CRL number, zero if unknown
+    """
+    try:
+      with open(self.__crl_file + '.number', 'r') as f:
+        return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+      return 0
+
+  def __nextCRLNumber(self):
+    """Take and save the next CRL number
+
+    CRL numbers must always increase, even across restarts
+    @return [int] the new CRL number
+    """
+    self.__crl_number += 1
+    self.__writeFile(self.__crl_file + '.number',
+                     str(self.__crl_number).encode())
+    return self.__crl_number
+
+  @staticmethod
+  def __writeFile(path, content):
+    """Replace atomically the content of a file
+
+    @param path [str] the path of the file
+    @param content [bytes] the new content
+    """
+    with open(path + '.tmp', 'wb') as f:
+      f.write(content)
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(path + '.tmp', path)
+
+  def __sign(self, l_serial, now, delta_of=None):
+    """Build and sign a CRL
+
+    @param l_serial [list] the serials to put into the CRL
+    @param now [datetime] the signing time
+    @param delta_of [int] OPTIONNAL : the number of the base CRL if the new
+                          CRL is a delta CRL
+    @return [tuple] the (number, PEM bytes) of the CRL
+    """
+    number = self.__nextCRLNumber()
+    builder = x509.CertificateRevocationListBuilder()
+    builder = builder.issuer_name(self.__ca.subject)
+    builder = builder.last_update(now)
+    builder = builder.next_update(now +
+                                  datetime.timedelta(hours=self.__validity))
+    builder = builder.add_extension(x509.CRLNumber(number), critical=False)
+    if delta_of is not None:
+      builder = builder.add_extension(x509.DeltaCRLIndicator(delta_of),
+                                      critical=True)
+    for serial in l_serial:
+      (time, reason) = self.__d_revoked[serial]
+      revoked = x509.RevokedCertificateBuilder().serial_number(serial)
+      revoked = revoked.revocation_date(time)
+      if reason is not None:
+        revoked = revoked.add_extension(x509.CRLReason(reason),
+                                        critical=False)
+      builder = builder.add_revoked_certificate(
+          revoked.build(default_backend()))
+    crl = builder.sign(self.__ca_key, self.__algorithm, default_backend())
+    return (number, crl.public_bytes(serialization.Encoding.PEM))
+
+  @staticmethod
+  def __toUTC(value):
+    """Return a timezone aware UTC time
+
+    The times without timezone are UTC times, like all stored times
+    @param value [datetime] the time
+    @return [datetime] the UTC time
+    """
+    if value.tzinfo is None:
+      return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+  @staticmethod
+  def __parseReason(reason):
+    """Convert a stored revocation reason to a CRL reason
+
+    @param reason [str] the reason as stored in database
+    @return [x509.ReasonFlags] the CRL reason
+            [None] if it is unspecified
+    """
+    if reason is None:
+      return None
+    try:
+      flag = x509.ReasonFlags(reason)
+    except ValueError:
+      return None
+    if flag == x509.ReasonFlags.unspecified:
+      return None
+    return flag
+
+  @staticmethod
+  def __contains(l_sorted, serial):
+    """Check if a serial belongs to a sorted list of serials
+
+    @param l_sorted [list] the sorted list
+    @param serial [int] the serial to look for
+    @return [bool] True if the serial is in the list
+    """
+    i = bisect.bisect_left(l_sorted, serial)
+    return i < len(l_sorted) and l_sorted[i] == serial
+
+# API
+  def update(self, revoked, now=None):
+    """Publish the revocations of the given revoked serials set
+
+    The base CRL is signed again when it is older than the rebuild interval,
+    otherwise only the delta CRL is signed, and only if the revoked set has
+    changed since the last publication. Nothing is computed while the set
+    keeps the same generation and the base CRL is recent enough
+    @param revoked [RevokedSerialSet] the revoked serials of the database
+    @param now [datetime] OPTIONNAL : the publication time
+    @return [tuple] the (list of newly revoked serials, list of serials which
+                    are no longer revoked) since the previous update
+    """
+    if now is None:
+      now = datetime.datetime.utcnow().replace(microsecond=0)
+    now = self.__toUTC(now)
+    base_due = (self.__base_time is None or
+                now - self.__base_time >= datetime.timedelta(
+                    hours=self.__base_interval))
+    if revoked.generation == self.__generation and not base_due:
+      return ([], [])
+    self.__generation = revoked.generation
+
+    d_revoked = dict()
+    for serial in revoked:
+      row = revoked.getRevocation(serial)
+      end = row.get('certificate_end_time')
+      # expired certificates don't need to stay in CRLs
+      if isinstance(end, datetime.datetime) and self.__toUTC(end) < now:
+        continue
+      time = row['revoked_time']
+      time = self.__toUTC(time) if isinstance(time, datetime.datetime) else now
+      d_revoked[serial] = (time, self.__parseReason(row.get('revoked_reason')))
+    l_added = sorted(set(d_revoked) - set(self.__d_revoked))
+    l_removed = sorted(set(self.__d_revoked) - set(d_revoked))
+    self.__d_revoked = d_revoked
+    self.__l_revoked = sorted(d_revoked)
+    if not self.enabled:
+      return (l_added, l_removed)
+
+    try:
+      if base_due or len(l_removed) > 0:
+        (self.__base_number, content) = self.__sign(self.__l_revoked, now)
+        self.__writeFile(self.__crl_file, content)
+        self.__base_time = now
+        self.__l_base = list(self.__l_revoked)
+        # an empty delta tells that the base is up to date
+        (number, content) = self.__sign([], now, self.__base_number)
+        self.__writeFile(self.__delta_file, content)
+        self.__l_delta = []
+        g_sys_log.info("Published base CRL %d with %d revoked certificates",
+                       self.__base_number, len(self.__l_base))
+      elif len(l_added) > 0:
+        # serials revoked since the base CRL
+        l_delta = [serial for serial in self.__l_revoked
+                   if not self.__contains(self.__l_base, serial)]
+        (number, content) = self.__sign(l_delta, now, self.__base_number)
+        self.__writeFile(self.__delta_file, content)
+        self.__l_delta = l_delta
+        g_sys_log.info("Published delta CRL %d of base %d with %d revoked" +
+                       " certificates", number, self.__base_number,
+                       len(l_delta))
+    except (IOError, OSError) as e:
+      g_sys_log.error("Unable to publish CRL : %s", str(e))
+    return (l_added, l_removed)
+
+  def isRevoked(self, serial):
+    """Check if a certificate is revoked
+
+    @param serial [int] the certificate serial
+    @return [bool] True if the certificate is revoked
+    """
+    return self.__contains(self.__l_revoked, serial)
+
+
+class PKICRLDirectory(object):
+  """Build an instance of the revocation directory publisher
+
+  This instance must be loaded by the PKI class
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build a new revocation directory publisher
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    # the path of the directory, None if it is disabled
+    self.__directory = None
+    # the set of serials which have a file into the directory
+    self.__s_serial = set()
+
+  def load(self):
+    """Load the directory settings and list its current files
+
+    @return [bool] True if the directory is ready to use
+    """
+    path = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'crl_directory',
+        fallback='')
+    if len(path) == 0:
+      return True
+    self.__directory = path.rstrip('/') + '/'
+    try:
+      os.makedirs(self.__directory, exist_ok=True)
+      self.__s_serial = set([int(name)
+                             for name in os.listdir(self.__directory)
+                             if name.isdigit()])
+    except OSError as e:
+      g_sys_log.fatal("Revocation directory '%s' is invalid : %s",
+                      self.__directory, str(e))
+      return False
+    return True
+
+  @property
+  def enabled(self):
+    """Return the activation status of the revocation directory
+
+    @return [bool] True if revocations are published into the directory
+    """
+    return self.__directory is not None
+
+# API
+  def update(self, l_revoked):
+    """Make the directory match the given revoked serials
+
+    Only the files of the serials which have changed are created or removed.
+    Files are created under a temporary name then renamed
+    @param l_revoked [list] the currently revoked serials
+    @return [tuple] the (number of created files, number of removed files)
+    """
+    if not self.enabled:
+      return (0, 0)
+    s_revoked = set(l_revoked)
+    l_added = sorted(s_revoked - self.__s_serial)
+    l_removed = sorted(self.__s_serial - s_revoked)
+    for serial in l_added:
+      path = self.__directory + str(serial)
+      try:
+        with open(self.__directory + '.' + str(serial) + '.tmp', 'w'):
+          pass
+        os.rename(self.__directory + '.' + str(serial) + '.tmp', path)
+      except (IOError, OSError) as e:
+        g_sys_log.error("Unable to create revocation file '%s' : %s",
+                        path, str(e))
+        continue
+      self.__s_serial.add(serial)
+    for serial in l_removed:
+      path = self.__directory + str(serial)
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      except OSError as e:
+        g_sys_log.error("Unable to remove revocation file '%s' : %s",
+                        path, str(e))
+        continue
+      self.__s_serial.discard(serial)
+    if len(l_added) + len(l_removed) > 0:
+      fd = os.open(self.__directory, os.O_RDONLY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+      g_sys_log.info("Revocation directory updated, %d added and %d removed",
+                     len(l_added), len(l_removed))
+    return (len(l_added), len(l_removed))
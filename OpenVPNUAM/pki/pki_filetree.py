@@ -24,12 +24,21 @@
 
 """PKI - Public Key Infrastructure File Tree program class
 
-This class is responsive of management of all SSL files
+This class is responsive of management of all SSL files.
+Files are written under a temporary name, synced then renamed so a crash
+never leaves a partially written file. When the writer thread is enabled,
+writes are queued and processed by batch in background, each batch sharing
+the same directory syncs. All certificate files are recorded into the
+store manifest once they are on disk.
 """
 
 # System imports
+import collections
+import hashlib
 import logging
 import os
+import shutil
+import threading
 
 import OpenSSL
 from OpenSSL import crypto
@@ -37,6 +46,7 @@ from OpenSSL.crypto import (_lib as lib, _ffi as ffi)
 
 # Project imports
 from ..config import Error
+from .pki_manifest import PKIManifest, ManifestEntry
 
 # Global project declarations
 g_sys_log = logging.getLogger('openvpn-uam.pki.file')
@@ -48,6 +58,15 @@ class PKIFileTree(object):
   This instance must be called in the openvpn uam program class
   """
 
+  # constants for queued file operations
+  OP_WRITE = 0
+  OP_LINK = 1
+  # the maximum number of hashed directory levels, each level use two
+  # hexadecimal characters of the user id hash
+  FANOUT_MAX = 4
+  # the name prefix of user directories during a layout migration
+  MIGRATE_PREFIX = '.migrate-'
+
   def __init__(self, confparser):
     """Constructor : Build a new PKI API instance
     """
@@ -56,12 +75,35 @@ class PKIFileTree(object):
     self.__new_cert_directory = "certificates/"
     # the cipher to use for private key encryption
     self.__cipher = "DES3"
+    # the number of hashed directory levels above user directories
+    self.__fanout = 0
+    # the set of directories which are known to exist
+    self.__s_directory = set()
+    # a boolean which determine if files are written by a background thread
+    self.__writer_thread = True
+    # the maximum number of file operations processed in one batch
+    self.__writer_batch_size = 64
+    # the record of all stored certificate files
+    self.__manifest = PKIManifest(confparser)
+    # the list of pending file operations as tuple (op, arg1, arg2, entry)
+    self.__l_operation = collections.deque()
+    # the number of file operations currently processed
+    self.__in_progress = 0
+    # the number of queued or processed operations by destination path
+    self.__d_pending = collections.Counter()
+    # the condition used to wake up the writer thread and the flush waiters
+    self.__condition = threading.Condition()
+    self.__thread = None
+    self.__stop = False
 
-  def load(self):
+  def load(self, seed_manifest=True):
     """Return a boolean indicates if PKI is ready to work or not
 
     This function check things required by PKI working and return a boolean
     that indicates if the PKI is ready to work with certificate or not
+    @param seed_manifest [bool] OPTIONNAL : if False a new manifest is not
+                  filled with the existing files, as the tree is not yet in
+                  the configured layout
     @return [bool] The ready status
     """
 
@@ -87,62 +129,595 @@ class PKIFileTree(object):
       g_sys_log.fatal("Invalid cipher name")
       return False
 
+    self.__fanout = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'cert_directory_fanout',
+        fallback=self.__fanout)
+    if not 0 <= self.__fanout <= self.FANOUT_MAX:
+      g_sys_log.fatal("Option 'cert_directory_fanout' must be between 0 and " +
+                      str(self.FANOUT_MAX))
+      return False
+
+    self.__writer_thread = self.__cp.getboolean(
+        self.__cp.PKI_SECTION,
+        'file_writer_thread',
+        fallback=self.__writer_thread)
+
+    self.__writer_batch_size = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'file_writer_batch_size',
+        fallback=self.__writer_batch_size)
+    if self.__writer_batch_size <= 0:
+      g_sys_log.fatal("Option 'file_writer_batch_size' must be a positive" +
+                      " number")
+      return False
+
     if not self.makePath(self.__new_cert_directory):
       g_sys_log.fatal("Certificate directory is invalid")
       return False
+
+    if not self.__manifest.load(self.__new_cert_directory):
+      g_sys_log.fatal("Certificate store manifest is invalid")
+      return False
+    if seed_manifest:
+      self.__seedManifest()
     return True
 
+  def __seedManifest(self):
+    """Record all files of an existing store into a new manifest
+
+    This is made once, when the manifest is enabled on a certificate
+    directory which already contains user directories
+    """
+    if (not self.__manifest.enabled or not self.__manifest.created or
+        len(self.__manifest) > 0):
+      return
+    l_change = []
+    for (user_id, path) in self.listPKIUserDirectories():
+      try:
+        for h_entry in os.scandir(path):
+          if not h_entry.name.isdigit() or not h_entry.is_dir():
+            continue
+          for f_entry in os.scandir(h_entry.path):
+            (name, ext) = os.path.splitext(f_entry.name)
+            ext = ext.lstrip('.')
+            if not name.isdigit() or ext not in PKIManifest.EXTENSIONS:
+              continue
+            (size, digest) = self.digestFile(f_entry.path)
+            l_change.append((PKIManifest.OP_ADD,
+                             ManifestEntry(user_id, int(h_entry.name),
+                                           int(name), ext, size, digest)))
+      except (IOError, OSError) as e:
+        g_sys_log.error("Unable to scan user directory '%s' : %s", path,
+                        str(e))
+    if len(l_change) > 0:
+      g_sys_log.info("Recording %d existing files into the new manifest",
+                     len(l_change))
+      self.__manifest.record(l_change)
+
+  @property
+  def manifest(self):
+    """Return the manifest of the certificate store
+
+    @return [PKIManifest] the manifest
+    """
+    return self.__manifest
+
 # Tools
   def makePath(self, path):
     """Ensure that the given path is builded on the file system
 
+    Directories which have already been checked are cached so the file system
+    is only queried once for each of them
     @param path [str] the path to check for
     @return [bool] True if the entire path is existing on the FS
                    False if an error happen
     """
-    p = ""
-    for folder in path.split('/'):
-      if len(folder) == 0:
+    path = os.path.normpath(path)
+    if path in self.__s_directory:
+      return True
+    if not os.path.exists(path):
+      # create it
+      g_sys_log.info("Creating directory '%s'", path + '/')
+      try:
+        os.makedirs(path, exist_ok=True)
+      except OSError as e:
+        g_sys_log.error("Unable to create directory '%s' : %s",
+                        path + '/', str(e))
+        return False
+    # if cert path already exist
+    # check if it is a valid directory
+    elif not os.path.isdir(path):
+      g_sys_log.error("File '%s' is not a directory", path + '/')
+      return False
+    self.__s_directory.add(path)
+    return True
+
+  @staticmethod
+  def __syncDirectory(path):
+    """Flush the entries of a directory to the disk
+
+    @param path [str] the path of the directory
+    """
+    try:
+      fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+      g_sys_log.error("Unable to open directory '%s' : %s", path, str(e))
+      return
+    try:
+      os.fsync(fd)
+    except OSError as e:
+      g_sys_log.error("Unable to sync directory '%s' : %s", path, str(e))
+    finally:
+      os.close(fd)
+
+  @staticmethod
+  def __discardFile(f, path):
+    """Close a temporary file and remove it, ignoring errors
+
+    @param f [file] the open file object, can be None
+    @param path [str] the path of the file to remove
+    """
+    if f is not None:
+      try:
+        f.close()
+      except (IOError, OSError):
+        pass
+    PKIFileTree.__removeFile(path)
+
+  @staticmethod
+  def __removeFile(path):
+    """Remove a file and ignore error if it does not exist
+
+    @param path [str] the path of the file to remove
+    """
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+  @staticmethod
+  def digestFile(path):
+    """Return the size and the digest of a file
+
+    @param path [str] the path of the file
+    @return [tuple] the (size, sha256 hexdigest) of the file
+    """
+    with open(path, 'rb') as f:
+      content = f.read()
+    return (len(content), hashlib.sha256(content).hexdigest())
+
+  def __processOperations(self, l_op):
+    """Execute a batch of file operations
+
+    All contents are first written to temporary files, then all these files
+    are synced, renamed to their final names and at last each modified
+    directory is synced once before the files are recorded into the manifest
+    @param l_op [list] the list of file operations as tuple
+                      (op, arg1, arg2, entry)
+    """
+    l_tmp = []
+    l_change = []
+    s_dir = set()
+    # write all temporary files
+    for (op, arg1, arg2, entry) in l_op:
+      if op != self.OP_WRITE:
+        continue
+      (content, path) = (arg1, arg2)
+      directory = os.path.dirname(path) or '.'
+      if os.path.exists(path) or not self.makePath(directory):
+        g_sys_log.error("Error during export of file '%s'.", path)
         continue
-      p += folder + '/'
-      if not os.path.exists(p):
-        # create it
-        g_sys_log.info("Creating directory '%s'", p)
+      tmp = os.path.join(directory, '.' + os.path.basename(path) + '.tmp')
+      f = None
+      try:
+        if isinstance(content, bytes):
+          # open output file in binary mode
+          f = open(tmp, "wb")
+        else:
+          # open output file in text mode
+          f = open(tmp, "wt")
+        f.write(content)
+      except (IOError, OSError) as e:
+        g_sys_log.error("Unable to write file '%s' : %s", tmp, str(e))
+        self.__discardFile(f, tmp)
+        continue
+      if entry is not None:
+        if isinstance(content, str):
+          content = content.encode()
+        entry = entry._replace(size=len(content),
+                               digest=hashlib.sha256(content).hexdigest())
+      l_tmp.append((f, tmp, path, entry))
+
+    # sync then rename them
+    for (f, tmp, path, entry) in l_tmp:
+      try:
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(tmp, path)
+        s_dir.add(os.path.dirname(tmp) or '.')
+        if entry is not None:
+          l_change.append((PKIManifest.OP_ADD, entry))
+      except (IOError, OSError) as e:
+        g_sys_log.error("Unable to store file '%s' : %s", path, str(e))
+        self.__discardFile(f, tmp)
+
+    # links are made after writes because their source can be in this batch
+    for (op, arg1, arg2, entry) in l_op:
+      if op != self.OP_LINK:
+        continue
+      (src_path, dst_path) = (arg1, arg2)
+      if os.path.exists(dst_path):
+        g_sys_log.error("Error during export of file '%s'.", dst_path)
+        continue
+      try:
+        os.link(src_path, dst_path)
+      except OSError:
         try:
-          os.mkdir(p)
-        except OSError as e:
-          g_sys_log.error("File '%s' already exist", p)
-          return False
-      # if cert path already exist
-      else:
-        # check if it is a valid directory
-        if not os.path.isdir(p):
-          g_sys_log.error("File '%s' is not a directory", p)
-          return False
-    return True
+          shutil.copy2(src_path, dst_path)
+        except (IOError, OSError) as e:
+          g_sys_log.error("Unable to copy file '%s' to '%s' : %s",
+                          src_path, dst_path, str(e))
+          continue
+      s_dir.add(os.path.dirname(dst_path) or '.')
+      if entry is not None:
+        (size, digest) = self.digestFile(dst_path)
+        l_change.append((PKIManifest.OP_ADD,
+                         entry._replace(size=size, digest=digest)))
+
+    for directory in s_dir:
+      self.__syncDirectory(directory)
+    self.__manifest.record(l_change)
+
+  def __queueOperation(self, op, arg1, arg2, entry=None):
+    """Register a new file operation
+
+    The operation is processed immediatly if the writer thread is not running
+    @param op [int] the operation type, see constants above
+    @param arg1 the first operation argument
+    @param arg2 the second operation argument
+    @param entry [ManifestEntry] OPTIONNAL : the manifest entry of the file,
+                  its size and digest are computed when the file is stored
+    """
+    if self.__thread is None:
+      self.__processOperations([(op, arg1, arg2, entry)])
+      return
+    with self.__condition:
+      self.__l_operation.append((op, arg1, arg2, entry))
+      self.__d_pending[arg2] += 1
+      self.__condition.notify_all()
+
+  def __run(self):
+    """Background writing loop
+
+    Wait for queued file operations and process them by batch
+    """
+    g_sys_log.debug("File writer thread started")
+    while True:
+      with self.__condition:
+        while not self.__stop and len(self.__l_operation) == 0:
+          self.__condition.wait()
+        if len(self.__l_operation) == 0:
+          break
+        l_op = []
+        while (len(self.__l_operation) > 0 and
+               len(l_op) < self.__writer_batch_size):
+          l_op.append(self.__l_operation.popleft())
+        self.__in_progress = len(l_op)
+      try:
+        self.__processOperations(l_op)
+      finally:
+        with self.__condition:
+          self.__in_progress = 0
+          for (op, arg1, arg2, entry) in l_op:
+            self.__d_pending[arg2] -= 1
+            if self.__d_pending[arg2] <= 0:
+              del self.__d_pending[arg2]
+          self.__condition.notify_all()
+    g_sys_log.debug("File writer thread stopped")
 
 # API
-  def storeBytesToFile(self, content, path):
+  def start(self):
+    """Start the background writer thread if it is enabled
+    """
+    if not self.__writer_thread or self.__thread is not None:
+      return
+    self.__stop = False
+    self.__thread = threading.Thread(target=self.__run,
+                                     name='pki-filewriter',
+                                     daemon=True)
+    self.__thread.start()
+
+  def stop(self):
+    """Stop the background writer thread
+
+    All pending file operations are processed before the thread exits
+    """
+    if self.__thread is not None:
+      with self.__condition:
+        self.__stop = True
+        self.__condition.notify_all()
+      self.__thread.join()
+      self.__thread = None
+    self.__manifest.close()
+
+  def flush(self):
+    """Wait until all pending file operations are processed
+    """
+    if self.__thread is None:
+      return
+    with self.__condition:
+      while len(self.__l_operation) > 0 or self.__in_progress > 0:
+        self.__condition.wait()
+
+  def __flushPath(self, path):
+    """Wait until the pending file operations on a path are processed
+
+    @param path [str] the destination path of the operations
+    """
+    if self.__thread is None:
+      return
+    with self.__condition:
+      while path in self.__d_pending:
+        self.__condition.wait()
+
+  def storeBytesToFile(self, content, path, entry=None):
     """Write a list of bytes into a file
 
     @param content [bytes/str] the content to write into the file
     @param path [str] the path to the file into
+    @param entry [ManifestEntry] OPTIONNAL : the manifest entry of the file
     """
-    f = None
-    if os.path.exists(path):
-      g_sys_log.error("Error during export of file '%s'.", path)
-      return
+    assert isinstance(content, (bytes, str))
+    self.__queueOperation(self.OP_WRITE, content, path, entry)
 
-    if isinstance(content, bytes):
-      # open output file in binary mode
-      f = open(path, "wb")
-    elif isinstance(content, str):
-      # open output file in text mode
-      f = open(path, "wt")
-    assert f is not None
+  def removePKIUserFiles(self, l_entry):
+    """Remove a list of certificate files and unrecord them from the manifest
 
-    f.write(content)
-    f.close()
+    @param l_entry [list<ManifestEntry>] the files to remove
+    """
+    self.flush()
+    l_change = []
+    s_dir = set()
+    for entry in l_entry:
+      path = self.getManifestEntryPath(entry)
+      try:
+        os.remove(path)
+      except OSError as e:
+        g_sys_log.error("Unable to remove file '%s' : %s", path, str(e))
+        continue
+      s_dir.add(os.path.dirname(path))
+      l_change.append((PKIManifest.OP_REMOVE, entry))
+    for directory in s_dir:
+      self.__syncDirectory(directory)
+    self.__manifest.record(l_change)
+
+  def checkManifest(self):
+    """Compare all files recorded in the manifest with the file system
+
+    @return [list] the list of invalid files as tuple (ManifestEntry, reason)
+    """
+    self.flush()
+    l_invalid = []
+    for entry in self.__manifest:
+      try:
+        (size, digest) = self.digestFile(self.getManifestEntryPath(entry))
+      except (IOError, OSError):
+        l_invalid.append((entry, 'missing'))
+        continue
+      if size != entry.size or digest != entry.digest:
+        l_invalid.append((entry, 'modified'))
+    return l_invalid
+
+  def getFanoutPrefix(self, user_id, levels=None):
+    """Return the hashed directories under which a user directory is stored
+
+    @param user_id [int] the id of the user
+    @param levels [int] OPTIONNAL : the number of hashed levels, default to
+                        the configured one
+    @return [str] the relative prefix, empty if there is no fan-out
+    """
+    if levels is None:
+      levels = self.__fanout
+    digest = hashlib.sha1(str(user_id).encode()).hexdigest()
+    return ''.join([digest[2 * i:2 * i + 2] + '/' for i in range(levels)])
+
+  def getPKIUserDirectory(self, user_id, levels=None):
+    """Return the directory which contains all files of a user
+
+    @param user_id [int] the id of the user
+    @param levels [int] OPTIONNAL : the number of hashed levels, default to
+                        the configured one
+    @return [str] the path of the directory
+    """
+    return (self.__new_cert_directory + self.getFanoutPrefix(user_id, levels) +
+            str(user_id) + "/")
+
+  def getCertificateDirectory(self):
+    """Return the root of the certificate directory
+
+    @return [str] the path of the certificate directory
+    """
+    return self.__new_cert_directory
+
+  def listPKIUserDirectories(self, levels=None):
+    """Return all user directories of the certificate directory
+
+    @param levels [int] OPTIONNAL : the number of hashed levels of the tree,
+                        default to the configured one
+    @return [list] the list of (user_id, path) of each user directory
+    """
+    if levels is None:
+      levels = self.__fanout
+    l_dir = [self.__new_cert_directory.rstrip('/')]
+    for i in range(levels):
+      l_sub = []
+      for directory in l_dir:
+        for name in os.listdir(directory):
+          path = os.path.join(directory, name)
+          if len(name) == 2 and os.path.isdir(path):
+            l_sub.append(path)
+      l_dir = l_sub
+    l_user = []
+    for directory in l_dir:
+      for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.isdigit() and os.path.isdir(path):
+          l_user.append((int(name), path))
+    return l_user
+
+  def __listFanoutDirectories(self, levels):
+    """Return the hashed directories of a tree, the deepest first
+
+    @param levels [int] the number of hashed levels of the tree
+    @return [list<str>] the paths of the hashed directories
+    """
+    l_all = []
+    l_dir = [self.__new_cert_directory.rstrip('/')]
+    for i in range(levels):
+      l_sub = []
+      for directory in l_dir:
+        for name in os.listdir(directory):
+          path = os.path.join(directory, name)
+          if len(name) == 2 and os.path.isdir(path):
+            l_sub.append(path)
+      l_all = l_sub + l_all
+      l_dir = l_sub
+    return l_all
+
+  def migrateTree(self, levels):
+    """Move all user directories of a tree to the configured layout
+
+    A hashed directory and a user directory can have the same name, so a
+    destination can be inside a user directory which is not yet moved. The
+    move is then made in two phases : all user directories are first renamed
+    to a staging name at the root of the tree, the emptied hashed directories
+    are removed and at last each staged directory is renamed to its new
+    place. Staged directories left by an interrupted migration are moved
+    again by the next one. A new manifest is filled after the move.
+    @param levels [int] the number of hashed levels of the existing tree
+    @return [int] the number of moved user directories
+            [None] if an error happen
+    """
+    if levels == self.__fanout:
+      self.__seedManifest()
+      return 0
+    root = self.__new_cert_directory.rstrip('/')
+    # list all directories before any move
+    l_user = self.listPKIUserDirectories(levels)
+    l_fanout = self.__listFanoutDirectories(levels)
+    l_staged = []
+    for name in os.listdir(root):
+      if (name.startswith(self.MIGRATE_PREFIX) and
+          name[len(self.MIGRATE_PREFIX):].isdigit()):
+        l_staged.append((int(name[len(self.MIGRATE_PREFIX):]),
+                         os.path.join(root, name)))
+
+    # first phase, rename each user directory to a unique staging name
+    for (user_id, src) in l_user:
+      staged = os.path.join(root, self.MIGRATE_PREFIX + str(user_id))
+      if os.path.exists(staged):
+        g_sys_log.error("Unable to move '%s', '%s' already exists", src,
+                        staged)
+        return None
+      try:
+        os.rename(src, staged)
+      except OSError as e:
+        g_sys_log.error("Unable to move '%s' to '%s' : %s", src, staged,
+                        str(e))
+        return None
+      l_staged.append((user_id, staged))
+    for directory in l_fanout:
+      try:
+        os.rmdir(directory)
+      except OSError:
+        # not empty, it contains other files than user directories
+        pass
+
+    # second phase, rename each staged directory to its final place
+    count = 0
+    for (user_id, staged) in l_staged:
+      dst = self.getPKIUserDirectory(user_id).rstrip('/')
+      if os.path.exists(dst):
+        g_sys_log.error("Unable to move '%s', '%s' already exists", staged,
+                        dst)
+        return None
+      try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.rename(staged, dst)
+      except OSError as e:
+        g_sys_log.error("Unable to move '%s' to '%s' : %s", staged, dst,
+                        str(e))
+        return None
+      count += 1
+    self.__s_directory.clear()
+    g_sys_log.info("Moved %d user directories to the %d levels layout",
+                   count, self.__fanout)
+    # the files can only be found once the tree is in the configured layout
+    self.__seedManifest()
+    return count
+
+  def getPKIUserFilePath(self, user, hostname, certificate, extension):
+    """Return the path of a file which belong to a certificate
+
+    @param user [User] the user to which the certificate is associated
+    @param hostname [Hostname] the hostname to which the certificate is
+                              associated
+    @param certificate [Certificate] the Certificate instance associated with
+                        the file
+    @param extension [str] the type of the file (key, csr or crt)
+    @return [str] the path of the file
+    """
+    return (self.getPKIUserDirectory(user.id) + str(hostname.id) + "/" +
+            str(certificate.id) + "." + extension)
+
+  def getManifestEntryPath(self, entry):
+    """Return the path of a file recorded in the manifest
+
+    @param entry [ManifestEntry] the manifest entry
+    @return [str] the path of the file
+    """
+    return (self.getPKIUserDirectory(entry.user_id) + str(entry.hostname_id) +
+            "/" + str(entry.serial) + "." + entry.extension)
+
+  def hasPKIUserFile(self, user, hostname, certificate, extension):
+    """Check if a file which belong to a certificate exists
+
+    @param user [User] the user to which the certificate is associated
+    @param hostname [Hostname] the hostname to which the certificate is
+                              associated
+    @param certificate [Certificate] the Certificate instance associated with
+                        the file
+    @param extension [str] the type of the file (key, csr or crt)
+    @return [bool] True if the file exists
+    """
+    # a pending write of the file must be visible
+    self.__flushPath(self.getPKIUserFilePath(user, hostname, certificate,
+                                             extension))
+    if (self.__manifest.enabled and
+        self.__manifest.getEntry(certificate.id, extension) is not None):
+      return True
+    # the file can have been written while the manifest was disabled
+    return os.path.isfile(self.getPKIUserFilePath(user, hostname, certificate,
+                                                  extension))
+
+  def linkPKIUserFile(self, user, hostname, src, dst, extension):
+    """Make a certificate file available for another certificate
+
+    The file is hard linked if possible, copied otherwise
+    @param user [User] the user to which the certificates are associated
+    @param hostname [Hostname] the hostname to which the certificates are
+                              associated
+    @param src [Certificate] the certificate which owns the file
+    @param dst [Certificate] the certificate which will share the file
+    @param extension [str] the type of the file (key, csr or crt)
+    """
+    self.__queueOperation(
+        self.OP_LINK,
+        self.getPKIUserFilePath(user, hostname, src, extension),
+        self.getPKIUserFilePath(user, hostname, dst, extension),
+        ManifestEntry(user.id, hostname.id, dst.id, extension, None, None))
 
   def storePKIUserCertificate(self, user, hostname, certificate, obj,
                               password=None):
@@ -157,23 +732,69 @@ class PKIFileTree(object):
     @param password [str] OPTIONNAL : an optionnal passphrase to use for encrypt
           the output (if available)
     """
-    path = (self.__new_cert_directory + str(user.id) + "/" + str(hostname.id) +
-            "/")
-    self.makePath(path)
+    (extension, bytes_) = self.dumpPKIObject(obj, password)
+    self.storePKIUserFile(user, hostname, certificate, extension, bytes_)
 
+  def dumpPKIObject(self, obj, password=None):
+    """Serialize a PKI object in PEM format
+
+    @param obj [X509/X509Req/PKey] The object to serialize
+    @param password [str] OPTIONNAL : an optionnal passphrase to use for encrypt
+          the output (if available)
+    @return [tuple] the (extension, bytes) of the object file
+    """
     bytes_ = None
     if isinstance(obj, OpenSSL.crypto.X509):
       bytes_ = crypto.dump_certificate(crypto.FILETYPE_PEM, obj)
-      path += str(certificate.id) + ".crt"
-    if isinstance(obj, OpenSSL.crypto.X509Req):
+      extension = "crt"
+    elif isinstance(obj, OpenSSL.crypto.X509Req):
       bytes_ = crypto.dump_certificate_request(crypto.FILETYPE_PEM, obj)
-      path += str(certificate.id) + ".csr"
+      extension = "csr"
     elif isinstance(obj, OpenSSL.crypto.PKey):
       if isinstance(password, str):
         bytes_ = crypto.dump_privatekey(crypto.FILETYPE_PEM, obj,
                                         self.__cipher, password.encode())
       else:
         bytes_ = crypto.dump_privatekey(crypto.FILETYPE_PEM, obj)
-      path += str(certificate.id) + ".key"
+      extension = "key"
     assert bytes_ is not None
-    self.storeBytesToFile(bytes_, path)
+    return (extension, bytes_)
+
+  def storePKIUserFile(self, user, hostname, certificate, extension, content):
+    """Store the content of a certificate file
+
+    @param user [User] the user to which the certificate is associated
+    @param hostname [Hostname] the hostname to which the certificate is
+                              associated
+    @param certificate [Certificate] the Certificate instance associated with
+                        the file
+    @param extension [str] the type of the file
+    @param content [bytes] the content of the file
+    """
+    self.storeBytesToFile(
+        content,
+        self.getPKIUserFilePath(user, hostname, certificate, extension),
+        ManifestEntry(user.id, hostname.id, certificate.id, extension,
+                      None, None))
+
+  def readPKIUserFile(self, user, hostname, certificate, extension):
+    """Read the content of a certificate file
+
+    @param user [User] the user to which the certificate is associated
+    @param hostname [Hostname] the hostname to which the certificate is
+                              associated
+    @param certificate [Certificate] the Certificate instance associated with
+                        the file
+    @param extension [str] the type of the file
+    @return [bytes] the content of the file
+            [None] if the file cannot be read
+    """
+    path = self.getPKIUserFilePath(user, hostname, certificate, extension)
+    # a pending write of the file must be visible
+    self.__flushPath(path)
+    try:
+      with open(path, 'rb') as f:
+        return f.read()
+    except (IOError, OSError) as e:
+      g_sys_log.error("Unable to read file '%s' : %s", path, str(e))
+      return None
@@ -0,0 +1,324 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Private Key Pool program class
+
+This class keeps a bounded reservoir of ready-to-use private keys.
+Keys are generated by a background thread while the pool is under its low
+watermark, until it reach its high watermark. Each pooled key is also stored
+encrypted into the pool directory so the reservoir survives to a restart of
+the daemon.
+"""
+
+# System imports
+import collections
+import logging
+import os
+import threading
+import time
+
+from OpenSSL import crypto
+from OpenSSL.crypto import (_lib as lib, _ffi as ffi)
+
+# Project imports
+from ..helpers import *
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.keypool')
+
+
+class PKIKeyPool(object):
+  """Build an instance of the private key pool
+
+  This instance must be loaded and started by the PKI class
+  """
+
+  # the number of seconds to wait after a failed key generation, doubled
+  # after each consecutive failure up to the maximum
+  RETRY_DELAY = 1.0
+  RETRY_DELAY_MAX = 300.0
+
+  def __init__(self, confparser):
+    """Constructor : Build a new empty private key pool
+    """
+    self.__cp = confparser
+    # the directory into which pooled keys are stored
+    self.__directory = "keypool/"
+    # the number of key to reach when the pool is refilled
+    # a size of zero disable the pool
+    self.__high_watermark = 0
+    # the number of key under which the pool is refilled
+    self.__low_watermark = None
+    # the passphrase used to encrypt pooled keys on the file system
+    self.__password = None
+    # the cipher to use for pooled keys encryption
+    self.__cipher = "DES3"
+    # the function that build a new private key
+    self.__generator = None
+    # the list of available keys as tuple (path, PKey)
+    self.__l_key = collections.deque()
+    # the condition used to wake up the generation thread
+    self.__condition = threading.Condition()
+    self.__thread = None
+    self.__stop = False
+    self.__counter = 0
+
+  def load(self, key_type, generator):
+    """Load the pool settings and import the keys already stored
+
+    @param key_type [str] the name of the type of pooled keys, keys of each
+                          type are stored into a separate directory
+    @param generator [function] the function to call without argument to
+                                build a new private key
+    @return [bool] True if the pool is ready to work
+                   False otherwise
+    """
+    self.__generator = generator
+    try:
+      self.__high_watermark = self.__cp.getint(
+          self.__cp.PKI_SECTION,
+          'key_pool_size',
+          fallback=self.__high_watermark)
+    except ValueError:
+      g_sys_log.error("Option 'key_pool_size' must be a number")
+      return False
+    if self.__high_watermark < 0:
+      g_sys_log.error("Option 'key_pool_size' must be a positive number")
+      return False
+    if not self.enabled:
+      return True
+
+    try:
+      self.__low_watermark = self.__cp.getint(
+          self.__cp.PKI_SECTION,
+          'key_pool_low_watermark',
+          fallback=self.__high_watermark // 2)
+    except ValueError:
+      g_sys_log.error("Option 'key_pool_low_watermark' must be a number")
+      return False
+    if not (0 <= self.__low_watermark < self.__high_watermark):
+      g_sys_log.error("Option 'key_pool_low_watermark' must be lower than " +
+                      "'key_pool_size'")
+      return False
+
+    self.__directory = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'key_pool_directory',
+        fallback=self.__directory).rstrip('/') + '/' + key_type + '/'
+
+    self.__cipher = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'cert_key_cipher',
+        fallback=self.__cipher)
+    # BAD USAGE but no other solution
+    if lib.EVP_get_cipherbyname(self.__cipher.encode()) == ffi.NULL:
+      g_sys_log.fatal("Invalid cipher name")
+      return False
+
+    self.__password = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'key_pool_password',
+        fallback=None)
+    if not self.__password:
+      # keys stored by a previous run cannot be decrypted anymore
+      g_sys_log.warning("No 'key_pool_password' configured, pooled keys " +
+                        "will not be reused after a restart")
+      self.__password = random_generator(32)
+
+    try:
+      os.makedirs(self.__directory, exist_ok=True)
+    except OSError as e:
+      g_sys_log.error("Unable to create key pool directory '%s' : %s",
+                      self.__directory, str(e))
+      return False
+
+    self.__importStoredKeys()
+    g_sys_log.info("Using %s private key pool of %d keys with %d ready",
+                   key_type, self.__high_watermark, len(self.__l_key))
+    return True
+
+  def __importStoredKeys(self):
+    """Load into the pool the keys that are already stored in its directory
+
+    Keys which cannot be decrypted with the current password are removed
+    """
+    for name in sorted(os.listdir(self.__directory)):
+      path = self.__directory + name
+      if not name.endswith('.key'):
+        continue
+      try:
+        with open(path, 'rb') as f:
+          key = crypto.load_privatekey(crypto.FILETYPE_PEM, f.read(),
+                                       self.__password.encode())
+      except (IOError, crypto.Error):
+        g_sys_log.warning("Discard unreadable pooled key '%s'", path)
+        self.__removeFile(path)
+        continue
+      if len(self.__l_key) >= self.__high_watermark:
+        self.__removeFile(path)
+      else:
+        self.__l_key.append((path, key))
+
+# Getters methods
+  @property
+  def enabled(self):
+    """Return the activation status of the pool
+
+    @return [bool] True if the pool is configured to keep keys
+    """
+    return self.__high_watermark > 0
+
+  def __len__(self):
+    """Return the number of ready keys
+
+    @return [int] the number of keys currently available in the pool
+    """
+    return len(self.__l_key)
+
+# Tools
+  @staticmethod
+  def __removeFile(path):
+    """Remove a stored key file and log error if it fail
+
+    @param path [str] the path of the file to remove
+    """
+    try:
+      os.remove(path)
+    except OSError as e:
+      g_sys_log.error("Unable to remove pooled key '%s' : %s", path, str(e))
+
+  def __storeKey(self, key):
+    """Write a new pooled key into the pool directory
+
+    The key is written under a temporary name then renamed to prevent
+    partially written files to be imported
+    @param key [PKey] the key to store
+    @return [str] the path of the stored key
+            [None] if the key cannot be stored
+    """
+    self.__counter += 1
+    path = self.__directory + '{:d}-{:d}.key'.format(int(time.time()),
+                                                     self.__counter)
+    try:
+      with open(path + '.tmp', 'wb') as f:
+        f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key,
+                                       self.__cipher,
+                                       self.__password.encode()))
+      os.rename(path + '.tmp', path)
+    except (IOError, OSError) as e:
+      g_sys_log.error("Unable to store pooled key '%s' : %s", path, str(e))
+      return None
+    return path
+
+  def __run(self):
+    """Background generation loop
+
+    Wait until the pool goes under its low watermark then generate keys until
+    it reach its high watermark. After a failed generation or storage, the
+    thread waits for an increasing delay before it tries again
+    """
+    g_sys_log.debug("Private key pool thread started")
+    delay = 0.0
+    while True:
+      with self.__condition:
+        if delay > 0:
+          self.__condition.wait(delay)
+        while (not self.__stop and
+               len(self.__l_key) > self.__low_watermark):
+          self.__condition.wait()
+        if self.__stop:
+          break
+      while not self.__stop and len(self.__l_key) < self.__high_watermark:
+        try:
+          key = self.__generator()
+        except Exception as e:
+          g_sys_log.error("Unable to generate a pooled key : %s", str(e))
+          path = None
+        else:
+          path = self.__storeKey(key)
+        if path is None:
+          delay = min(max(delay * 2, self.RETRY_DELAY), self.RETRY_DELAY_MAX)
+          g_sys_log.warning("Private key pool refill retried in %.1f seconds",
+                            delay)
+          break
+        delay = 0.0
+        self.__l_key.append((path, key))
+      else:
+        g_sys_log.debug("Private key pool refilled with %d keys",
+                        len(self.__l_key))
+    g_sys_log.debug("Private key pool thread stopped")
+
+# API
+  def start(self):
+    """Start the background generation thread if pool is enabled
+    """
+    if not self.enabled or self.__thread is not None:
+      return
+    self.__stop = False
+    self.__thread = threading.Thread(target=self.__run,
+                                     name='pki-keypool',
+                                     daemon=True)
+    self.__thread.start()
+    # fill the pool if it is under its low watermark
+    self.notify()
+
+  def stop(self):
+    """Stop the background generation thread
+
+    The key which is currently being generated is finished before the thread
+    exits
+    """
+    if self.__thread is None:
+      return
+    with self.__condition:
+      self.__stop = True
+      self.__condition.notify()
+    self.__thread.join()
+    self.__thread = None
+
+  def notify(self):
+    """Wake up the generation thread if the pool must be refilled
+    """
+    with self.__condition:
+      if len(self.__l_key) <= self.__low_watermark:
+        self.__condition.notify()
+
+  def takeKey(self):
+    """Take a ready private key from the pool
+
+    @return [PKey] a private key which will never be given again
+            [None] if the pool is empty or disabled
+    """
+    if not self.enabled:
+      return None
+    try:
+      path, key = self.__l_key.popleft()
+    except IndexError:
+      g_sys_log.debug("Private key pool is empty")
+      self.notify()
+      return None
+    self.__removeFile(path)
+    self.notify()
+    return key
@@ -30,9 +30,12 @@ This is the entry point of all SSL operations
 """
 
 # System imports
+import concurrent.futures
 import datetime
 import logging
+import multiprocessing
 import os
+import time
 
 try:
   import OpenSSL
@@ -42,9 +45,26 @@ try:
 except ImportError:
   raise Exception("Module OpenSSL required " +
                   " https://pypi.python.org/pypi/pyOpenSSL")
+# elliptic curve keys are built with the cryptography module which is
+# required by pyOpenSSL, ed25519 is only available in recent versions
+try:
+  from cryptography.hazmat.backends import default_backend
+  from cryptography.hazmat.primitives.asymmetric import ec
+except ImportError:
+  ec = None
+try:
+  from cryptography.hazmat.primitives.asymmetric import ed25519
+except ImportError:
+  ed25519 = None
 
 # Project imports
+from .pki_archive import PKIArchiver
+from .pki_crl import PKICRLBuilder, PKICRLDirectory
 from .pki_filetree import PKIFileTree
+from .pki_keypool import PKIKeyPool
+from .pki_profile import PKIProfileBuilder
+from .pki_reconcile import PKIReconciler
+from .pki_serial import PKISerialAllocator
 from .. import models as Model
 from ..config import Error
 from ..helpers import *
@@ -59,12 +79,43 @@ class PublicKeyInfrastructure(object):
   This instance must be called in the openvpn uam program class
   """
 
+  # the X509 version of new certificates (v3)
+  CERTIFICATE_VERSION = 2
+  # the subject fields copied from the CA into new certificates
+  SUBJECT_TEMPLATE_FIELDS = ['C', 'ST', 'L', 'O', 'OU']
+
+  # available private key types
+  KEY_TYPE_RSA = 'rsa'
+  KEY_TYPE_EC_P256 = 'ec-p256'
+  KEY_TYPE_EC_P384 = 'ec-p384'
+  KEY_TYPE_ED25519 = 'ed25519'
+
   def __init__(self, confparser):
     """Constructor : Build a new PKI API instance
     """
     self.__cp = confparser
     # the file tree to use to store all file
     self.__ft = PKIFileTree(confparser)
+    # the reservoir of pre-generated private keys
+    self.__key_pool = PKIKeyPool(confparser)
+    # the allocator of pre-reserved serial numbers
+    self.__serial_allocator = PKISerialAllocator(confparser)
+    # the archiver of expired certificates files
+    self.__archiver = PKIArchiver(confparser, self.__ft)
+    # the publisher of certificate revocation lists
+    self.__crl = PKICRLBuilder(confparser)
+    # the publisher of the revocation directory
+    self.__crl_directory = PKICRLDirectory(confparser)
+    # the builder of client profiles
+    self.__profile = PKIProfileBuilder(confparser, self.__ft)
+    # the scanner which compares the file tree with the database
+    self.__reconciler = PKIReconciler(confparser, self.__ft,
+                                      self.loadCertificate)
+    # the thread which runs the long file system jobs, archival and
+    # reconciliation, out of the main loop, and their last futures by name
+    self.__jobs = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix='pki-jobs')
+    self.__d_job = dict()
     # path to CA cert
     self.__certificate_authority = None
     # path to CA key
@@ -73,7 +124,9 @@ class PublicKeyInfrastructure(object):
     # Path to the server certificate, use to ensure that this certificate is
     # still valid
     self.__server_certificate = None
-    # number of bits for new private key
+    # the type of new private key
+    self.__key_type = self.KEY_TYPE_RSA
+    # number of bits for new RSA private key
     self.__cert_key_size = int(2048)
 
     self.__cert_key_password_size = int(6)
@@ -81,6 +134,20 @@ class PublicKeyInfrastructure(object):
     self.__digest = "sha512"
     # a boolean which determine if CSR must be exported to FS or not
     self.__keep_request = False
+    # the number of workers that build certificates in parallel
+    self.__issuance_workers = multiprocessing.cpu_count()
+    # the name of the section which contains client certificate extensions
+    self.__client_extensions = None
+    # the parsed extensions of each extensions section
+    self.__d_extensions = dict()
+    # the issuer name of new certificates
+    self.__issuer = None
+    # the subject fields common to all new certificates
+    self.__subject_template = None
+    # a boolean which determine if renewals re-sign the existing public key
+    self.__renew_reuse_key = False
+    # the maximum number of days a key pair can be certified for
+    self.__key_lifetime_days = 365
 
   def load(self):
     """Return a boolean indicates if PKI is ready to work or not
@@ -109,6 +176,27 @@ class PublicKeyInfrastructure(object):
         'keep_certificate_request',
         fallback=self.__keep_request)
 
+    self.__renew_reuse_key = self.__cp.getboolean(
+        self.__cp.PKI_SECTION,
+        'renew_reuse_key',
+        fallback=self.__renew_reuse_key)
+
+    self.__key_lifetime_days = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'key_lifetime_days',
+        fallback=self.__key_lifetime_days)
+    if self.__key_lifetime_days <= 0:
+      g_sys_log.fatal("Option 'key_lifetime_days' must be a positive number")
+      return False
+
+    self.__issuance_workers = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'issuance_workers',
+        fallback=self.__issuance_workers)
+    if self.__issuance_workers <= 0:
+      g_sys_log.fatal("Option 'issuance_workers' must be a positive number")
+      return False
+
     self.__digest = self.__cp.get(
         self.__cp.PKI_SECTION,
         'digest',
@@ -119,7 +207,38 @@ class PublicKeyInfrastructure(object):
       g_sys_log.fatal("No such digest method")
       return False
 
-    if not self.__cp.has_option(self.__cp.PKI_SECTION, 'client_extensions'):
+    self.__key_type = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'key_type',
+        fallback=self.__key_type).lower()
+    if not self.isKeyTypeSupported(self.__key_type):
+      g_sys_log.fatal("Unsupported private key type '%s'", self.__key_type)
+      return False
+    if self.__keep_request and self.__key_type == self.KEY_TYPE_ED25519:
+      g_sys_log.warning("Certificate requests cannot be signed with ed25519 " +
+                        "keys, they will not be stored")
+
+    if not self.__key_pool.load(self.__key_type, self.__generatePrivateKey):
+      g_sys_log.fatal('Unable to load private key pool')
+      return False
+
+    if not self.__serial_allocator.load():
+      g_sys_log.fatal('Unable to load serial number allocator')
+      return False
+
+    if not self.__reconciler.load():
+      g_sys_log.fatal('Unable to load reconciliation settings')
+      return False
+
+    if not self.__archiver.load():
+      g_sys_log.fatal('Unable to load archival settings')
+      return False
+
+    self.__client_extensions = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'client_extensions',
+        fallback=None)
+    if self.__client_extensions is None:
       g_sys_log.warning("No SSL extensions configured for client certificate.")
 
     if not self.__cp.has_option(self.__cp.PKI_SECTION, 'server_extensions'):
@@ -149,8 +268,49 @@ class PublicKeyInfrastructure(object):
     else:
       g_sys_log.info("Using CA Private Key with size '%s' bits",
                      self.__certificate_authority_key.bits())
+
+    if not self.__profile.load(self.__certificate_authority):
+      g_sys_log.fatal('Unable to load client profile settings')
+      return False
+
+    if not self.__crl.load(self.__certificate_authority,
+                           self.__certificate_authority_key,
+                           self.__digest):
+      g_sys_log.fatal('Unable to load CRL settings')
+      return False
+
+    if not self.__crl_directory.load():
+      g_sys_log.fatal('Unable to load revocation directory settings')
+      return False
+
+    # build the issuance template from the CA
+    self.__issuer = self.__certificate_authority.get_subject()
+    self.__subject_template = OpenSSL.crypto.X509().get_subject()
+    for field in self.SUBJECT_TEMPLATE_FIELDS:
+      value = getattr(self.__issuer, field)
+      if value is not None:
+        setattr(self.__subject_template, field, value)
+
+    # parse and check all extensions once
+    self.__d_extensions = dict()
+    for option in ['client_extensions', 'server_extensions']:
+      section = self.__cp.get(self.__cp.PKI_SECTION, option, fallback=None)
+      if section is not None and not self.__loadExtensionSection(section):
+        g_sys_log.fatal("Invalid SSL extensions in section '%s'", section)
+        return False
+
+    self.__key_pool.start()
+    self.__ft.start()
     return True
 
+  def stop(self):
+    """Stop properly all background PKI activities
+    """
+    self.__jobs.shutdown(wait=True)
+    self.__key_pool.stop()
+    self.__ft.stop()
+    self.__archiver.close()
+
   def checkRequirements(self):
     """Check requirement for PKI to running
 
@@ -230,34 +390,162 @@ class PublicKeyInfrastructure(object):
         return None
     return key
 
-  def loadExtensionFromSection(self, cert, section):
-    """Extract the list of extensions listed in a section of conf file
+  @classmethod
+  def isKeyTypeSupported(cls, key_type):
+    """Check if the given private key type can be generated
 
-    @param cert [X509] the certificate into add new extensions
+    @param key_type [str] the name of the key type
+    @return [bool] True if keys of this type can be generated
+                  False otherwise
+    """
+    if key_type == cls.KEY_TYPE_RSA:
+      return True
+    if key_type in [cls.KEY_TYPE_EC_P256, cls.KEY_TYPE_EC_P384]:
+      return ec is not None
+    if key_type == cls.KEY_TYPE_ED25519:
+      return ed25519 is not None
+    return False
+
+  def getHostnameKeyType(self, hostname):
+    """Return the type of private key to use for the given hostname
+
+    @param hostname [Hostname] the hostname for which to build a key
+    @return [str] the hostname key type if set and valid, the global one
+                  otherwise
+    """
+    key_type = hostname.key_type
+    if not key_type:
+      return self.__key_type
+    key_type = key_type.lower()
+    if not self.isKeyTypeSupported(key_type):
+      g_sys_log.error("Unsupported private key type '%s' for Hostname(%s)," +
+                      " use '%s' instead", key_type, hostname.id,
+                      self.__key_type)
+      return self.__key_type
+    return key_type
+
+  def getPublicKeyType(self, key):
+    """Return the type of the given key if it match the configured settings
+
+    @param key [PKey] the key to check
+    @return [str] the key type
+            [None] if the key doesn't match any usable key type
+    """
+    if key.type() == OpenSSL.crypto.TYPE_RSA:
+      if key.bits() == self.__cert_key_size:
+        return self.KEY_TYPE_RSA
+      return None
+    c_key = key.to_cryptography_key()
+    if ec is not None and isinstance(c_key, ec.EllipticCurvePublicKey):
+      if c_key.curve.name == ec.SECP256R1.name:
+        return self.KEY_TYPE_EC_P256
+      if c_key.curve.name == ec.SECP384R1.name:
+        return self.KEY_TYPE_EC_P384
+    if ed25519 is not None and isinstance(c_key, ed25519.Ed25519PublicKey):
+      return self.KEY_TYPE_ED25519
+    return None
+
+  def __getReusableKey(self, user, hostname, end_time):
+    """Return the current public key of a hostname if it can be certified again
+
+    The key of the latest certificate can be reused if it is not revoked,
+    if its type still match the hostname key type and if the new certificate
+    ends before the key reaches its lifetime
+    @param user [User] the owner of the hostname
+    @param hostname [Hostname] the hostname to renew
+    @param end_time [datetime] the end of validity of the new certificate
+    @return [tuple] the (Certificate, PKey) of the latest certificate
+            [None] if a new key must be generated
+    """
+    if not self.__renew_reuse_key:
+      return None
+    m_prev = hostname.getLatestCertificate()
+    if (m_prev is None or m_prev.revoked_time is not None or
+        m_prev.key_creation_time is None):
+      return None
+    if (m_prev.key_creation_time +
+        datetime.timedelta(days=self.__key_lifetime_days) < end_time):
+      g_sys_log.info("Key of Hostname(%s) reached its lifetime, rekey",
+                     hostname.id)
+      return None
+    if not self.__ft.hasPKIUserFile(user, hostname, m_prev, 'key'):
+      return None
+    cert = self.loadCertificate(
+        self.__ft.getPKIUserFilePath(user, hostname, m_prev, 'crt'))
+    if cert is None:
+      return None
+    key = cert.get_pubkey()
+    if self.getPublicKeyType(key) != self.getHostnameKeyType(hostname):
+      return None
+    return (m_prev, key)
+
+  def __generatePrivateKey(self, key_type=None):
+    """Build a new private key according to the configured key settings
+
+    @param key_type [str] OPTIONNAL : the type of key to build, default to
+                        the configured type
+    @return [OpenSSL.crypto.PKey] the new private key
+    """
+    if key_type is None:
+      key_type = self.__key_type
+    if key_type == self.KEY_TYPE_RSA:
+      g_sys_log.debug("Generate a %s bits RSA Private Key",
+                      self.__cert_key_size)
+      key = OpenSSL.crypto.PKey()
+      key.generate_key(OpenSSL.crypto.TYPE_RSA, self.__cert_key_size)
+      return key
+
+    g_sys_log.debug("Generate a %s Private Key", key_type)
+    if key_type == self.KEY_TYPE_EC_P256:
+      c_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    elif key_type == self.KEY_TYPE_EC_P384:
+      c_key = ec.generate_private_key(ec.SECP384R1(), default_backend())
+    elif key_type == self.KEY_TYPE_ED25519:
+      c_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+      raise ValueError("Unsupported private key type '" + key_type + "'")
+    return OpenSSL.crypto.PKey.from_cryptography_key(c_key)
+
+  def __loadExtensionSection(self, section):
+    """Parse and check the list of extensions listed in a section of conf file
+
+    Extensions which doesn't depend on the certificate are built once. Key
+    identifiers are only checked here against the CA certificate because they
+    must be computed for each certificate.
+    The result is cached for later use by loadExtensionFromSection()
     @param section [str] the section from which to extract extensions
       declarations
-    @return [list] The list of extensions.
+    @return [bool] True if all extensions are valid
+                   False otherwise
     """
-    exts = []
+    l_ext = []
     if not self.__cp.has_section(section):
       g_sys_log.warning("No extension found in section '%s'", section)
-      return
+      self.__d_extensions[section] = l_ext
+      return True
 
     for (name, value) in self.__cp.items(section):
       critical = False
-      subject = None
-      issuer = None
-      if name == 'subjectKeyIdentifier':
-        subject = cert
-      if name == 'authorityKeyIdentifier':
-        subject = cert
-        issuer = self.__certificate_authority
-      exts.append(
-          OpenSSL.crypto.X509Extension(name.encode(),
-                                       critical,
-                                       value.encode(),
-                                       subject,
-                                       issuer))
+      try:
+        if name in ['subjectKeyIdentifier', 'authorityKeyIdentifier']:
+          with_issuer = (name == 'authorityKeyIdentifier')
+          # check the declaration by using the CA as certificate
+          OpenSSL.crypto.X509Extension(
+              name.encode(),
+              critical,
+              value.encode(),
+              self.__certificate_authority,
+              self.__certificate_authority if with_issuer else None)
+          l_ext.append((name.encode(), value.encode(), with_issuer))
+        else:
+          l_ext.append(
+              OpenSSL.crypto.X509Extension(name.encode(),
+                                           critical,
+                                           value.encode()))
+      except crypto.Error as e:
+        g_sys_log.error("Invalid extension '%s' in section '%s' : %s",
+                        name, section, str(e))
+        return False
 # Disabled because the OpenSSL library doesn't forbid the 'critical' word
 #      items = value.split(',')
 #      if 'critical' in items:
@@ -267,87 +555,414 @@ class PublicKeyInfrastructure(object):
 #      exts.append(OpenSSL.crypto.X509Extension(name.encode(),
 #                                               critical,
 #                                               data.encode()))
+    self.__d_extensions[section] = l_ext
+    return True
+
+  def loadExtensionFromSection(self, cert, section):
+    """Add to a certificate the list of extensions listed in a section
+
+    Extensions are parsed only at the first use of the section, then only
+    the key identifiers are computed for the given certificate
+    @param cert [X509] the certificate into add new extensions
+    @param section [str] the section from which to extract extensions
+      declarations
+    """
+    if section not in self.__d_extensions:
+      if not self.__loadExtensionSection(section):
+        return
+
+    exts = []
+    for ext in self.__d_extensions[section]:
+      # key identifiers depend on the certificate
+      if isinstance(ext, tuple):
+        (name, value, with_issuer) = ext
+        ext = OpenSSL.crypto.X509Extension(
+            name,
+            False,
+            value,
+            cert,
+            self.__certificate_authority if with_issuer else None)
+      exts.append(ext)
     cert.add_extensions(exts)
 
-  def generateUserCertificate(self, user, hostname):
-    """Generate a new Certificate for the given Hostname
+  def __newCertificateModel(self, user, hostname, today):
+    """Build the model of a new certificate for the given Hostname
 
-    @param user [User]
-    @param hostname [Hostname]
+    @param user [User] the owner of the hostname
+    @param hostname [Hostname] the hostname to build a certificate for
+    @param today [datetime] the begin time of the certificate validity
+    @return [tuple] the new (Certificate, password, renewal) where password is
+                    None if the private key must not be encrypted and renewal
+                    is the (Certificate, PKey) whose key is reused or None
     """
-    g_sys_log.debug("Building a new certificate for Hostname(%s) '%s'",
-                    hostname.id, hostname.name)
-    today = datetime.datetime.utcnow()
+    begin = today.replace(microsecond=0)
+    m_cert = Model.Certificate(
+        begin,
+        begin + datetime.timedelta(days=hostname.period_days))
+
+    renewal = self.__getReusableKey(user, hostname,
+                                    m_cert.certificate_end_time)
+    if renewal is not None:
+      # the existing private key keeps its passphrase
+      (m_prev, key) = renewal
+      g_sys_log.debug("Reuse key of certificate (%s) for Hostname(%s)",
+                      m_prev.id, hostname.id)
+      m_cert.load({'is_password': m_prev.is_password,
+                   'key_creation_time': m_prev.key_creation_time})
+      return (m_cert, None, renewal)
+    m_cert.load({'key_creation_time': begin})
 
+    # configure settings
+    if user.password_mail is not None:
+      # generate a random password
+      password = random_generator(self.__cert_key_password_size)
+    elif user.certificate_password is not None:
+      # use configured password
+      password = user.certificate_password
+    else:
+      password = None
+    # set before the insert to prevent a later update
+    if password is not None:
+      m_cert.load({'is_password': True})
+    return (m_cert, password, None)
+
+  def __buildCertificate(self, user, hostname, m_cert, renewal=None):
+    """Build the private key and the signed certificate of a certificate model
+
+    The given certificate model must have been already inserted because its
+    id is used as serial number. No certificate request is built for ed25519
+    keys, even if requests are kept, because pyOpenSSL can only sign a request
+    with a digest and ed25519 signatures doesn't use any
+    @param user [User] the owner of the hostname
+    @param hostname [Hostname] the hostname of the certificate
+    @param m_cert [Certificate] the registered certificate model
+    @param renewal [tuple] OPTIONNAL : the (Certificate, PKey) whose public
+                    key must be certified instead of a new one
+    @return [tuple] the (PKey, X509Req, X509) of the new certificate, the
+                    key is None if it is reused and the request is None if it
+                    must not be stored
+    """
     # BUILD PRIVATE KEY
-    g_sys_log.debug("Generate a %s bits RSA Private Key", self.__cert_key_size)
-    key = OpenSSL.crypto.PKey()
-    key.generate_key(OpenSSL.crypto.TYPE_RSA, self.__cert_key_size)
-
-    # BUILD CERTIFICATE SIGNING REQUEST
-    g_sys_log.debug("Generate a X509 request")
-    req = OpenSSL.crypto.X509Req()
-    req.get_subject().C = self.__certificate_authority.get_subject().C
-    req.get_subject().ST = self.__certificate_authority.get_subject().ST
-    req.get_subject().L = self.__certificate_authority.get_subject().L
-    req.get_subject().O = self.__certificate_authority.get_subject().O
-    req.get_subject().OU = self.__certificate_authority.get_subject().OU
-    req.get_subject().CN = user.cuid + "_" + hostname.name
-    req.get_subject().emailAddress = user.user_mail
-    req.get_subject().name = (user.cuid + "_" + hostname.name + "_" +
-                              str(today))
-    req.set_pubkey(key)
-    req.sign(key, self.__digest)
+    key_type = self.getHostnameKeyType(hostname)
+    key = None
+    if renewal is not None:
+      pubkey = renewal[1]
+    else:
+      # use a pre-generated key if one is ready
+      if key_type == self.__key_type:
+        key = self.__key_pool.takeKey()
+      if key is None:
+        key = self.__generatePrivateKey(key_type)
+      pubkey = key
+
+    # BUILD SUBJECT
+    subject = OpenSSL.crypto.X509Name(self.__subject_template)
+    subject.CN = user.cuid + "_" + hostname.name
+    subject.emailAddress = user.user_mail
+    subject.name = (user.cuid + "_" + hostname.name + "_" +
+                    str(m_cert.certificate_begin_time))
 
     # BUILD CERTIFICATE
     g_sys_log.debug("Generate a X509 certificate")
     cert = OpenSSL.crypto.X509()
-    cert.set_version(2)
-    #cert.gmtime_adj_notBefore(0)
-    #cert.gmtime_adj_notAfter(60*60*24*365)
-    cert.set_notBefore(datetimeToGeneralizedTimeB(today))
+    cert.set_version(self.CERTIFICATE_VERSION)
+    cert.set_notBefore(
+        datetimeToGeneralizedTimeB(m_cert.certificate_begin_time))
     cert.set_notAfter(
-        datetimeToGeneralizedTimeB(
-            today + datetime.timedelta(days=hostname.period_days)
-        ))
+        datetimeToGeneralizedTimeB(m_cert.certificate_end_time))
+    cert.set_serial_number(m_cert.id)
+    cert.set_issuer(self.__issuer)
+    cert.set_subject(subject)
+    cert.set_pubkey(pubkey)
+    if self.__client_extensions is not None:
+      self.loadExtensionFromSection(cert, self.__client_extensions)
+    cert.sign(self.__certificate_authority_key, self.__digest)
     # /BUILD CERTIFICATE
 
+    # BUILD CERTIFICATE SIGNING REQUEST
+    # it is only needed to be stored and it requires the private key
+    req = None
+    if self.__keep_request and key is not None:
+      if key_type == self.KEY_TYPE_ED25519:
+        g_sys_log.debug("Skip the X509 request of Certificate(%s), ed25519 " +
+                        "keys cannot sign it", m_cert.id)
+      else:
+        g_sys_log.debug("Generate a X509 request")
+        req = OpenSSL.crypto.X509Req()
+        for (field, value) in subject.get_components():
+          setattr(req.get_subject(), field.decode(), value.decode())
+        req.set_pubkey(key)
+        req.sign(key, self.__digest)
+    return (key, req, cert)
+
+  def __storeCertificate(self, user, hostname, m_cert, password, renewal,
+                         key, req, cert):
+    """Export all files of a new certificate
+
+    @param user [User] the owner of the hostname
+    @param hostname [Hostname] the hostname of the certificate
+    @param m_cert [Certificate] the certificate model
+    @param password [str] the passphrase of the private key or None
+    @param renewal [tuple] the (Certificate, PKey) whose key is reused or None
+    @param key [PKey] the private key or None if it is reused
+    @param req [X509Req] the certificate request or None
+    @param cert [X509] the signed certificate
+    """
+    key_pem = None
+    if key is None:
+      # the reused key file is shared with the previous certificate
+      self.__ft.linkPKIUserFile(user, hostname, renewal[0], m_cert, 'key')
+      if self.__profile.enabled:
+        key_pem = self.__ft.readPKIUserFile(user, hostname, renewal[0], 'key')
+    else:
+      (ext, key_pem) = self.__ft.dumpPKIObject(key, password)
+      self.__ft.storePKIUserFile(user, hostname, m_cert, ext, key_pem)
+    if req is not None:
+      self.__ft.storePKIUserCertificate(user, hostname, m_cert, req)
+    self.__ft.storePKIUserCertificate(user, hostname, m_cert, cert)
+    self.__profile.build(user, hostname, m_cert, cert, key, key_pem, password)
+
+  def generateUserCertificate(self, user, hostname):
+    """Generate a new Certificate for the given Hostname
+
+    @param user [User]
+    @param hostname [Hostname]
+    """
+    g_sys_log.debug("Building a new certificate for Hostname(%s) '%s'",
+                    hostname.id, hostname.name)
+    today = datetime.datetime.utcnow()
+
     # build certificate model
-    m_cert = Model.Certificate(
-        generalizedTimeToDatetimeB(cert.get_notBefore()),
-        generalizedTimeToDatetimeB(cert.get_notAfter()))
+    (m_cert, password, renewal) = self.__newCertificateModel(user, hostname,
+                                                             today)
+    # with a reserved serial the certificate insert can be delayed
+    realtime = True
+    if self.__serial_allocator.enabled:
+      if not self.__serial_allocator.assignSerials(hostname.db, [m_cert]):
+        # an auto increment id could collide with a leased serial
+        g_sys_log.error("Unable to reserve a serial for Hostname(%s), the" +
+                        " certificate will be built at next renewal scan",
+                        hostname.id)
+        return
+      realtime = False
     # ask the hostname to register the new certificate
-    if not hostname.addCertificate(m_cert) or m_cert.id is None:
+    if not hostname.addCertificate(m_cert, realtime) or m_cert.id is None:
       g_sys_log.error("Hostname unable to insert new certificate with" +
                       " the configured adapter.")
       return
 
-    # BUILD CERTIFICATE
-    cert.set_serial_number(m_cert.id)
-    cert.set_issuer(self.__certificate_authority.get_subject())
-    cert.set_subject(req.get_subject())
-    cert.set_pubkey(req.get_pubkey())
-    self.loadExtensionFromSection(cert,
-                                  self.__cp.get(self.__cp.PKI_SECTION,
-                                                'client_extensions',
-                                                fallback=None))
-    cert.sign(self.__certificate_authority_key, self.__digest)
-    # /BUILD CERTIFICATE
+    (key, req, cert) = self.__buildCertificate(user, hostname, m_cert,
+                                               renewal)
+    # export certificate
+    self.__storeCertificate(user, hostname, m_cert, password, renewal,
+                            key, req, cert)
+
+  def generateUserCertificates(self, l_pair):
+    """Generate a new Certificate for each given Hostname
+
+    The serials of all certificates are reserved at once, by the serial
+    allocator or by a single database insert. Then keys and certificates are
+    built and signed by a pool of workers and finally all files are written.
+    @param l_pair [list<tuple>] the list of (User, Hostname) to build a
+                                certificate for
+    @return [list<Certificate>] the list of successfully built certificates
+    """
+    return self.__buildCertificates(self.__registerCertificates(l_pair))
+
+  def renewCertificates(self, db):
+    """Build the certificates of hostnames which need a new one
+
+    An enabled hostname of an enabled user need a new certificate when it
+    has none or when its latest one will expire soon. The certificates are
+    registered into the database by the caller, then the keys are built and
+    signed in the jobs thread
+    @param db [Database] the database to read the users from
+    @return [concurrent.futures.Future] the future of the list of
+                          successfully built certificates
+            [None] if no certificate is needed or if the previous renewal is
+                          not finished
+    """
+    if self.__isJobRunning('renewal'):
+      return None
+    l_pair = []
+    for user in db.getEnabledUserList():
+      for hostname in user.getEnabledHostnameList():
+        hostname.updateCertificateList()
+        latest = hostname.getLatestCertificate()
+        if (latest is None or
+            latest in hostname.getCertificateSoonExpiredList()):
+          l_pair.append((user, hostname))
+    l_registered = self.__registerCertificates(l_pair)
+    if len(l_registered) == 0:
+      return None
+    return self.__submitJob('renewal', self.__buildCertificates, l_registered)
 
-    # configure settings
-    if user.password_mail is not None:
-      m_cert.is_password = True
-      # generate a random password
-      password = random_generator(self.__cert_key_password_size)
-    elif user.certificate_password is not None:
-      m_cert.is_password = True
-      # use configured password
-      password = user.certificate_password
-    else:
-      password = None
+  def __registerCertificates(self, l_pair):
+    """Register a new Certificate model for each given Hostname
 
-    # export certificate
-    self.__ft.storePKIUserCertificate(user, hostname, m_cert, key, password)
-    if self.__keep_request:
-      self.__ft.storePKIUserCertificate(user, hostname, m_cert, req)
-    self.__ft.storePKIUserCertificate(user, hostname, m_cert, cert)
+    @param l_pair [list<tuple>] the list of (User, Hostname) to build a
+                                certificate for
+    @return [list<tuple>] the (User, Hostname, Certificate, password, renewal)
+                          of each registered certificate
+    """
+    if len(l_pair) == 0:
+      return []
+    g_sys_log.debug("Registering %d new certificates", len(l_pair))
+    today = datetime.datetime.utcnow()
+
+    # build certificate models
+    l_new = []
+    for (user, hostname) in l_pair:
+      (m_cert, password, renewal) = self.__newCertificateModel(user,
+                                                               hostname,
+                                                               today)
+      m_cert.db = hostname.db
+      l_new.append((user, hostname, m_cert, password, renewal))
+
+    # reserve all serials at once, with reserved serials the inserts
+    # can be delayed
+    db = l_pair[0][1].db
+    realtime = True
+    if self.__serial_allocator.enabled:
+      if not self.__serial_allocator.assignSerials(
+          db, [item[2] for item in l_new]):
+        # an auto increment id could collide with a leased serial
+        g_sys_log.error("Unable to reserve %d serials, the certificates" +
+                        " will be built at next renewal scan", len(l_new))
+        return []
+      realtime = False
+    if not db.insertList([(item[2], item[1]) for item in l_new], realtime):
+      g_sys_log.error("Unable to insert new certificates with" +
+                      " the configured adapter.")
+    l_registered = []
+    for item in l_new:
+      (user, hostname, m_cert, password, renewal) = item
+      if m_cert.id is None or not hostname.addCertificate(m_cert):
+        g_sys_log.error("Hostname(%s) unable to register new certificate",
+                        hostname.id)
+        continue
+      l_registered.append(item)
+    return l_registered
+
+  def __buildCertificates(self, l_registered):
+    """Build, sign and store the keys and certificates of registered models
+
+    @param l_registered [list<tuple>] the registered certificates, see
+                                      __registerCertificates
+    @return [list<Certificate>] the list of successfully built certificates
+    """
+    if len(l_registered) == 0:
+      return []
+    # build keys and certificates in parallel
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self.__issuance_workers) as executor:
+      l_future = [executor.submit(self.__buildCertificate,
+                                  user, hostname, m_cert, renewal)
+                  for (user, hostname, m_cert, password, renewal)
+                  in l_registered]
+
+    # export certificates
+    l_cert = []
+    for (item, future) in zip(l_registered, l_future):
+      (user, hostname, m_cert, password, renewal) = item
+      try:
+        (key, req, cert) = future.result()
+      except (crypto.Error, ValueError) as e:
+        g_sys_log.error("Unable to build certificate (%s) for Hostname(%s) " +
+                        ": %s", m_cert.id, hostname.id, str(e))
+        continue
+      self.__storeCertificate(user, hostname, m_cert, password, renewal,
+                              key, req, cert)
+      l_cert.append(m_cert)
+    g_sys_log.info("Built %d new certificates for %d hostnames",
+                   len(l_cert), len(l_registered))
+    return l_cert
+
+  def __isJobRunning(self, name):
+    """Check if the previous run of a job is not finished
+
+    @param name [str] the name of the job
+    @return [bool] True if the job is still running, this run must be skipped
+    """
+    future = self.__d_job.get(name)
+    if future is None or future.done():
+      return False
+    g_sys_log.warning("PKI job '%s' is still running, this run is skipped",
+                      name)
+    return True
+
+  def __submitJob(self, name, function, *args):
+    """Run a file system job in the jobs thread
+
+    @param name [str] the name of the job
+    @param function [callable] the function of the job
+    @param args [list] the arguments of the function
+    @return [concurrent.futures.Future] the future of the job result
+    """
+    def done(future):
+      if future.exception() is not None:
+        g_sys_log.error("PKI job '%s' failed : %s", name,
+                        str(future.exception()))
+
+    future = self.__jobs.submit(function, *args)
+    future.add_done_callback(done)
+    self.__d_job[name] = future
+    return future
+
+  def reconcile(self, db, repair=None):
+    """Compare the certificate directory with the database certificates
+
+    The certificates are read from the database by the caller, then the
+    directory is compared in the jobs thread
+    @param db [Database] the database to read the certificates from
+    @param repair [bool] OPTIONNAL : if True fix the differences on the file
+                          system side, default to the reconcile_repair option
+    @return [concurrent.futures.Future] the future of the list of found
+                          differences as ReconcileIssue
+            [None] if the certificates cannot be read from the database or if
+                          the previous reconciliation is not finished
+    """
+    if self.__isJobRunning('reconcile'):
+      return None
+    since = time.time()
+    l_row = db.getCertificateSnapshot()
+    if l_row is None:
+      g_sys_log.error("Unable to read certificates from database for" +
+                      " reconciliation")
+      return None
+    return self.__submitJob('reconcile', self.__reconciler.run, l_row, repair,
+                            since)
+
+  def publishRevocations(self, db):
+    """Publish the revoked certificates of the database
+
+    The revocations come from the revoked serials set which is kept up to
+    date by the database polls
+    @param db [Database] the database to read the revoked serials from
+    @return [tuple] the (list of newly revoked serials, list of serials which
+                    are no longer revoked) since the previous publication
+    """
+    result = self.__crl.update(db.getRevokedSerialSet())
+    self.__crl_directory.update(self.__crl.revoked)
+    return result
+
+  def archiveExpiredCertificates(self, db):
+    """Archive the files of certificates expired since the retention period
+
+    The certificates are read from the database by the caller, then the
+    files are archived in the jobs thread
+    @param db [Database] the database to read the certificates from
+    @return [concurrent.futures.Future] the future of the number of archived
+                          files
+            [None] if the archival is disabled, if the certificates cannot be
+                          read from the database or if the previous archival
+                          is not finished
+    """
+    if not self.__archiver.enabled or self.__isJobRunning('archive'):
+      return None
+    l_row = db.getCertificateSnapshot()
+    if l_row is None:
+      g_sys_log.error("Unable to read certificates from database for" +
+                      " archival")
+      return None
+    return self.__submitJob('archive', self.__archiver.run, l_row)
@@ -0,0 +1,336 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Certificate store manifest program class
+
+This class keeps an append-only record of all files written into the
+certificate directory. Each line of the manifest file describes one added
+or removed file, the whole file is replayed at loading to build an in-memory
+index of the store, so lookups and integrity checks don't need any
+directory walk.
+
+Line format, tab separated :
+  + user_id hostname_id serial extension size sha256
+  - user_id hostname_id serial extension
+"""
+
+# System imports
+import collections
+import logging
+import os
+import threading
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.manifest')
+
+# An entry of the manifest, the path of the file is relative to the user
+# directory
+ManifestEntry = collections.namedtuple(
+    'ManifestEntry',
+    ['user_id', 'hostname_id', 'serial', 'extension', 'size', 'digest'])
+
+
+class PKIManifest(object):
+  """Build an instance of the certificate store manifest
+
+  This instance must be loaded by the PKI file tree
+  """
+
+  # constants for manifest operations
+  OP_ADD = '+'
+  OP_REMOVE = '-'
+  # the extensions of the files stored for each certificate
+  EXTENSIONS = ['crt', 'key', 'csr', 'ovpn', 'p12']
+  # the minimum number of lines of a manifest before it is compacted
+  COMPACT_MIN_LINES = 1000
+
+  def __init__(self, confparser):
+    """Constructor : Build a new empty manifest
+    """
+    self.__cp = confparser
+    # the path of the manifest file, None if the manifest is disabled
+    self.__path = None
+    # the index of entries by (serial, extension)
+    self.__d_entry = dict()
+    # the index of serials by hostname id
+    self.__d_hostname = collections.defaultdict(set)
+    self.__lock = threading.Lock()
+    self.__file = None
+    # True if the manifest file has been created at loading
+    self.__created = False
+    # the number of lines of the manifest file
+    self.__lines = 0
+    # the ratio of lines which don't describe a current entry above which
+    # the manifest is compacted
+    self.__compact_ratio = 0.5
+
+  def load(self, directory):
+    """Load the manifest configuration and replay the existing manifest
+
+    @param directory [str] the certificate directory
+    @return [bool] True if the manifest is ready to use
+    """
+    name = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'manifest_file',
+        fallback='.manifest')
+    if len(name) == 0:
+      g_sys_log.info("Certificate store manifest is disabled")
+      return True
+    self.__path = os.path.join(directory, name)
+    try:
+      self.__compact_ratio = self.__cp.getfloat(
+          self.__cp.PKI_SECTION,
+          'manifest_compact_ratio',
+          fallback=self.__compact_ratio)
+    except ValueError as e:
+      g_sys_log.error("Invalid option 'manifest_compact_ratio' : %s", str(e))
+      return False
+    if not 0.0 < self.__compact_ratio <= 1.0:
+      g_sys_log.error("Option 'manifest_compact_ratio' must be between 0 " +
+                      "and 1")
+      return False
+
+    self.__d_entry.clear()
+    self.__d_hostname.clear()
+    self.__lines = 0
+    self.__created = not os.path.exists(self.__path)
+    try:
+      if not self.__created:
+        self.__replay()
+      self.__file = open(self.__path, 'a')
+    except (IOError, OSError) as e:
+      g_sys_log.error("Unable to open manifest '%s' : %s",
+                      self.__path, str(e))
+      return False
+    g_sys_log.debug("Manifest loaded with %d entries", len(self.__d_entry))
+    with self.__lock:
+      self.__compactIfNeeded()
+    return True
+
+  def close(self):
+    """Close the manifest file
+    """
+    if self.__file is not None:
+      self.__file.close()
+      self.__file = None
+
+  @property
+  def enabled(self):
+    """Return the activation status of the manifest
+
+    @return [bool] True if files are recorded
+    """
+    return self.__path is not None
+
+  @property
+  def created(self):
+    """Return True if the manifest file did not exist before the loading
+
+    The files of an existing store must then be recorded by a scan
+    @return [bool] the creation status
+    """
+    return self.__created
+
+  def __len__(self):
+    """Return the number of files in the store
+
+    @return [int] the number of recorded files
+    """
+    return len(self.__d_entry)
+
+  def __iter__(self):
+    """Iterate over all recorded files
+
+    @return [iterator] the iterator over a copy of the entries
+    """
+    with self.__lock:
+      return iter(list(self.__d_entry.values()))
+
+# Tools
+  def __replay(self):
+    """Rebuild the index from the manifest file
+
+    A partially written last line, left by a crash, is truncated
+    """
+    valid_size = 0
+    with open(self.__path, 'r') as f:
+      for line in f:
+        if not line.endswith('\n'):
+          g_sys_log.warning("Truncate incomplete manifest line '%s'",
+                            line)
+          break
+        valid_size += len(line.encode())
+        self.__lines += 1
+        fields = line.rstrip('\n').split('\t')
+        try:
+          if fields[0] == self.OP_ADD and len(fields) == 7:
+            self.__apply(self.OP_ADD, ManifestEntry(
+                int(fields[1]), int(fields[2]), int(fields[3]), fields[4],
+                int(fields[5]), fields[6]))
+          elif fields[0] == self.OP_REMOVE and len(fields) == 5:
+            self.__apply(self.OP_REMOVE, ManifestEntry(
+                int(fields[1]), int(fields[2]), int(fields[3]), fields[4],
+                None, None))
+          else:
+            raise ValueError('unknown operation')
+        except ValueError as e:
+          g_sys_log.warning("Ignore invalid manifest line '%s' : %s",
+                            line.rstrip('\n'), str(e))
+    if valid_size != os.path.getsize(self.__path):
+      with open(self.__path, 'r+') as f:
+        f.truncate(valid_size)
+
+  def __apply(self, op, entry):
+    """Update the in-memory index with an operation
+
+    @param op [str] the operation, see constants above
+    @param entry [ManifestEntry] the concerned entry
+    """
+    key = (entry.serial, entry.extension)
+    if op == self.OP_ADD:
+      self.__d_entry[key] = entry
+      self.__d_hostname[entry.hostname_id].add(entry.serial)
+    elif key in self.__d_entry:
+      del self.__d_entry[key]
+      if not self.hasSerial(entry.serial):
+        self.__d_hostname[entry.hostname_id].discard(entry.serial)
+
+  def __compactIfNeeded(self):
+    """Compact the manifest when too many lines are dead
+
+    The lock must be held by the caller
+    """
+    if self.__lines < self.COMPACT_MIN_LINES:
+      return
+    dead = self.__lines - len(self.__d_entry)
+    if dead < self.__lines * self.__compact_ratio:
+      return
+    g_sys_log.info("Compacting manifest '%s', %d of its %d lines are dead",
+                   self.__path, dead, self.__lines)
+    self.__compact()
+
+  def __compact(self):
+    """Rewrite the manifest with only the current entries
+
+    The lock must be held by the caller
+    @return [bool] True if the manifest has been rewritten
+    """
+    tmp = self.__path + '.tmp'
+    try:
+      with open(tmp, 'w') as f:
+        for entry in self.__d_entry.values():
+          f.write(self.__formatLine(self.OP_ADD, entry))
+        f.flush()
+        os.fsync(f.fileno())
+      self.__file.close()
+      os.rename(tmp, self.__path)
+      self.__file = open(self.__path, 'a')
+    except (IOError, OSError) as e:
+      g_sys_log.error("Unable to compact manifest '%s' : %s",
+                      self.__path, str(e))
+      return False
+    self.__lines = len(self.__d_entry)
+    return True
+
+  @classmethod
+  def __formatLine(cls, op, entry):
+    """Return the manifest line of an operation
+
+    @param op [str] the operation, see constants above
+    @param entry [ManifestEntry] the concerned entry
+    @return [str] the line
+    """
+    fields = [op, entry.user_id, entry.hostname_id, entry.serial,
+              entry.extension]
+    if op == cls.OP_ADD:
+      fields += [entry.size, entry.digest]
+    return '\t'.join([str(field) for field in fields]) + '\n'
+
+# API
+  def record(self, l_change):
+    """Append a list of changes to the manifest
+
+    All lines are synced to disk at once, the index is only updated when
+    they are written. The manifest is compacted when the ratio of its dead
+    lines reaches the manifest_compact_ratio option
+    @param l_change [list] the list of changes as tuple (op, ManifestEntry)
+    @return [bool] True if the changes are recorded
+    """
+    if not self.enabled or len(l_change) == 0:
+      return True
+    with self.__lock:
+      try:
+        self.__file.write(''.join([self.__formatLine(op, entry)
+                                   for (op, entry) in l_change]))
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+      except (IOError, OSError) as e:
+        g_sys_log.error("Unable to write manifest '%s' : %s",
+                        self.__path, str(e))
+        return False
+      self.__lines += len(l_change)
+      for (op, entry) in l_change:
+        self.__apply(op, entry)
+      self.__compactIfNeeded()
+    return True
+
+  def compact(self):
+    """Rewrite the manifest with only the current entries
+
+    @return [bool] True if the manifest has been rewritten
+    """
+    if not self.enabled:
+      return False
+    with self.__lock:
+      return self.__compact()
+
+  def getEntry(self, serial, extension):
+    """Return the recorded file of a certificate
+
+    @param serial [int] the certificate serial
+    @param extension [str] the type of the file (key, csr or crt)
+    @return [ManifestEntry] the entry of the file
+            [None] if the file is not recorded
+    """
+    return self.__d_entry.get((serial, extension))
+
+  def hasSerial(self, serial):
+    """Check if at least one file is recorded for a certificate
+
+    @param serial [int] the certificate serial
+    @return [bool] True if a file of the certificate is recorded
+    """
+    return any([(serial, ext) in self.__d_entry
+                for ext in self.EXTENSIONS])
+
+  def getHostnameSerials(self, hostname_id):
+    """Return the serials of all certificates stored for a hostname
+
+    @param hostname_id [int] the id of the hostname
+    @return [list] the sorted list of serials
+    """
+    with self.__lock:
+      return sorted(self.__d_hostname.get(hostname_id, set()))
@@ -0,0 +1,170 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Client profile program class
+
+This class renders the client deliverables of a new certificate : an
+OpenVPN profile with the CA, the certificate and the private key embedded
+inline, and optionally a PKCS#12 bundle. Both are built once at issuance
+and stored beside the certificate files.
+
+The profile template is a regular OpenVPN client configuration in which
+these placeholders are replaced :
+  ${ca}, ${cert}, ${key} : the inline <ca>, <cert> and <key> blocks
+  ${common_name} : the common name of the certificate
+"""
+
+# System imports
+import logging
+import string
+
+from OpenSSL import crypto
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.profile')
+
+
+class PKIProfileBuilder(object):
+  """Build an instance of the client profile builder
+
+  This instance must be loaded by the PKI class
+  """
+
+  # the extensions of the deliverable files
+  EXT_PROFILE = 'ovpn'
+  EXT_PKCS12 = 'p12'
+
+  def __init__(self, confparser, filetree):
+    """Constructor : Build a new profile builder
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    @param filetree [PKIFileTree] the certificate file tree
+    """
+    self.__cp = confparser
+    self.__ft = filetree
+    # the profile template, None if profiles are disabled
+    self.__template = None
+    # a boolean which determine if PKCS#12 bundles are built
+    self.__pkcs12 = False
+    # the CA certificate in PEM format
+    self.__ca_pem = None
+    self.__ca = None
+
+  def load(self, ca):
+    """Load the profile settings
+
+    @param ca [X509] the certificate authority
+    @return [bool] True if the settings are valid
+    """
+    path = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'profile_template',
+        fallback='')
+    if len(path) > 0:
+      try:
+        with open(path, 'r') as f:
+          self.__template = string.Template(f.read())
+      except (IOError, OSError) as e:
+        g_sys_log.fatal("Unable to read profile template '%s' : %s",
+                        path, str(e))
+        return False
+
+    self.__pkcs12 = self.__cp.getboolean(
+        self.__cp.PKI_SECTION,
+        'profile_pkcs12',
+        fallback=self.__pkcs12)
+
+    self.__ca = ca
+    self.__ca_pem = crypto.dump_certificate(crypto.FILETYPE_PEM, ca).decode()
+    return True
+
+  @property
+  def enabled(self):
+    """Return the activation status of the profile rendering
+
+    @return [bool] True if profiles are built at issuance
+    """
+    return self.__template is not None
+
+# Tools
+  def __renderProfile(self, cert, cert_pem, key_pem):
+    """Render the profile template of a certificate
+
+    @param cert [X509] the certificate
+    @param cert_pem [bytes] the certificate in PEM format
+    @param key_pem [bytes] the private key in PEM format
+    @return [bytes] the profile
+    """
+    return self.__template.safe_substitute(
+        ca='<ca>\n' + self.__ca_pem + '</ca>',
+        cert='<cert>\n' + cert_pem.decode() + '</cert>',
+        key='<key>\n' + key_pem.decode() + '</key>',
+        common_name=cert.get_subject().CN).encode()
+
+  def __renderPKCS12(self, cert, key, password):
+    """Build the PKCS#12 bundle of a certificate
+
+    @param cert [X509] the certificate
+    @param key [PKey] the private key
+    @param password [str] the passphrase of the bundle or None
+    @return [bytes] the bundle
+    """
+    p12 = crypto.PKCS12()
+    p12.set_certificate(cert)
+    p12.set_privatekey(key)
+    p12.set_ca_certificates([self.__ca])
+    p12.set_friendlyname(cert.get_subject().CN.encode())
+    if password is not None:
+      return p12.export(password.encode())
+    return p12.export()
+
+# API
+  def build(self, user, hostname, m_cert, cert, key, key_pem, password):
+    """Render and store the deliverables of a new certificate
+
+    @param user [User] the owner of the hostname
+    @param hostname [Hostname] the hostname of the certificate
+    @param m_cert [Certificate] the certificate model
+    @param cert [X509] the signed certificate
+    @param key [PKey] the private key or None if it is not available
+    @param key_pem [bytes] the stored private key in PEM format
+    @param password [str] the passphrase of the private key or None
+    """
+    if not self.enabled or key_pem is None:
+      return
+    cert_pem = crypto.dump_certificate(crypto.FILETYPE_PEM, cert)
+    profile = self.__renderProfile(cert, cert_pem, key_pem)
+    self.__ft.storePKIUserFile(user, hostname, m_cert, self.EXT_PROFILE,
+                               profile)
+
+    if self.__pkcs12 and key is not None:
+      try:
+        bundle = self.__renderPKCS12(cert, key, password)
+      except crypto.Error as e:
+        g_sys_log.error("Unable to build PKCS#12 bundle of certificate (%s)" +
+                        " : %s", m_cert.id, str(e))
+        return
+      self.__ft.storePKIUserFile(user, hostname, m_cert, self.EXT_PKCS12,
+                                 bundle)
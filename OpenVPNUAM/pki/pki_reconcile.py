@@ -0,0 +1,400 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Certificate store reconciliation program class
+
+This class compares the certificate directory with the certificates rows of
+the database. User directories are scanned in parallel by a pool of threads
+which parse each certificate file, then the result is compared with a bulk
+snapshot of the certificate table and with the store manifest.
+Found differences are reported and can be repaired on the file system side,
+the database is never modified.
+"""
+
+# System imports
+import collections
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import os
+
+# Project imports
+from .pki_manifest import PKIManifest, ManifestEntry
+from ..helpers import *
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.reconcile')
+
+# A difference between the certificate directory and the database
+ReconcileIssue = collections.namedtuple('ReconcileIssue',
+                                        ['kind', 'serial', 'path', 'detail'])
+
+# A file found in the certificate directory, info is a tuple
+# (serial, begin, end) for parsed certificates, None for other files and
+# False if the certificate cannot be parsed
+ScannedFile = collections.namedtuple(
+    'ScannedFile',
+    ['user_id', 'hostname_id', 'serial', 'extension', 'path', 'info'])
+
+
+class PKIReconciler(object):
+  """Build an instance of the reconciliation scanner
+
+  This instance must be loaded by the PKI class
+  """
+
+  # constants for issue kinds
+  # a certificate row which is not expired but without certificate file
+  ISSUE_MISSING_FILE = 'missing-file'
+  # a certificate file without private key file
+  ISSUE_MISSING_KEY = 'missing-key'
+  # a file without certificate row
+  ISSUE_ORPHAN_FILE = 'orphan-file'
+  # a file stored under another user or hostname than its certificate row
+  ISSUE_MISPLACED_FILE = 'misplaced-file'
+  # a temporary file left by an interrupted write
+  ISSUE_TEMPORARY_FILE = 'temporary-file'
+  # a certificate file that cannot be parsed
+  ISSUE_UNREADABLE_FILE = 'unreadable-file'
+  # a certificate whose serial doesn't match its file name
+  ISSUE_SERIAL_MISMATCH = 'serial-mismatch'
+  # a certificate whose validity dates doesn't match its row
+  ISSUE_VALIDITY_MISMATCH = 'validity-mismatch'
+  # a file which is not recorded in the manifest
+  ISSUE_UNRECORDED_FILE = 'unrecorded-file'
+  # a manifest entry whose file doesn't exist
+  ISSUE_STALE_RECORD = 'stale-record'
+
+  def __init__(self, confparser, filetree, loader):
+    """Constructor : Build a new reconciliation scanner
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    @param filetree [PKIFileTree] the certificate file tree to scan
+    @param loader [function] the function which load a certificate file
+    """
+    self.__cp = confparser
+    self.__ft = filetree
+    self.__loader = loader
+    # the number of threads which scan user directories
+    self.__workers = 2 * multiprocessing.cpu_count()
+    # the directory into which orphan files are moved by repairs
+    self.__orphan_directory = "orphans/"
+    # True if the scheduled runs fix the differences
+    self.__repair = False
+
+  def load(self):
+    """Load the reconciliation settings
+
+    @return [bool] True if the settings are valid
+    """
+    self.__workers = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'reconcile_workers',
+        fallback=self.__workers)
+    if self.__workers <= 0:
+      g_sys_log.fatal("Option 'reconcile_workers' must be a positive number")
+      return False
+
+    self.__orphan_directory = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'orphan_directory',
+        fallback=self.__orphan_directory).rstrip('/') + '/'
+    if not os.path.isabs(self.__orphan_directory):
+      self.__orphan_directory = (self.__ft.getCertificateDirectory() +
+                                 self.__orphan_directory)
+
+    self.__repair = self.__cp.getboolean(self.__cp.PKI_SECTION,
+                                         'reconcile_repair',
+                                         fallback=self.__repair)
+    return True
+
+# Tools
+  @staticmethod
+  def __isRecent(entry, since):
+    """Check if a directory entry has been modified since a time
+
+    @param entry [os.DirEntry] the entry to check
+    @param since [float] the UNIX time, None if no entry is recent
+    @return [bool] True if the entry has been modified or removed since
+    """
+    if since is None:
+      return False
+    try:
+      return entry.stat().st_mtime >= since
+    except OSError:
+      return True
+
+  def __scanUserDirectory(self, user_id, path, since):
+    """List and parse all files of a user directory
+
+    @param user_id [int] the id of the user
+    @param path [str] the path of the user directory
+    @param since [float] the UNIX time from which modified files are
+                    skipped, None to keep all files
+    @return [tuple] the (list of ScannedFile of the user, set of skipped
+                    (serial, extension))
+    """
+    l_file = []
+    s_skipped = set()
+    for h_entry in os.scandir(path):
+      if not h_entry.is_dir() or not h_entry.name.isdigit():
+        if not self.__isRecent(h_entry, since):
+          l_file.append(ScannedFile(user_id, None, None, None, h_entry.path,
+                                    None))
+        continue
+      for f_entry in os.scandir(h_entry.path):
+        (name, ext) = os.path.splitext(f_entry.name)
+        ext = ext.lstrip('.')
+        if self.__isRecent(f_entry, since):
+          if name.isdigit():
+            s_skipped.add((int(name), ext))
+          continue
+        if not name.isdigit() or ext not in PKIManifest.EXTENSIONS:
+          l_file.append(ScannedFile(user_id, int(h_entry.name), None, ext,
+                                    f_entry.path, None))
+          continue
+        info = None
+        if ext == 'crt':
+          info = False
+          cert = self.__loader(f_entry.path)
+          if cert is not None:
+            info = (cert.get_serial_number(),
+                    generalizedTimeToDatetimeB(cert.get_notBefore()),
+                    generalizedTimeToDatetimeB(cert.get_notAfter()))
+        l_file.append(ScannedFile(user_id, int(h_entry.name), int(name), ext,
+                                  f_entry.path, info))
+    return (l_file, s_skipped)
+
+  def __scan(self, since):
+    """Scan all user directories in parallel
+
+    @param since [float] the UNIX time from which modified files are
+                    skipped, None to keep all files
+    @return [tuple] the (list of ScannedFile of the certificate directory,
+                    set of skipped (serial, extension))
+    """
+    l_file = []
+    s_skipped = set()
+    with concurrent.futures.ThreadPoolExecutor(self.__workers) as executor:
+      l_future = [executor.submit(self.__scanUserDirectory, user_id, path,
+                                  since)
+                  for (user_id, path) in self.__ft.listPKIUserDirectories()]
+      for future in l_future:
+        try:
+          (l_user_file, s_user_skipped) = future.result()
+        except OSError as e:
+          g_sys_log.error("Unable to scan user directory : %s", str(e))
+          continue
+        l_file += l_user_file
+        s_skipped |= s_user_skipped
+    return (l_file, s_skipped)
+
+  def __moveFile(self, src, dst):
+    """Move a file to another place of the file system
+
+    @param src [str] the current path of the file
+    @param dst [str] the new path of the file
+    @return [bool] True if the file has been moved
+    """
+    if os.path.exists(dst) or not self.__ft.makePath(os.path.dirname(dst)):
+      g_sys_log.error("Unable to move '%s', '%s' is not available", src, dst)
+      return False
+    try:
+      os.rename(src, dst)
+    except OSError as e:
+      g_sys_log.error("Unable to move '%s' to '%s' : %s", src, dst, str(e))
+      return False
+    return True
+
+  def __compare(self, l_file, d_row, repair):
+    """Compare scanned files with certificates rows
+
+    @param l_file [list<ScannedFile>] the scanned files
+    @param d_row [dict] the certificates rows by id
+    @param repair [bool] if True fix the file system differences
+    @return [tuple] the (list of ReconcileIssue, dict of stored files by
+                    (serial, extension) as ManifestEntry without digest)
+    """
+    l_issue = []
+    d_stored = dict()
+    root = self.__ft.getCertificateDirectory()
+    for f in l_file:
+      if f.serial is None:
+        if os.path.basename(f.path).startswith('.') and f.path.endswith('.tmp'):
+          l_issue.append(ReconcileIssue(self.ISSUE_TEMPORARY_FILE, None,
+                                        f.path, None))
+          if repair:
+            try:
+              os.remove(f.path)
+            except OSError as e:
+              g_sys_log.error("Unable to remove '%s' : %s", f.path, str(e))
+          continue
+        l_issue.append(ReconcileIssue(self.ISSUE_ORPHAN_FILE, None, f.path,
+                                      'unknown file'))
+        if repair:
+          self.__moveFile(f.path, self.__orphan_directory +
+                          os.path.relpath(f.path, root))
+        continue
+
+      row = d_row.get(f.serial)
+      if row is None:
+        l_issue.append(ReconcileIssue(self.ISSUE_ORPHAN_FILE, f.serial, f.path,
+                                      'no certificate row'))
+        if repair:
+          self.__moveFile(f.path, self.__orphan_directory +
+                          os.path.relpath(f.path, root))
+        continue
+
+      path = f.path
+      stored = ManifestEntry(f.user_id, f.hostname_id, f.serial, f.extension,
+                             None, None)
+      if row['user_id'] != f.user_id or row['hostname_id'] != f.hostname_id:
+        path = (self.__ft.getPKIUserDirectory(row['user_id']) +
+                str(row['hostname_id']) + "/" + str(f.serial) + "." +
+                f.extension)
+        l_issue.append(ReconcileIssue(self.ISSUE_MISPLACED_FILE, f.serial,
+                                      f.path, path))
+        if repair and self.__moveFile(f.path, path):
+          stored = stored._replace(user_id=row['user_id'],
+                                   hostname_id=row['hostname_id'])
+        else:
+          path = f.path
+      d_stored[(f.serial, f.extension)] = stored
+
+      if f.info is False:
+        l_issue.append(ReconcileIssue(self.ISSUE_UNREADABLE_FILE, f.serial,
+                                      path, None))
+      elif f.info is not None:
+        (serial, begin, end) = f.info
+        if serial != f.serial:
+          l_issue.append(ReconcileIssue(self.ISSUE_SERIAL_MISMATCH, f.serial,
+                                        path, serial))
+        if ((isinstance(row['certificate_begin_time'], datetime.datetime) and
+             row['certificate_begin_time'] != begin) or
+            (isinstance(row['certificate_end_time'], datetime.datetime) and
+             row['certificate_end_time'] != end)):
+          l_issue.append(ReconcileIssue(self.ISSUE_VALIDITY_MISMATCH,
+                                        f.serial, path, (begin, end)))
+    return (l_issue, d_stored)
+
+  def __compareManifest(self, d_stored, s_skipped, repair):
+    """Compare stored files with the manifest
+
+    @param d_stored [dict] the stored files by (serial, extension)
+    @param s_skipped [set] the (serial, extension) of the files which have not
+                    been scanned
+    @param repair [bool] if True fix the manifest
+    @return [list<ReconcileIssue>] the list of differences
+    """
+    manifest = self.__ft.manifest
+    l_issue = []
+    l_change = []
+    for entry in manifest:
+      if (entry.serial, entry.extension) in s_skipped:
+        continue
+      stored = d_stored.get((entry.serial, entry.extension))
+      if (stored is None or stored.user_id != entry.user_id or
+          stored.hostname_id != entry.hostname_id):
+        l_issue.append(ReconcileIssue(self.ISSUE_STALE_RECORD, entry.serial,
+                                      self.__ft.getManifestEntryPath(entry),
+                                      entry.extension))
+        l_change.append((PKIManifest.OP_REMOVE, entry))
+        if stored is not None:
+          l_change.append((PKIManifest.OP_ADD, stored))
+    for (key, stored) in d_stored.items():
+      if manifest.getEntry(*key) is None:
+        path = self.__ft.getManifestEntryPath(stored)
+        l_issue.append(ReconcileIssue(self.ISSUE_UNRECORDED_FILE,
+                                      stored.serial, path, stored.extension))
+        l_change.append((PKIManifest.OP_ADD, stored))
+    if repair:
+      l_record = []
+      for (op, entry) in l_change:
+        if op == PKIManifest.OP_ADD:
+          try:
+            (size, digest) = self.__ft.digestFile(
+                self.__ft.getManifestEntryPath(entry))
+          except (IOError, OSError):
+            continue
+          entry = entry._replace(size=size, digest=digest)
+        l_record.append((op, entry))
+      manifest.record(l_record)
+    return l_issue
+
+# API
+  def run(self, l_row, repair=None, since=None):
+    """Compare the certificate directory with the given certificates rows
+
+    @param l_row [list<dict>] the certificates rows, see
+                              Adapter.getCertificateSnapshot
+    @param repair [bool] OPTIONNAL : if True the differences are fixed on the
+                          file system side, orphan files are moved into the
+                          orphan directory and misplaced ones to their place.
+                          Default to the reconcile_repair option
+    @param since [float] OPTIONNAL : the UNIX time of the rows snapshot, the
+                          files modified since are skipped because their rows
+                          may be missing from the snapshot
+    @return [list<ReconcileIssue>] the list of found differences
+    """
+    if repair is None:
+      repair = self.__repair
+    # pending writes must be on disk
+    self.__ft.flush()
+    d_row = dict([(row['id'], row) for row in l_row])
+    (l_file, s_skipped) = self.__scan(since)
+    (l_issue, d_stored) = self.__compare(l_file, d_row, repair)
+
+    # rows of valid certificates must have their files
+    now = datetime.datetime.today()
+    for (serial, row) in d_row.items():
+      end = row['certificate_end_time']
+      if isinstance(end, datetime.datetime) and end < now:
+        continue
+      if (serial, 'crt') in s_skipped or (serial, 'key') in s_skipped:
+        continue
+      if (serial, 'crt') not in d_stored:
+        l_issue.append(ReconcileIssue(self.ISSUE_MISSING_FILE, serial, None,
+                                      'crt'))
+      elif (serial, 'key') not in d_stored:
+        l_issue.append(ReconcileIssue(self.ISSUE_MISSING_KEY, serial, None,
+                                      'key'))
+
+    if self.__ft.manifest.enabled:
+      l_issue += self.__compareManifest(d_stored, s_skipped, repair)
+
+    d_count = collections.Counter([issue.kind for issue in l_issue])
+    if len(l_issue) == 0:
+      g_sys_log.info("Reconciliation of %d files and %d certificates found " +
+                     "no difference", len(l_file), len(d_row))
+    else:
+      g_sys_log.warning("Reconciliation of %d files and %d certificates " +
+                        "found %d differences %s, %s", len(l_file),
+                        len(d_row), len(l_issue), dict(d_count),
+                        'repaired' if repair else
+                        'enable reconcile_repair to fix them')
+    for issue in l_issue:
+      g_sys_log.debug("Reconciliation %s : %s", issue.kind, str(issue))
+    return l_issue
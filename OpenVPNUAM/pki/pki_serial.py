@@ -0,0 +1,204 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""PKI - Serial Number Allocator program class
+
+This class reserves blocks of certificate serial numbers ahead of time. With
+a reserved serial, a certificate can be signed immediately and its row
+inserted later through the database insert queue.
+Blocks are leased from the database adapter, or from a local counter file
+which is durably updated before any serial of the block is used.
+"""
+
+# System imports
+import logging
+import os
+import threading
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.pki.serial')
+
+
+class PKISerialAllocator(object):
+  """Build an instance of the serial number allocator
+
+  This instance must be loaded by the PKI class
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build a new serial allocator
+    """
+    self.__cp = confparser
+    # the number of serial to reserve at once
+    # a size of zero disable the allocator
+    self.__lease_size = 0
+    # the path to the local counter file, if None the serials are leased
+    # from the database
+    self.__path = None
+    # the next available serial of the current lease
+    self.__next = 0
+    # the end (excluded) of the current lease
+    self.__end = 0
+    self.__lock = threading.Lock()
+
+  def load(self):
+    """Load the allocator settings
+
+    @return [bool] True if the allocator is ready to work
+                   False otherwise
+    """
+    self.__lease_size = self.__cp.getint(
+        self.__cp.PKI_SECTION,
+        'serial_lease_size',
+        fallback=self.__lease_size)
+    if self.__lease_size < 0:
+      g_sys_log.error("Option 'serial_lease_size' must be a positive number")
+      return False
+    if not self.enabled:
+      return True
+
+    self.__path = self.__cp.get(
+        self.__cp.PKI_SECTION,
+        'serial_file',
+        fallback=None)
+    if self.__path:
+      g_sys_log.info("Using serial leases of %d from file '%s'",
+                     self.__lease_size, self.__path)
+    else:
+      self.__path = None
+      g_sys_log.info("Using serial leases of %d from database",
+                     self.__lease_size)
+    return True
+
+# Getters methods
+  @property
+  def enabled(self):
+    """Return the activation status of the allocator
+
+    @return [bool] True if serials must be reserved ahead of time
+    """
+    return self.__lease_size > 0
+
+# Tools
+  def __writeCounter(self, value):
+    """Durably write the next available serial into the counter file
+
+    The value is written into a temporary file which is synced then renamed
+    @param value [int] the next available serial
+    @return [bool] True if the value is stored on disk
+    """
+    tmp = self.__path + '.tmp'
+    try:
+      with open(tmp, 'w') as f:
+        f.write(str(value) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      os.rename(tmp, self.__path)
+      # sync the directory to make the rename durable
+      fd = os.open(os.path.dirname(os.path.abspath(self.__path)), os.O_RDONLY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    except OSError as e:
+      g_sys_log.error("Unable to write serial file '%s' : %s",
+                      self.__path, str(e))
+      return False
+    return True
+
+  def __leaseFromFile(self, db, count):
+    """Reserve a range of serial from the local counter file
+
+    @param db [Database] the database used to initialize a new counter
+    @param count [int] the number of serial to reserve
+    @return [int] the first serial of the range
+            [None] if an error happen
+    """
+    try:
+      with open(self.__path, 'r') as f:
+        first = int(f.read().strip())
+    except FileNotFoundError:
+      # start after the existing certificates
+      last_id = db.getLastCertificateId()
+      if last_id is None:
+        return None
+      first = last_id + 1
+      g_sys_log.info("Initialize serial file '%s' at %d", self.__path, first)
+    except (OSError, ValueError) as e:
+      g_sys_log.error("Unable to read serial file '%s' : %s",
+                      self.__path, str(e))
+      return None
+    if not self.__writeCounter(first + count):
+      return None
+    return first
+
+  def __lease(self, db, count):
+    """Reserve a new range of serial
+
+    @param db [Database] the database to use for reservation
+    @param count [int] the number of serial to reserve
+    @return [bool] True if a new lease is available
+    """
+    if self.__path is None:
+      first = db.reserveSerialRange(count)
+    else:
+      first = self.__leaseFromFile(db, count)
+    if first is None:
+      g_sys_log.error("Unable to lease %d serial numbers", count)
+      return False
+    g_sys_log.debug("Leased serial numbers from %d to %d",
+                    first, first + count - 1)
+    self.__next = first
+    self.__end = first + count
+    return True
+
+# API
+  def assignSerials(self, db, l_cert):
+    """Set a reserved serial as id of each given certificate
+
+    Serials of a failed lease are lost, which only leaves a gap in serials.
+    When this function fail, the caller must not fall back to an auto
+    increment insert, it could give a serial already leased but not yet
+    inserted
+    @param db [Database] the database to use if a new lease is needed
+    @param l_cert [list<Certificate>] the certificates without id
+    @return [bool] True if all certificates have received a serial
+                   False if the allocator is disabled or the lease fail, in
+                   this case no certificate is modified
+    """
+    if not self.enabled:
+      return False
+    l_serial = []
+    with self.__lock:
+      while len(l_serial) < len(l_cert):
+        if self.__next >= self.__end:
+          needed = len(l_cert) - len(l_serial)
+          if not self.__lease(db, max(self.__lease_size, needed)):
+            return False
+        l_serial.append(self.__next)
+        self.__next += 1
+    for (cert, serial) in zip(l_cert, l_serial):
+      cert.load({'id': serial})
+    return True
@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Revocation - This module keep the set of revoked certificates serials
+
+The set is filled from the database adapter after each poll of the users,
+incrementally from the last known revocation time, and fully rebuilt from
+time to time to forget un-revoked certificates. The revocation row of each
+serial is kept, so the CRLs can be published from the set without any
+other database read.
+"""
+
+# System imports
+import logging
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.revocation')
+
+
+class RevokedSerialSet(object):
+  """This class is the set of revoked certificates serials
+  """
+
+  def __init__(self):
+    """Constructor : Build an empty set
+    """
+    # the revocation row by serial, replaced but never modified
+    self.__d_row = dict()
+    # the greatest revocation time seen, None if the set has never been filled
+    self.__last_time = None
+    # incremented each time the set of serials changes
+    self.__generation = 0
+
+  def __len__(self):
+    """Return the number of revoked serials
+
+    @return [int] the number of serials
+    """
+    return len(self.__d_row)
+
+  def __iter__(self):
+    """Iterate over revoked serials
+
+    @return [iterator] the iterator over serials
+    """
+    return iter(self.__d_row)
+
+  def __contains__(self, serial):
+    """Check if a serial is revoked
+
+    @param serial [int] the serial of the certificate
+    @return [bool] True if the certificate is revoked
+    """
+    return serial in self.__d_row
+
+  def getRevocation(self, serial):
+    """Return the revocation row of a serial
+
+    @param serial [int] the serial of the certificate
+    @return [dict] the row, see Adapter.getRevokedCertificateList
+            [None] if the certificate is not revoked
+    """
+    return self.__d_row.get(serial)
+
+  @property
+  def last_time(self):
+    """Return the greatest known revocation time
+
+    @return [datetime] the revocation time
+            [None] if the set has never been filled
+    """
+    return self.__last_time
+
+  @property
+  def generation(self):
+    """Return the number of changes of the set
+
+    @return [int] the generation, which is incremented by each change
+    """
+    return self.__generation
+
+  def update(self, l_row, full=False):
+    """Add revoked certificates rows to the set
+
+    The set is replaced by a new instance so readers never need any lock
+    @param l_row [list<dict>] the rows, see Adapter.getRevokedCertificateList
+    @param full [bool] OPTIONNAL : if True the rows replace the whole set
+    @return [int] the number of new revoked serials
+    """
+    d_row = dict() if full else dict(self.__d_row)
+    last_time = None if full else self.__last_time
+    for row in l_row:
+      if row['revoked_time'] is None:
+        continue
+      d_row[row['id']] = row
+      if last_time is None or row['revoked_time'] > last_time:
+        last_time = row['revoked_time']
+    added = len(d_row) - (0 if full else len(self.__d_row))
+
+    if d_row != self.__d_row:
+      self.__generation += 1
+    self.__d_row = d_row
+    self.__last_time = last_time
+    if added != 0:
+      g_sys_log.debug("Revoked serials set updated with %d serials, %d total",
+                      added, len(d_row))
+    return added
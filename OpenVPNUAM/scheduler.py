@@ -0,0 +1,370 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Scheduler - Cooperative runner of the periodic tasks of the daemon
+
+All periodic jobs of the main loop, database poll, queue flush, renewal
+scan, revocation publication, status ingest or archival, are registered here
+as named tasks. Each task has its own interval, a random jitter which spreads
+the runs of tasks with the same interval, and a policy for the runs missed
+while the loop was busy. Tasks run one at a time in the thread of the main
+loop, so a task which lasts longer than its interval is never started again
+before its end, and the duration and the lag of each run are recorded to
+find which task is eating the loop.
+"""
+
+# System imports
+import logging
+import random
+import threading
+import time
+
+# Project imports
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.scheduler')
+
+
+class TaskMetrics(object):
+  """This class records the runs statistics of a task
+  """
+
+  def __init__(self):
+    """Constructor : Build empty statistics
+    """
+    # number of finished runs, and of runs which raised an exception
+    self.runs = 0
+    self.failures = 0
+    # number of occurrences dropped by the missed runs policy
+    self.skipped = 0
+    # number of occurrences dropped because the previous run was still
+    # in progress at their time
+    self.overlaps = 0
+    # durations and lags of runs in seconds
+    self.last_duration = 0.0
+    self.max_duration = 0.0
+    self.total_duration = 0.0
+    self.last_lag = 0.0
+    self.max_lag = 0.0
+    self.total_lag = 0.0
+
+  @property
+  def mean_duration(self):
+    """Return the mean duration of runs
+
+    @return [float] the number of seconds
+    """
+    return self.total_duration / self.runs if self.runs else 0.0
+
+  @property
+  def mean_lag(self):
+    """Return the mean lag of runs
+
+    @return [float] the number of seconds
+    """
+    return self.total_lag / self.runs if self.runs else 0.0
+
+  def add(self, lag, duration, failed=False):
+    """Record a run
+
+    @param lag [float] the number of seconds between the scheduled time and
+                the start of the run
+    @param duration [float] the number of seconds of the run
+    @param failed [bool] OPTIONNAL : True if the run raised an exception
+    """
+    self.runs += 1
+    if failed:
+      self.failures += 1
+    self.last_lag = lag
+    self.max_lag = max(self.max_lag, lag)
+    self.total_lag += lag
+    self.last_duration = duration
+    self.max_duration = max(self.max_duration, duration)
+    self.total_duration += duration
+
+  def __str__(self):
+    """Return a one line summary of the statistics
+
+    @return [str] the summary
+    """
+    return ("%d runs, %d failures, %d skipped, %d overlaps, " +
+            "duration %.3f/%.3fs, lag %.3f/%.3fs (mean/max)") % (
+        self.runs, self.failures, self.skipped, self.overlaps,
+        self.mean_duration, self.max_duration, self.mean_lag, self.max_lag)
+
+
+class ScheduledTask(object):
+  """This class describes a periodic task and its scheduling state
+  """
+
+  # the policies for the occurrences missed while the loop was busy
+  # wait for the next occurrence
+  MISSED_SKIP = 'skip'
+  # run once now for all missed occurrences
+  MISSED_RUN_ONCE = 'run-once'
+  # run each missed occurrence, back to back
+  MISSED_CATCH_UP = 'catch-up'
+  MISSED_POLICIES = [MISSED_SKIP, MISSED_RUN_ONCE, MISSED_CATCH_UP]
+
+  # maximum number of missed occurrences run by the catch up policy
+  CATCH_UP_LIMIT = 10
+
+  def __init__(self, name, function, interval, jitter=0.0,
+               missed=MISSED_RUN_ONCE):
+    """Constructor : Build a new task
+
+    @param name [str] the name of the task
+    @param function [callable] the function to call without argument
+    @param interval [float] the number of seconds between two runs
+    @param jitter [float] OPTIONNAL : the maximum number of seconds randomly
+                added to each scheduled time
+    @param missed [str] OPTIONNAL : the policy of missed runs, see constants
+    """
+    assert interval > 0
+    assert jitter >= 0
+    assert missed in self.MISSED_POLICIES
+    self.name = name
+    self.function = function
+    self.interval = interval
+    self.jitter = jitter
+    self.missed = missed
+    self.metrics = TaskMetrics()
+    # True while the function is running
+    self.running = False
+    # the monotonic time of the current occurrence, without jitter, and the
+    # time at which it must run
+    self.__due = None
+    self.__next_time = None
+
+  @property
+  def next_time(self):
+    """Return the time of the next run
+
+    @return [float] the monotonic time
+    """
+    return self.__next_time
+
+  def schedule(self, due):
+    """Set the time of the next occurrence
+
+    @param due [float] the monotonic time of the occurrence
+    """
+    self.__due = due
+    self.__next_time = due
+    if self.jitter > 0:
+      self.__next_time += random.uniform(0, self.jitter)
+
+  def start(self, now):
+    """Apply the missed runs policy to the current occurrence
+
+    @param now [float] the current monotonic time
+    @return [bool] True if the task must run now
+    """
+    missed = int((now - self.__next_time) // self.interval)
+    if missed <= 0:
+      return True
+    if self.missed == self.MISSED_SKIP:
+      self.metrics.skipped += missed + 1
+      self.schedule(self.__due + (missed + 1) * self.interval)
+      return False
+    if self.missed == self.MISSED_RUN_ONCE:
+      self.metrics.skipped += missed
+      self.__due += missed * self.interval
+    elif missed > self.CATCH_UP_LIMIT:
+      self.metrics.skipped += missed - self.CATCH_UP_LIMIT
+      self.__due += (missed - self.CATCH_UP_LIMIT) * self.interval
+    return True
+
+  def finish(self, start, end, failed=False):
+    """Record a run and schedule the next occurrence
+
+    The occurrences which have been reached during the run are dropped
+    @param start [float] the monotonic time of the start of the run
+    @param end [float] the monotonic time of the end of the run
+    @param failed [bool] OPTIONNAL : True if the run raised an exception
+    """
+    self.metrics.add(max(0.0, start - self.__next_time), end - start, failed)
+    due = self.__due + self.interval
+    overlaps = int((end - due) // self.interval) + 1 if end > due else 0
+    if overlaps > 0 and due > start:
+      self.metrics.overlaps += overlaps
+      g_sys_log.warning("Task '%s' lasted %.3f seconds, longer than its " +
+                        "interval", self.name, end - start)
+      due += overlaps * self.interval
+    self.schedule(due)
+
+
+class Scheduler(object):
+  """This class runs the periodic tasks from the main loop
+  """
+
+  def __init__(self, confparser):
+    """Constructor : Build a scheduler without task
+
+    @param confparser [OVPNUAMConfigParser] the configuration
+    """
+    self.__cp = confparser
+    self.__l_task = []
+    # number of seconds between two logs of the tasks statistics, 0 to
+    # disable them
+    self.__metrics_interval = 3600.0
+    # set to wake up the loop, and to stop it with __stopped
+    self.__event = threading.Event()
+    self.__stopped = False
+
+  def load(self):
+    """Load the scheduler configuration
+
+    @return [bool] True if the configuration is valid
+    """
+    self.__metrics_interval = self.__cp.getfloat(
+        self.__cp.SCHEDULER_SECTION, 'metrics_interval',
+        fallback=self.__metrics_interval)
+    if self.__metrics_interval > 0:
+      return self.addTask('metrics', self.logMetrics,
+                          self.__metrics_interval,
+                          missed=ScheduledTask.MISSED_SKIP) is not None
+    return True
+
+  def addTask(self, name, function, interval, jitter=0.0,
+              missed=ScheduledTask.MISSED_RUN_ONCE, delay=None):
+    """Register a new periodic task
+
+    The interval, the jitter and the missed runs policy can be overridden by
+    the options <name>_interval, <name>_jitter and <name>_missed of the
+    scheduler section. A task with a null interval is disabled.
+    @param name [str] the name of the task
+    @param function [callable] the function to call without argument
+    @param interval [float] the default number of seconds between two runs
+    @param jitter [float] OPTIONNAL : the default maximum number of seconds
+                randomly added to each scheduled time
+    @param missed [str] OPTIONNAL : the default policy of missed runs
+    @param delay [float] OPTIONNAL : the number of seconds before the first
+                run, one interval by default
+    @return [ScheduledTask] the new task
+            [False] if the task is disabled
+            [None] if its configuration is invalid
+    """
+    section = self.__cp.SCHEDULER_SECTION
+    try:
+      interval = self.__cp.getfloat(section, name + '_interval',
+                                    fallback=interval)
+      jitter = self.__cp.getfloat(section, name + '_jitter', fallback=jitter)
+    except ValueError as e:
+      g_sys_log.fatal("Invalid scheduling of task '%s' : %s", name, str(e))
+      return None
+    missed = self.__cp.get(section, name + '_missed', fallback=missed)
+    if missed not in ScheduledTask.MISSED_POLICIES:
+      g_sys_log.fatal("Option '%s_missed' must be one of %s", name,
+                      ScheduledTask.MISSED_POLICIES)
+      return None
+    if jitter < 0:
+      g_sys_log.fatal("Option '%s_jitter' must be a positive number", name)
+      return None
+    if interval <= 0:
+      g_sys_log.info("Task '%s' disabled", name)
+      return False
+    assert self.getTask(name) is None
+
+    task = ScheduledTask(name, function, interval, jitter, missed)
+    task.schedule(time.monotonic() + (interval if delay is None else delay))
+    self.__l_task.append(task)
+    g_sys_log.debug("Task '%s' scheduled every %s seconds", name, interval)
+    return task
+
+  def getTask(self, name):
+    """Return a registered task
+
+    @param name [str] the name of the task
+    @return [ScheduledTask] the task
+            [None] if there is no task with this name
+    """
+    for task in self.__l_task:
+      if task.name == name:
+        return task
+    return None
+
+  def runPending(self, now=None):
+    """Run the tasks which have reached their time
+
+    The tasks run in the order of their scheduled times
+    @param now [float] OPTIONNAL : the current monotonic time
+    @return [float] the number of seconds until the next task
+            [None] if there is no task
+    """
+    if now is None:
+      now = time.monotonic()
+    l_due = [task for task in self.__l_task
+             if task.next_time <= now and not task.running]
+    l_due.sort(key=lambda task: task.next_time)
+    for task in l_due:
+      if self.__stopped:
+        break
+      if not task.start(now):
+        continue
+      task.running = True
+      failed = False
+      start = time.monotonic()
+      try:
+        task.function()
+      except Exception as e:
+        failed = True
+        g_sys_log.error("Task '%s' failed : %s", task.name, str(e))
+      finally:
+        task.running = False
+      now = time.monotonic()
+      task.finish(start, now, failed)
+
+    if len(self.__l_task) == 0:
+      return None
+    return max(0.0, min([task.next_time for task in self.__l_task]) - now)
+
+  def run(self):
+    """Run the tasks until stop() is called
+    """
+    self.__stopped = False
+    while not self.__stopped:
+      self.__event.wait(self.runPending())
+      self.__event.clear()
+
+  def stop(self):
+    """Make the loop return after the current task
+    """
+    self.__stopped = True
+    self.__event.set()
+
+  def getMetrics(self):
+    """Return the statistics of all tasks
+
+    @return [dict] the TaskMetrics by task name
+    """
+    return dict([(task.name, task.metrics) for task in self.__l_task])
+
+  def logMetrics(self):
+    """Log the statistics of all tasks, the slowest first
+    """
+    for task in sorted(self.__l_task,
+                       key=lambda task: task.metrics.total_duration,
+                       reverse=True):
+      g_sys_log.info("Task '%s' : %s", task.name, str(task.metrics))
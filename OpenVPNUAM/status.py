@@ -0,0 +1,281 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Status - Incremental reader of the OpenVPN status file
+
+OpenVPN rewrites its status file every --status interval. This reader keeps
+the identity of the last read file (inode, size and modification time) and
+does not read it again until it changes. The file is mapped in memory and
+only the client lines are extracted, so reading it costs one pass over the
+mapping, then the sessions are compared with the previous ones to produce
+connect and disconnect events.
+The three --status-version formats are supported, the columns of the
+version 2 and 3 formats are found from their HEADER lines.
+"""
+
+# System imports
+import collections
+import logging
+import mmap
+import os
+
+# Global project declarations
+g_sys_log = logging.getLogger('openvpn-uam.status')
+
+# A client session read from the status file
+StatusClient = collections.namedtuple(
+    'StatusClient',
+    ['common_name', 'real_address', 'virtual_address', 'bytes_received',
+     'bytes_sent', 'connected_since'])
+
+
+class StatusFileReader(object):
+  """This class produces the sessions changes of an OpenVPN status file
+  """
+
+  # the markers of the status file sections
+  V1_CLIENT_LIST = b'OpenVPN CLIENT LIST'
+  V1_CLIENT_HEADER = b'Common Name,'
+  V1_ROUTING_TABLE = b'ROUTING TABLE'
+  V1_ROUTING_HEADER = b'Virtual Address,'
+  V1_END = b'GLOBAL STATS'
+  CLIENT_LIST = b'CLIENT_LIST'
+  ROUTING_TABLE = b'ROUTING_TABLE'
+  HEADER = b'HEADER'
+  # the columns of the version 2 and 3 formats
+  COL_COMMON_NAME = b'Common Name'
+  COL_REAL_ADDRESS = b'Real Address'
+  COL_VIRTUAL_ADDRESS = b'Virtual Address'
+  COL_BYTES_RECEIVED = b'Bytes Received'
+  COL_BYTES_SENT = b'Bytes Sent'
+  COL_CONNECTED_SINCE = b'Connected Since (time_t)'
+  # the index of the columns of each section when the file has no HEADER
+  # line, as written by OpenVPN 2.4 and later
+  DEFAULT_COLUMNS = {
+      CLIENT_LIST: {COL_COMMON_NAME: 1, COL_REAL_ADDRESS: 2,
+                    COL_VIRTUAL_ADDRESS: 3, COL_BYTES_RECEIVED: 5,
+                    COL_BYTES_SENT: 6, COL_CONNECTED_SINCE: 8},
+      ROUTING_TABLE: {COL_VIRTUAL_ADDRESS: 1, COL_COMMON_NAME: 2,
+                      COL_REAL_ADDRESS: 3},
+  }
+
+  def __init__(self, path):
+    """Constructor : Build a new reader
+
+    @param path [str] the path of the status file
+    """
+    self.__path = path
+    # the (inode, size, mtime) of the last read file
+    self.__identity = None
+    # the current sessions, by (common name, real address)
+    self.__d_client = dict()
+
+  @property
+  def clients(self):
+    """Return the current sessions
+
+    @return [dict] the StatusClient by (common_name, real_address)
+    """
+    return self.__d_client
+
+  def read(self):
+    """Read the status file if it has changed
+
+    @return [tuple] the (l_connect, l_disconnect) lists of StatusClient
+            [None] if the file has not changed or cannot be read
+    """
+    try:
+      with open(self.__path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        identity = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if identity == self.__identity:
+          return None
+        if st.st_size == 0:
+          # the file is being rewritten, wait for the next change
+          return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+          d_client = self.__parse(buf)
+    except (IOError, OSError, ValueError) as e:
+      g_sys_log.error("Unable to read status file '%s' : %s", self.__path,
+                      str(e))
+      return None
+    if d_client is None:
+      # incomplete file, read it again at the next call
+      return None
+    self.__identity = identity
+
+    l_connect = []
+    l_disconnect = []
+    d_previous = self.__d_client
+    for key, client in d_client.items():
+      previous = d_previous.get(key)
+      if previous is None or previous.connected_since != client.connected_since:
+        if previous is not None:
+          l_disconnect.append(previous)
+        l_connect.append(client)
+    for key, client in d_previous.items():
+      if key not in d_client:
+        l_disconnect.append(client)
+    self.__d_client = d_client
+    return (l_connect, l_disconnect)
+
+  def __parse(self, buf):
+    """Extract the sessions from the mapped status file
+
+    @param buf [mmap] the mapping of the file
+    @return [dict] the StatusClient by (common_name, real_address)
+            [None] if the file is incomplete
+    """
+    d_client = dict()
+    # the virtual addresses by (common name, real address) of the routing
+    # table
+    d_virtual = dict()
+    # the separator of version 2 and 3 formats, None for version 1
+    sep = None
+    # the line prefixes and the columns index of the version 2 and 3 sections
+    client_marker = None
+    routing_marker = None
+    d_column = dict(self.DEFAULT_COLUMNS)
+    section = None
+    complete = False
+    size = len(buf)
+    pos = 0
+    while pos < size:
+      end = buf.find(b'\n', pos)
+      if end < 0:
+        end = size
+      start = pos
+      pos = end + 1
+      if sep is not None:
+        # only client, routing and header lines are copied out of the mapping
+        head = buf[start:start + len(self.ROUTING_TABLE) + 1]
+        if head.startswith(client_marker):
+          fields = buf[start:end].rstrip(b'\r').split(sep)
+          row = self.__getColumns(fields, d_column[self.CLIENT_LIST])
+          if row is None:
+            continue
+          client = StatusClient(
+              row[self.COL_COMMON_NAME].decode(errors='replace'),
+              row[self.COL_REAL_ADDRESS].decode(errors='replace'),
+              row[self.COL_VIRTUAL_ADDRESS].decode(errors='replace') or None,
+              self.__toInt(row[self.COL_BYTES_RECEIVED]),
+              self.__toInt(row[self.COL_BYTES_SENT]),
+              self.__toInt(row[self.COL_CONNECTED_SINCE]))
+          d_client[(client.common_name, client.real_address)] = client
+        elif head.startswith(routing_marker):
+          fields = buf[start:end].rstrip(b'\r').split(sep)
+          row = self.__getColumns(fields, d_column[self.ROUTING_TABLE])
+          if row is not None:
+            d_virtual[(row[self.COL_COMMON_NAME].decode(errors='replace'),
+                       row[self.COL_REAL_ADDRESS].decode(errors='replace'))] = (
+                row[self.COL_VIRTUAL_ADDRESS].decode(errors='replace'))
+        elif head.startswith(self.HEADER + sep):
+          fields = buf[start:end].rstrip(b'\r').split(sep)
+          if len(fields) > 2 and fields[1] in d_column:
+            # the data lines have no HEADER field before their section name
+            d_index = dict([(name, i + 1)
+                            for (i, name) in enumerate(fields[2:])])
+            l_name = list(self.DEFAULT_COLUMNS[fields[1]])
+            if all([name in d_index for name in l_name]):
+              d_column[fields[1]] = dict([(name, d_index[name])
+                                          for name in l_name])
+            else:
+              g_sys_log.warning("Unknown %s columns in status file, use the" +
+                                " default ones", fields[1].decode())
+        elif head.startswith(b'END'):
+          complete = True
+          break
+        continue
+
+      line = buf[start:end].rstrip(b'\r')
+      if section is None:
+        for title in (b'TITLE', self.HEADER):
+          if line.startswith(title) and len(line) > len(title):
+            sep = line[len(title):len(title) + 1]
+            client_marker = self.CLIENT_LIST + sep
+            routing_marker = self.ROUTING_TABLE + sep
+            # read the line again, it can be a HEADER line
+            pos = start
+        if line.startswith(self.V1_CLIENT_LIST):
+          section = self.V1_CLIENT_LIST
+        continue
+
+      # version 1 format
+      if line.startswith(self.V1_ROUTING_TABLE):
+        section = self.V1_ROUTING_TABLE
+      elif line.startswith(self.V1_END) or line == b'END':
+        complete = True
+        break
+      elif (line.startswith(self.V1_CLIENT_HEADER) or
+            line.startswith(self.V1_ROUTING_HEADER) or
+            line.startswith(b'Updated,')):
+        continue
+      elif section == self.V1_CLIENT_LIST:
+        fields = line.split(b',', 4)
+        if len(fields) == 5:
+          client = StatusClient(
+              fields[0].decode(errors='replace'),
+              fields[1].decode(errors='replace'), None,
+              self.__toInt(fields[2]), self.__toInt(fields[3]),
+              fields[4].decode(errors='replace'))
+          d_client[(client.common_name, client.real_address)] = client
+      elif section == self.V1_ROUTING_TABLE:
+        fields = line.split(b',', 3)
+        if len(fields) >= 3:
+          d_virtual[(fields[1].decode(errors='replace'),
+                     fields[2].decode(errors='replace'))] = (
+              fields[0].decode(errors='replace'))
+
+    if not complete:
+      return None
+    for key, address in d_virtual.items():
+      if key in d_client and d_client[key].virtual_address is None:
+        d_client[key] = d_client[key]._replace(virtual_address=address)
+    return d_client
+
+  @staticmethod
+  def __getColumns(fields, d_index):
+    """Return the fields of a line by column name
+
+    @param fields [list<bytes>] the fields of the line
+    @param d_index [dict] the index of the fields by column name
+    @return [dict] the fields by column name
+            [None] if the line is too short
+    """
+    if len(fields) <= max(d_index.values()):
+      return None
+    return dict([(name, fields[i]) for (name, i) in d_index.items()])
+
+  @staticmethod
+  def __toInt(value):
+    """Convert a field to an integer
+
+    @param value [bytes] the field
+    @return [int] the integer value, 0 if the field is not a number
+    """
+    try:
+      return int(value)
+    except ValueError:
+      return 0
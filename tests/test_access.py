@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the access time windows"""
+
+# System imports
+import collections
+import datetime
+import time
+import unittest
+
+# Project imports
+from OpenVPNUAM.access import AccessWindowIndex, parseAccessTime
+
+
+class TestAccessWindowIndex(unittest.TestCase):
+  """Move the users states through their window boundaries"""
+
+  User = collections.namedtuple('User', ['id', 'start_time', 'stop_time'])
+
+  def setUp(self):
+    self.now = time.mktime(datetime.datetime(2030, 1, 15, 12, 0).timetuple())
+    self.index = AccessWindowIndex()
+
+  def at(self, hours):
+    """Return a time relative to the reference time
+
+    @param hours [int] the number of hours from the reference time
+    @return [datetime] the time
+    """
+    return datetime.datetime.fromtimestamp(self.now + hours * 3600)
+
+  def time(self, hours):
+    return self.now + hours * 3600
+
+  def testUpdate(self):
+    self.index.update([self.User(1, None, None),
+                       self.User(2, self.at(2), None),
+                       self.User(3, None, self.at(-1)),
+                       self.User(4, self.at(-1), self.at(3)),
+                       self.User(5, '2029-01-01', '0000-00-00 00:00:00')],
+                      self.now)
+    # unrestricted users are not indexed
+    self.assertEqual(len(self.index), 4)
+    self.assertEqual(self.index.getWindow(1), (None, None))
+    self.assertEqual(self.index.check(1, self.now), None)
+    self.assertEqual(self.index.check(2, self.now),
+                     AccessWindowIndex.STATE_NOT_STARTED)
+    self.assertEqual(self.index.check(3, self.now),
+                     AccessWindowIndex.STATE_STOPPED)
+    self.assertTrue(self.index.isAllowed(4, self.now))
+    self.assertTrue(self.index.isAllowed(5, self.now))
+    self.assertEqual(self.index.next_time, self.time(2))
+
+  def testBoundary(self):
+    self.index.update([self.User(1, self.at(1), self.at(2))], self.now)
+    self.assertEqual(self.index.advance(self.time(1) - 1), [])
+    self.assertEqual(self.index.next_time, self.time(1))
+    # a boundary is applied at its exact time
+    self.assertEqual(self.index.advance(self.time(1)), [(1, None)])
+    self.assertEqual(self.index.next_time, self.time(2))
+    self.assertEqual(self.index.advance(self.time(1)), [])
+    self.assertEqual(self.index.advance(self.time(2)),
+                     [(1, AccessWindowIndex.STATE_STOPPED)])
+    self.assertEqual(self.index.next_time, float('inf'))
+    # time going backwards does not change anything
+    self.assertEqual(self.index.advance(self.time(1)), [])
+    self.assertEqual(self.index.check(1, self.time(1)),
+                     AccessWindowIndex.STATE_STOPPED)
+
+  def testSeveralBoundaries(self):
+    self.index.update([self.User(1, self.at(1), self.at(3)),
+                       self.User(2, self.at(2), None),
+                       self.User(3, self.at(5), None)], self.now)
+    # all reached boundaries are applied in time order
+    self.assertEqual(self.index.advance(self.time(4)),
+                     [(1, None), (2, None),
+                      (1, AccessWindowIndex.STATE_STOPPED)])
+    self.assertEqual(self.index.next_time, self.time(5))
+    self.assertEqual(self.index.check(3, self.time(4)),
+                     AccessWindowIndex.STATE_NOT_STARTED)
+    # a check past the next boundary advances the index
+    self.assertTrue(self.index.isAllowed(3, self.time(5)))
+    self.assertEqual(self.index.advance(self.time(6)), [])
+
+  def testEmptyWindow(self):
+    # the stop time is before the start time
+    self.index.update([self.User(1, self.at(2), self.at(1))], self.now)
+    self.assertEqual(self.index.check(1, self.now),
+                     AccessWindowIndex.STATE_NOT_STARTED)
+    self.assertEqual(self.index.advance(self.time(3)),
+                     [(1, AccessWindowIndex.STATE_STOPPED)])
+
+  def testUpdateReset(self):
+    self.index.update([self.User(1, self.at(1), None)], self.now)
+    self.index.advance(self.time(1))
+    # a new user list restarts from its own boundaries
+    self.index.update([self.User(1, self.at(4), None)], self.time(2))
+    self.assertEqual(self.index.check(1, self.time(2)),
+                     AccessWindowIndex.STATE_NOT_STARTED)
+    self.assertEqual(self.index.advance(self.time(4)), [(1, None)])
+
+
+class TestParseAccessTime(unittest.TestCase):
+  """Read the start and stop times given by the adapters"""
+
+  def testFormats(self):
+    expected = time.mktime(datetime.datetime(2030, 1, 15, 12, 30).timetuple())
+    self.assertEqual(parseAccessTime(datetime.datetime(2030, 1, 15, 12, 30)),
+                     expected)
+    self.assertEqual(parseAccessTime('2030-01-15 12:30:00'), expected)
+    self.assertEqual(parseAccessTime(' 2030-01-15 12:30 '), expected)
+    self.assertEqual(parseAccessTime(datetime.date(2030, 1, 15)),
+                     parseAccessTime('2030-01-15'))
+
+  def testNoTime(self):
+    self.assertIsNone(parseAccessTime(None))
+    self.assertIsNone(parseAccessTime(''))
+    self.assertIsNone(parseAccessTime('0000-00-00 00:00:00'))
+    with self.assertLogs('openvpn-uam.access', 'ERROR'):
+      self.assertIsNone(parseAccessTime('tomorrow'))
@@ -0,0 +1,212 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the authorization snapshot and of its hook"""
+
+# System imports
+import hashlib
+import importlib.machinery
+import importlib.util
+import io
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+# Project imports
+from OpenVPNUAM.authorization import (AuthorizationEntry,
+                                      AuthorizationServer,
+                                      AuthorizationSnapshot)
+from OpenVPNUAM.config import OVPNUAMConfigParser
+
+
+def loadHook():
+  """Import the authorization hook script as a module
+
+  @return [module] the hook module
+  """
+  path = os.path.join(os.path.dirname(os.path.dirname(
+      os.path.abspath(__file__))), 'openvpn-uam-auth')
+  loader = importlib.machinery.SourceFileLoader('openvpn_uam_auth', path)
+  spec = importlib.util.spec_from_loader(loader.name, loader)
+  module = importlib.util.module_from_spec(spec)
+  loader.exec_module(module)
+  return module
+
+
+class TestAuthorizationSnapshot(unittest.TestCase):
+  """Write the binary snapshot and search it from the hook"""
+
+  @classmethod
+  def setUpClass(cls):
+    cls.hook = loadHook()
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'acl')
+    now = time.time()
+    # the (common name, entry) pairs of an index
+    self.l_entry = [
+        ('jdoe_laptop', AuthorizationEntry(1, True, True, None, None,
+                                           frozenset([7, 3]))),
+        ('jdoe_phone', AuthorizationEntry(1, True, False, None, None,
+                                          frozenset([5]))),
+        ('asmith_laptop', AuthorizationEntry(2, False, True, None, None,
+                                             frozenset([4]))),
+        ('bob_laptop', AuthorizationEntry(3, True, True, now + 3600, None,
+                                          frozenset([9]))),
+        ('eve_laptop', AuthorizationEntry(4, True, True, None, now - 3600,
+                                          frozenset([12])))]
+    self.assertTrue(AuthorizationSnapshot(self.path).write(self.l_entry))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def getGenerationTime(self):
+    """Return the build time stored into the snapshot header
+
+    @return [int] the UNIX time of the snapshot
+    """
+    with open(self.path, 'rb') as f:
+      return AuthorizationSnapshot.HEADER.unpack(
+          f.read(AuthorizationSnapshot.HEADER.size))[3]
+
+  def setGenerationTime(self, generated):
+    """Change the build time stored into the snapshot header
+
+    @param generated [int] the new UNIX time of the snapshot
+    """
+    with open(self.path, 'r+b') as f:
+      header = list(AuthorizationSnapshot.HEADER.unpack(
+          f.read(AuthorizationSnapshot.HEADER.size)))
+      header[3] = generated
+      f.seek(0)
+      f.write(AuthorizationSnapshot.HEADER.pack(*header))
+
+  def runHook(self, argv, common_name, serial):
+    """Run the hook as OpenVPN client-connect script
+
+    @param argv [list<str>] the options of the hook
+    @param common_name [str] the common name of the client
+    @param serial [str] the serial of the client certificate
+    @return [tuple] the (exit code, error output) of the hook
+    """
+    env = {'script_type': 'client-connect', 'common_name': common_name,
+           'tls_serial_0': serial}
+    stderr = io.StringIO()
+    with mock.patch.dict(os.environ, env), mock.patch('sys.stderr', stderr):
+      code = self.hook.main(['openvpn-uam-auth'] + argv)
+    return (code, stderr.getvalue())
+
+  def testFormat(self):
+    with open(self.path, 'rb') as f:
+      content = f.read()
+    (magic, count, record_size, generated) = (
+        AuthorizationSnapshot.HEADER.unpack_from(content, 0))
+    self.assertEqual(magic, b'UAMACL1\0')
+    self.assertEqual(count, 6)
+    self.assertEqual(record_size, 40)
+    self.assertLessEqual(abs(time.time() - generated), 5)
+    self.assertEqual(len(content), 24 + count * record_size)
+    l_record = [AuthorizationSnapshot.RECORD.unpack_from(content,
+                                                         24 + i * record_size)
+                for i in range(count)]
+    # records are sorted by serial
+    self.assertEqual([r[0] for r in l_record], [3, 4, 5, 7, 9, 12])
+    cn_hash = struct.unpack(
+        '<Q', hashlib.sha1(b'jdoe_laptop').digest()[:8])[0]
+    self.assertEqual(l_record[0], (3, cn_hash, AuthorizationSnapshot.TIME_MIN,
+                                   AuthorizationSnapshot.TIME_MAX, 0x03))
+    self.assertEqual(l_record[1][4],
+                     AuthorizationSnapshot.FLAG_HOSTNAME_ENABLED)
+    self.assertEqual(l_record[2][4],
+                     AuthorizationSnapshot.FLAG_USER_ENABLED)
+    # the hook reads the same format
+    self.assertEqual(self.hook.SNAPSHOT_MAGIC, AuthorizationSnapshot.MAGIC)
+    self.assertEqual(self.hook.SNAPSHOT_HEADER.format,
+                     AuthorizationSnapshot.HEADER.format)
+    self.assertEqual(self.hook.SNAPSHOT_RECORD.format,
+                     AuthorizationSnapshot.RECORD.format)
+
+  def testSearch(self):
+    for (common_name, serial, response) in [
+        ('jdoe_laptop', '3', 'ALLOW'),
+        ('jdoe_laptop', '7', 'ALLOW'),
+        ('jdoe_laptop', '5', 'DENY invalid-serial'),
+        ('jdoe_laptop', '8', 'DENY invalid-serial'),
+        ('jdoe_laptop', None, 'DENY invalid-serial'),
+        ('jdoe_phone', '5', 'DENY hostname-disabled'),
+        ('asmith_laptop', '4', 'DENY user-disabled'),
+        ('bob_laptop', '9', 'DENY access-not-started'),
+        ('eve_laptop', '12', 'DENY access-stopped')]:
+      self.assertEqual(
+          self.hook.authorizeSnapshot(self.path, common_name, serial),
+          response)
+
+  def testMaxAge(self):
+    self.setGenerationTime(int(time.time()) - 120)
+    self.assertEqual(self.hook.authorizeSnapshot(self.path, 'jdoe_laptop',
+                                                 '3', 300), 'ALLOW')
+    with self.assertRaises(OSError):
+      self.hook.authorizeSnapshot(self.path, 'jdoe_laptop', '3', 60)
+
+    self.assertEqual(self.runHook(['-a', self.path], 'jdoe_laptop', '3'),
+                     (0, ''))
+    self.assertEqual(
+        self.runHook(['-a', self.path, '-m', '300'], 'jdoe_laptop', '3'),
+        (0, ''))
+    # a stale snapshot is an unavailable authorization
+    (code, error) = self.runHook(['-a', self.path, '-m', '60'],
+                                 'jdoe_laptop', '3')
+    self.assertEqual(code, 1)
+    self.assertIn('stale snapshot', error)
+    (code, error) = self.runHook(['-a', self.path, '-m', '60', '--fail-open'],
+                                 'jdoe_laptop', '3')
+    self.assertEqual(code, 0)
+    self.assertIn('stale snapshot', error)
+    (code, error) = self.runHook(['-a', self.path, '-m', 'soon'],
+                                 'jdoe_laptop', '3')
+    self.assertEqual(code, 1)
+
+  def testRefresh(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.AUTHORIZATION_SECTION: {'acl_file': self.path,
+                                             'acl_refresh_time': '60'}})
+    server = AuthorizationServer(cp)
+    self.assertTrue(server.load())
+    now = time.time()
+    with mock.patch('time.time', return_value=now):
+      server.update([])
+    self.setGenerationTime(0)
+    # the snapshot is written again only after the refresh time
+    with mock.patch('time.time', return_value=now + 30):
+      server.refresh()
+    self.assertEqual(self.getGenerationTime(), 0)
+    with mock.patch('time.time', return_value=now + 61):
+      server.refresh()
+    self.assertEqual(self.getGenerationTime(), int(now + 61))
@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests of the bandwidth accounting"""
+
+# System imports
+import unittest
+
+# Project imports
+from OpenVPNUAM import models as Model
+from OpenVPNUAM.bandwidth import BandwidthAccounting, RingSeries
+from OpenVPNUAM.config import OVPNUAMConfigParser
+
+
+class TestRingSeries(unittest.TestCase):
+  """Sum traffic amounts by period"""
+
+  def testSum(self):
+    series = RingSeries(10, 6)
+    series.add(100, 1, 2)
+    series.add(105, 10, 20)
+    series.add(110, 100, 200)
+    self.assertEqual(list(series.iterate(10, 12)),
+                     [(10, 11, 22), (11, 100, 200)])
+    self.assertEqual(series.sum(10, 11), (11, 22))
+    self.assertEqual(series.sum(8, 14), (111, 222))
+    # only the last size periods of a range are kept
+    self.assertEqual(series.sum(0, 100), (0, 0))
+
+  def testWrap(self):
+    series = RingSeries(10, 3)
+    series.add(0, 1, 1)
+    series.add(30, 5, 5)
+    # the period 3 replaced the period 0 in the same slot
+    self.assertEqual(list(series.iterate(0, 4)), [(3, 5, 5)])
+    self.assertEqual(series.sum(0, 3), (0, 0))
+
+
+class FakeDatabase(object):
+  """A database which records the inserted rows
+  """
+
+  def __init__(self, l_user):
+    self.l_user = l_user
+    self.fail = False
+    self.l_call = []
+
+  def getUserList(self):
+    return self.l_user
+
+  def insertList(self, l_obj, realtime=False):
+    if self.fail:
+      return False
+    self.l_call.append(l_obj)
+    return True
+
+
+class TestBandwidthAccounting(unittest.TestCase):
+  """Account the byte counters of sessions"""
+
+  def setUp(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.DATABASE_SECTION: {'bandwidth_accounting': 'true',
+                                        'bandwidth_store_resolution': '60'}})
+    self.bandwidth = BandwidthAccounting(cp)
+    self.assertTrue(self.bandwidth.load())
+    self.now = 36000.0
+
+  def testFirstSampleReference(self):
+    self.bandwidth.addSample('a', 1, 1000, 1000, timestamp=self.now)
+    self.bandwidth.addSample('a', 1, 1600, 1000, timestamp=self.now + 10)
+    self.bandwidth.addSample('a', 2, 600, 60, True, timestamp=self.now + 10)
+    self.assertEqual(self.bandwidth.getRate('a', 60, self.now + 60),
+                     (1200 / 60.0, 60 / 60.0))
+
+  def testCounterReset(self):
+    self.bandwidth.addSample('a', 1, 1000, 1000, timestamp=self.now)
+    self.bandwidth.addSample('a', 1, 300, 1000, timestamp=self.now + 10)
+    self.assertEqual(self.bandwidth.getRate('a', 60, self.now + 60),
+                     (300 / 60.0, 0.0))
+
+  def testTopTalkers(self):
+    for (cn, amount) in [('a', 100), ('b', 300), ('c', 200), ('d', 0)]:
+      self.bandwidth.addSample(cn, cn, amount, amount, True,
+                               timestamp=self.now)
+    self.assertEqual(self.bandwidth.getTopTalkers(3600, 2, self.now + 10),
+                     [('b', 300, 300), ('c', 200, 200)])
+    # the traffic is out of a short window
+    self.assertEqual(self.bandwidth.getTopTalkers(60, 2, self.now + 600), [])
+
+  def testFlushSingleWrite(self):
+    hostname = Model.Hostname('laptop')
+    user = Model.User('jdoe', 'jdoe@example.org')
+    user.load({'id': 1}, [hostname])
+    db = FakeDatabase([user])
+    self.bandwidth.addSample('jdoe_laptop', 1, 10, 20, True,
+                             timestamp=self.now)
+    self.bandwidth.addSample('unknown', 2, 30, 40, True, timestamp=self.now)
+    db.fail = True
+    self.assertEqual(self.bandwidth.flush(db, True, self.now + 120), 0)
+    db.fail = False
+    self.assertEqual(self.bandwidth.flush(db, True, self.now + 180), 2)
+    # linked and unlinked samples are written by the same call
+    self.assertEqual(len(db.l_call), 1)
+    self.assertEqual(sorted([(s.common_name, p is hostname)
+                             for (s, p) in db.l_call[0]]),
+                     [('jdoe_laptop', True), ('unknown', False)])
+    self.assertEqual(self.bandwidth.flush(db, True, self.now + 240), 0)
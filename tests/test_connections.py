@@ -0,0 +1,285 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the connection log buffer and maintenance"""
+
+# System imports
+import datetime
+import time
+import unittest
+from unittest import mock
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.connections import (ConnectionLogBuffer,
+                                    ConnectionLogMaintenance)
+from OpenVPNUAM import models as Model
+
+
+class FakeDatabase(object):
+  """Record the inserted connection events"""
+
+  def __init__(self, l_user):
+    self.l_user = l_user
+    self.l_insert = []
+    # the result of the next inserts, True by default
+    self.l_result = []
+    # a function called during the next insert
+    self.during_insert = None
+
+  def getUserList(self):
+    return self.l_user
+
+  def insertList(self, l_obj, realtime=False):
+    if self.during_insert is not None:
+      self.during_insert()
+      self.during_insert = None
+    result = self.l_result.pop(0) if len(self.l_result) > 0 else True
+    if result:
+      self.l_insert.append([(entry.common_name, parent)
+                            for (entry, parent) in l_obj])
+    return result
+
+
+class TestConnectionLogBuffer(unittest.TestCase):
+  """Write the connection events by batches"""
+
+  def setUp(self):
+    self.hostname = Model.Hostname('laptop')
+    self.hostname.load({'id': 2})
+    user = Model.User('jdoe', 'jdoe@example.org')
+    user.load({'id': 1}, [self.hostname])
+    self.db = FakeDatabase([user])
+
+  def newBuffer(self, **options):
+    """Build a loaded buffer
+
+    @param options [dict] the options of the database section
+    @return [ConnectionLogBuffer] the buffer
+    """
+    cp = OVPNUAMConfigParser()
+    d_option = {'connection_log': 'True',
+                'connection_log_batch_size': '3',
+                'connection_log_flush_interval': '5'}
+    d_option.update(options)
+    cp.read_dict({cp.DATABASE_SECTION: d_option})
+    buf = ConnectionLogBuffer(cp)
+    self.assertTrue(buf.load())
+    return buf
+
+  def add(self, buf, *l_common_name):
+    for common_name in l_common_name:
+      buf.add(Model.ConnectionLog.EVENT_CONNECT, common_name)
+
+  def testBatch(self):
+    buf = self.newBuffer()
+    self.add(buf, 'jdoe_laptop', 'unknown')
+    self.assertEqual(buf.flush(self.db), 0)
+    self.add(buf, 'jdoe_laptop')
+    self.assertEqual(buf.flush(self.db), 3)
+    self.assertEqual(len(buf), 0)
+    # a multiple rows insert is done by kind of parent
+    self.assertEqual(self.db.l_insert, [
+        [('jdoe_laptop', self.hostname), ('jdoe_laptop', self.hostname)],
+        [('unknown', None)]])
+
+  def testInterval(self):
+    buf = self.newBuffer()
+    now = time.time()
+    with mock.patch('time.time', return_value=now):
+      self.add(buf, 'jdoe_laptop')
+    with mock.patch('time.time', return_value=now + 4):
+      self.assertEqual(buf.flush(self.db), 0)
+    with mock.patch('time.time', return_value=now + 5):
+      self.assertEqual(buf.flush(self.db), 1)
+
+  def testRequeue(self):
+    buf = self.newBuffer()
+    self.add(buf, 'jdoe_laptop', 'alice', 'bob')
+    # the events without hostname cannot be written
+    self.db.l_result = [True, False]
+    self.db.during_insert = lambda: self.add(buf, 'carol')
+    with self.assertLogs('openvpn-uam.connections', 'ERROR'):
+      self.assertEqual(buf.flush(self.db), 1)
+    # they are kept before the events added meanwhile
+    self.assertEqual(len(buf), 3)
+    self.assertEqual(buf.flush(self.db, force=True), 3)
+    self.assertEqual(self.db.l_insert, [
+        [('jdoe_laptop', self.hostname)],
+        [('alice', None), ('bob', None), ('carol', None)]])
+
+  def testRequeueOverflow(self):
+    buf = self.newBuffer(connection_log_batch_size='2',
+                         connection_log_max_pending='4')
+    self.add(buf, 'a', 'b', 'c')
+    self.db.l_result = [False]
+    self.db.during_insert = lambda: self.add(buf, 'x', 'y', 'z')
+    with self.assertLogs('openvpn-uam.connections', 'ERROR'):
+      self.assertEqual(buf.flush(self.db), 0)
+    # the oldest events are dropped beyond the maximum
+    self.assertEqual(len(buf), 4)
+    with self.assertLogs('openvpn-uam.connections', 'WARNING') as logs:
+      self.assertEqual(buf.flush(self.db), 4)
+    self.assertIn('2 connection events dropped', logs.output[0])
+    self.assertEqual(self.db.l_insert, [
+        [('c', None), ('x', None), ('y', None), ('z', None)]])
+
+  def testDisabled(self):
+    buf = self.newBuffer(connection_log='False')
+    self.add(buf, 'jdoe_laptop')
+    self.assertEqual(len(buf), 0)
+    self.assertEqual(buf.flush(self.db, force=True), 0)
+
+  def testInvalidOptions(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.DATABASE_SECTION: {
+        'connection_log_batch_size': '10',
+        'connection_log_max_pending': '5'}})
+    self.assertFalse(ConnectionLogBuffer(cp).load())
+
+
+class FakeMaintenanceDatabase(object):
+  """Record the maintenance operations of the connection history"""
+
+  def __init__(self):
+    self.l_call = []
+    # the operations which fail
+    self.s_failure = set()
+    # if True the operations are not supported
+    self.unsupported = False
+
+  def call(self, name, *args):
+    if self.unsupported:
+      raise NotImplementedError(name)
+    self.l_call.append((name,) + args)
+    return name not in self.s_failure
+
+  def rollupConnectionLog(self, start, end):
+    return self.call('rollup', start, end)
+
+  def maintainConnectionLogPartitions(self, oldest_month, newest_month):
+    return self.call('partitions', oldest_month, newest_month)
+
+  def purgeConnectionSummary(self, resolution, before):
+    return self.call('purge', resolution, before)
+
+
+class TestConnectionLogMaintenance(unittest.TestCase):
+  """Aggregate the connection log and expire its history"""
+
+  def setUp(self):
+    self.db = FakeMaintenanceDatabase()
+    self.now = datetime.datetime(2030, 1, 15, 10, 20, 0)
+
+  def newMaintenance(self, **options):
+    """Build a loaded maintenance job
+
+    @param options [dict] the options of the database section
+    @return [ConnectionLogMaintenance] the job
+    """
+    cp = OVPNUAMConfigParser()
+    d_option = {'connection_log': 'True'}
+    d_option.update(options)
+    cp.read_dict({cp.DATABASE_SECTION: d_option})
+    maintenance = ConnectionLogMaintenance(cp)
+    self.assertTrue(maintenance.load())
+    return maintenance
+
+  def hour(self, day, hour):
+    return datetime.datetime(2030, 1, day, hour)
+
+  def testRollup(self):
+    maintenance = self.newMaintenance()
+    self.assertTrue(maintenance.run(self.db, self.now))
+    # the previous hour is aggregated again at the first run
+    self.assertEqual(self.db.l_call[0],
+                     ('rollup', self.hour(15, 9), self.hour(15, 11)))
+    self.db.l_call = []
+    self.assertTrue(maintenance.run(self.db, self.now.replace(hour=12)))
+    self.assertEqual(self.db.l_call,
+                     [('rollup', self.hour(15, 10), self.hour(15, 13))])
+
+    # a failed rollup is started again from the same hour
+    self.db.l_call = []
+    self.db.s_failure.add('rollup')
+    self.assertFalse(maintenance.run(self.db, self.now.replace(hour=13)))
+    self.db.s_failure.clear()
+    self.assertTrue(maintenance.run(self.db, self.now.replace(hour=14)))
+    self.assertEqual(self.db.l_call,
+                     [('rollup', self.hour(15, 12), self.hour(15, 14)),
+                      ('rollup', self.hour(15, 12), self.hour(15, 15))])
+
+  def testPartitions(self):
+    maintenance = self.newMaintenance(
+        connection_log_retention_months='3',
+        connection_summary_hourly_retention_days='10')
+    self.assertTrue(maintenance.run(self.db, self.now))
+    self.assertEqual(self.db.l_call[1:], [
+        ('partitions', datetime.date(2029, 10, 1), datetime.date(2030, 3, 1)),
+        ('purge', 'hour', self.hour(5, 10))])
+    # the partitions are maintained once a day
+    self.db.l_call = []
+    maintenance.run(self.db, self.now.replace(hour=23))
+    self.assertEqual([c[0] for c in self.db.l_call], ['rollup'])
+    self.db.l_call = []
+    maintenance.run(self.db, self.now.replace(day=16, hour=0))
+    self.assertEqual([c[0] for c in self.db.l_call],
+                     ['rollup', 'partitions', 'purge'])
+
+  def testMaintenanceFailure(self):
+    maintenance = self.newMaintenance()
+    self.db.s_failure.add('partitions')
+    self.assertFalse(maintenance.run(self.db, self.now))
+    # the summaries are kept while the partitions are not up to date
+    self.assertEqual([c[0] for c in self.db.l_call],
+                     ['rollup', 'partitions'])
+    # and the maintenance is tried again the same day
+    self.db.s_failure.clear()
+    self.db.l_call = []
+    self.assertTrue(maintenance.run(self.db, self.now.replace(hour=11)))
+    self.assertEqual([c[0] for c in self.db.l_call],
+                     ['rollup', 'partitions', 'purge'])
+
+  def testUnlimitedRetention(self):
+    maintenance = self.newMaintenance(
+        connection_log_retention_months='0',
+        connection_summary_hourly_retention_days='0')
+    self.assertTrue(maintenance.run(self.db, self.now))
+    self.assertEqual(self.db.l_call[1:], [
+        ('partitions', datetime.date.min, datetime.date(2030, 3, 1))])
+
+  def testUnsupported(self):
+    maintenance = self.newMaintenance()
+    self.db.unsupported = True
+    with self.assertLogs('openvpn-uam.connections', 'WARNING'):
+      maintenance.run(self.db, self.now)
+    self.assertFalse(maintenance.enabled)
+    self.assertTrue(maintenance.run(self.db, self.now))
+
+  def testInvalidRetention(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.DATABASE_SECTION: {
+        'connection_log_retention_months': '-1'}})
+    self.assertFalse(ConnectionLogMaintenance(cp).load())
@@ -0,0 +1,303 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests of the management interface client"""
+
+# System imports
+import asyncio
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+# Project imports
+from OpenVPNUAM import models as Model
+from OpenVPNUAM.adapters import Adapter
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.database import Database
+from OpenVPNUAM.management import ManagementClient
+
+# The response of the server to the 'status 3' command
+STATUS = ('TITLE\tOpenVPN 2.6.0\r\n' +
+          'HEADER\tCLIENT_LIST\tCommon Name\tReal Address\t' +
+          'Virtual Address\tBytes Received\tBytes Sent\tClient ID\r\n' +
+          'CLIENT_LIST\tjdoe_laptop\t192.0.2.1:1194\t10.8.0.2\t100\t200\t' +
+          '7\r\n' +
+          'END\r\n')
+
+
+class FakeServer(object):
+  """A management interface which runs in its own event loop thread
+  """
+
+  def __init__(self, path):
+    """Constructor : Listen on a UNIX socket
+
+    @param path [str] the path of the socket
+    """
+    self.path = path
+    # the lines received from the client
+    self.received = queue.Queue()
+    self.writer = None
+    self.loop = asyncio.new_event_loop()
+    self.__ready = threading.Event()
+    self.thread = threading.Thread(target=self.__run, daemon=True)
+    self.thread.start()
+    self.__ready.wait()
+
+  def __run(self):
+    """Entry point of the server thread
+    """
+    asyncio.set_event_loop(self.loop)
+    self.server = self.loop.run_until_complete(
+        asyncio.start_unix_server(self.__handle, self.path))
+    self.__ready.set()
+    self.loop.run_forever()
+
+  async def __handle(self, reader, writer):
+    """Answer the commands of a client like the OpenVPN server
+
+    @param reader [asyncio.StreamReader] the reading side of the connection
+    @param writer [asyncio.StreamWriter] the writing side of the connection
+    """
+    self.writer = writer
+    # the prompt is not terminated by a newline
+    writer.write(b'ENTER PASSWORD:')
+    while True:
+      line = await reader.readline()
+      if not line:
+        break
+      line = line.decode().rstrip('\r\n')
+      self.received.put(line)
+      if line == 'secret':
+        writer.write(b'SUCCESS: password is correct\r\n' +
+                     b'>INFO:OpenVPN Management Interface Version 3\r\n')
+      elif line == 'status 3':
+        writer.write(STATUS.encode())
+      else:
+        writer.write(b'SUCCESS: ' + line.split()[0].encode() + b'\r\n')
+
+  def send(self, *l_line):
+    """Send lines to the client
+
+    @param l_line [list<str>] the lines without their terminator
+    """
+    data = ''.join([line + '\r\n' for line in l_line]).encode()
+    self.loop.call_soon_threadsafe(self.writer.write, data)
+
+  def disconnect(self):
+    """Close the connection of the client
+    """
+    self.loop.call_soon_threadsafe(self.writer.close)
+
+  def close(self):
+    """Stop the server and its thread
+    """
+    def stop():
+      self.server.close()
+      self.loop.stop()
+    self.loop.call_soon_threadsafe(stop)
+    self.thread.join()
+    self.loop.close()
+
+  def expect(self, command):
+    """Wait for a command of the client, skipping the others
+
+    @param command [str] the expected command line
+    """
+    while True:
+      line = self.received.get(timeout=5)
+      if line == command:
+        return
+
+
+class FakeIndex(object):
+  """An authorization index which only denies one common name
+  """
+
+  def authorize(self, common_name, serial):
+    if common_name == 'jdoe_phone':
+      return (False, 'hostname disabled')
+    return (True, '')
+
+
+class FakeBandwidth(object):
+  """A bandwidth accounting which records the sessions it forgets
+  """
+
+  def __init__(self):
+    self.removed = queue.Queue()
+
+  def addSample(self, common_name, session, received, sent, new):
+    pass
+
+  def removeSession(self, session):
+    self.removed.put(session)
+
+
+class FakeAdapter(Adapter):
+  """A database adapter which serves a fixed list of users
+  """
+
+  # the users returned by the adapter
+  l_user = []
+
+  def __init__(self):
+    Adapter.__init__(self, 'fake', Adapter.TYPE_LOCAL)
+
+  def load(self, config):
+    return True
+
+  def open(self):
+    return True
+
+  def close(self):
+    return True
+
+  def getUserList(self):
+    return self.l_user
+
+  def getRevokedCertificateList(self, since=None):
+    return []
+
+  def processUpdate(self, update):
+    return True
+
+
+class TestManagementClient(unittest.TestCase):
+  """Follow the sessions of a fake OpenVPN server"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    path = os.path.join(self.directory, 'management.sock')
+    self.server = FakeServer(path)
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.MANAGEMENT_SECTION: {'address': path,
+                                          'password': 'secret',
+                                          'reconnect_time': '60',
+                                          'bytecount_interval': '5'}})
+    self.bandwidth = FakeBandwidth()
+    self.client = ManagementClient(cp)
+    self.assertTrue(self.client.load())
+    self.client.start(FakeIndex(), self.bandwidth)
+    # the password is sent after the prompt, then the sessions are seeded
+    self.server.expect('secret')
+    self.server.expect('status 3')
+    self.server.expect('bytecount 5')
+
+  def tearDown(self):
+    self.client.stop()
+    self.server.close()
+    shutil.rmtree(self.directory)
+
+  def connect(self, cid, common_name, serial):
+    """Send the notifications of a new session
+
+    @param cid [int] the client id
+    @param common_name [str] the common name of the client
+    @param serial [int] the serial of the client certificate
+    """
+    for event in ['CONNECT,%d,1' % cid, 'ESTABLISHED,%d' % cid]:
+      self.server.send('>CLIENT:' + event,
+                       '>CLIENT:ENV,common_name=' + common_name,
+                       '>CLIENT:ENV,tls_serial_0=%d' % serial,
+                       '>CLIENT:ENV,END')
+
+  def waitOnline(self, l_cn):
+    """Wait until the client knows exactly the given sessions
+
+    @param l_cn [list<str>] the sorted common names of the sessions
+    """
+    deadline = time.monotonic() + 5
+    while (self.client.getOnlineList() != l_cn and
+           time.monotonic() < deadline):
+      time.sleep(0.01)
+    self.assertEqual(self.client.getOnlineList(), l_cn)
+
+  def testSeed(self):
+    self.assertTrue(self.client.connected)
+    self.waitOnline(['jdoe_laptop'])
+
+  def testAuthorize(self):
+    self.server.send('>CLIENT:CONNECT,8,1',
+                     '>CLIENT:ENV,common_name=jdoe_tablet',
+                     '>CLIENT:ENV,END')
+    self.server.expect('client-auth-nt 8 1')
+    self.server.send('>CLIENT:CONNECT,9,2',
+                     '>CLIENT:ENV,common_name=jdoe_phone',
+                     '>CLIENT:ENV,END')
+    self.server.expect('client-deny 9 2 "hostname disabled"')
+
+  def testKillRevoked(self):
+    self.connect(8, 'jdoe_tablet', 42)
+    self.connect(9, 'jdoe_desktop', 43)
+    self.waitOnline(['jdoe_desktop', 'jdoe_laptop', 'jdoe_tablet'])
+    self.client.update([], revoked=frozenset([42]))
+    self.server.expect('client-kill 8')
+    # only the session of the revoked certificate is killed
+    self.client.update([], revoked=frozenset([42]))
+    self.server.send('>CLIENT:DISCONNECT,8', '>CLIENT:ENV,END')
+    self.waitOnline(['jdoe_desktop', 'jdoe_laptop'])
+    self.assertEqual(self.bandwidth.removed.get(timeout=5), ('management', 8))
+    self.assertRaises(queue.Empty, self.server.received.get_nowait)
+
+  def testDisableUser(self):
+    hostname = Model.Hostname('tablet')
+    hostname.load({'id': 2, 'is_enabled': True})
+    user = Model.User('jdoe', 'jdoe@example.org')
+    user.load({'id': 1, 'is_enabled': True}, [hostname])
+    FakeAdapter.l_user = [user]
+    sys.modules['OpenVPNUAM.adapters.fake'] = types.ModuleType('fake')
+    sys.modules['OpenVPNUAM.adapters.fake'].Connector = FakeAdapter
+    self.addCleanup(sys.modules.pop, 'OpenVPNUAM.adapters.fake')
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.DATABASE_SECTION: {'adapter': 'fake'}, 'fake': {}})
+    db = Database(cp)
+    self.assertTrue(db.load())
+    self.assertTrue(db.open())
+    db.addUpdateListener(self.client.onUpdate)
+
+    self.connect(8, 'jdoe_tablet', 42)
+    self.waitOnline(['jdoe_laptop', 'jdoe_tablet'])
+    self.client.update(db.getUserList())
+    deadline = time.monotonic() + 5
+    while not hostname.is_online and time.monotonic() < deadline:
+      time.sleep(0.01)
+    # the session is killed by the update, without any new poll
+    user.disable()
+    self.server.expect('client-kill 8')
+
+  def testDisconnect(self):
+    self.connect(8, 'jdoe_tablet', 42)
+    self.waitOnline(['jdoe_laptop', 'jdoe_tablet'])
+    self.server.disconnect()
+    s_removed = set([self.bandwidth.removed.get(timeout=5)
+                     for i in range(2)])
+    self.assertEqual(s_removed, set([('management', 7), ('management', 8)]))
+    self.assertEqual(self.client.getOnlineList(), [])
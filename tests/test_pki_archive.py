@@ -0,0 +1,174 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the expired certificate archival"""
+
+# System imports
+import collections
+import datetime
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_archive import PKIArchiver
+from OpenVPNUAM.pki.pki_filetree import PKIFileTree
+
+
+class TestPKIArchiver(unittest.TestCase):
+  """Pack the files of expired certificates into monthly archives"""
+
+  Model = collections.namedtuple('Model', ['id'])
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.archiver = None
+    self.ft = None
+
+  def tearDown(self):
+    if self.archiver is not None:
+      self.archiver.close()
+    if self.ft is not None:
+      self.ft.stop()
+    shutil.rmtree(self.directory)
+
+  def load(self, batch_size=200, manifest=True):
+    """Load a file tree and its archiver
+
+    @param batch_size [int] OPTIONNAL : the number of certificates by archive
+    @param manifest [bool] OPTIONNAL : if False the manifest is disabled
+    """
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {
+        'cert_directory': self.directory,
+        'file_writer_thread': 'False',
+        'archive_retention_days': '30',
+        'archive_compression': 'gz',
+        'archive_batch_size': str(batch_size),
+        'archive_batch_pause': '0'}})
+    if not manifest:
+      cp.set(cp.PKI_SECTION, 'manifest_file', '')
+    self.ft = PKIFileTree(cp)
+    self.assertTrue(self.ft.load())
+    self.archiver = PKIArchiver(cp, self.ft)
+    self.assertTrue(self.archiver.load())
+
+  def certificate(self, serial, end, user_id=3, hostname_id=10):
+    """Store the files of a certificate
+
+    @param serial [int] the certificate serial
+    @param end [datetime] the end of validity of the certificate
+    @return [dict] the certificate row
+    """
+    (user, hostname, m_cert) = (self.Model(user_id), self.Model(hostname_id),
+                                self.Model(serial))
+    for ext in ['key', 'crt']:
+      self.ft.storePKIUserFile(user, hostname, m_cert, ext,
+                               '{}.{}'.format(serial, ext).encode())
+    return {'id': serial, 'user_id': user_id, 'hostname_id': hostname_id,
+            'certificate_end_time': end}
+
+  def path(self, serial, ext):
+    return self.ft.getPKIUserFilePath(self.Model(3), self.Model(10),
+                                      self.Model(serial), ext)
+
+  def check(self, l_row):
+    """Archive the given certificates and check the result
+
+    @param l_row [list<dict>] the certificates rows, the two first ones are
+                              expired in january and february 2020 and the
+                              last one is still valid
+    """
+    self.assertEqual(self.archiver.run(l_row), 4)
+    # the valid certificate is kept
+    self.assertTrue(os.path.exists(self.path(3, 'crt')))
+    self.assertIsNone(self.archiver.getArchiveEntry(3, 'crt'))
+    d_month = dict()
+    for (serial, month) in [(1, '2020-01'), (2, '2020-02')]:
+      for ext in ['key', 'crt']:
+        self.assertFalse(os.path.exists(self.path(serial, ext)))
+        entry = self.archiver.getArchiveEntry(serial, ext)
+        self.assertIsNotNone(entry)
+        self.assertEqual(os.path.basename(entry.archive),
+                         'certificates-' + month + '-0000.tar.gz')
+        with tarfile.open(entry.archive) as tar:
+          self.assertEqual(tar.extractfile(entry.member).read(),
+                           '{}.{}'.format(serial, ext).encode())
+        d_month[month] = entry.archive
+    # the archives are recorded by the index
+    self.archiver.close()
+    self.archiver.load()
+    self.assertEqual(
+        self.archiver.getArchiveEntry(2, 'key').archive, d_month['2020-02'])
+    self.assertEqual(self.archiver.run(l_row), 0)
+
+  def testRun(self):
+    self.load()
+    today = datetime.datetime.today()
+    l_row = [self.certificate(1, datetime.datetime(2020, 1, 15)),
+             self.certificate(2, datetime.datetime(2020, 2, 15)),
+             self.certificate(3, today - datetime.timedelta(days=1))]
+    self.check(l_row)
+    # archived files are removed from the manifest
+    self.assertIsNone(self.ft.manifest.getEntry(1, 'crt'))
+    self.assertIsNotNone(self.ft.manifest.getEntry(3, 'crt'))
+
+  def testWithoutManifest(self):
+    self.load(manifest=False)
+    today = datetime.datetime.today()
+    self.check([self.certificate(1, datetime.datetime(2020, 1, 15)),
+                self.certificate(2, datetime.datetime(2020, 2, 15)),
+                self.certificate(3, today - datetime.timedelta(days=1))])
+
+  def testBatches(self):
+    self.load(batch_size=2)
+    l_row = [self.certificate(serial, datetime.datetime(2020, 1, serial))
+             for serial in range(1, 6)]
+    self.assertEqual(self.archiver.run(l_row), 10)
+    l_name = sorted(os.listdir(os.path.join(self.directory, 'archives')))
+    self.assertEqual(l_name, ['certificates-2020-01-0000.tar.gz',
+                              'certificates-2020-01-0001.tar.gz',
+                              'certificates-2020-01-0002.tar.gz',
+                              'index'])
+    path = os.path.join(self.directory, 'archives', l_name[2])
+    with tarfile.open(path) as tar:
+      self.assertEqual(sorted(tar.getnames()), ['3/10/5.crt', '3/10/5.key'])
+
+  def testDisabled(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'cert_directory': self.directory,
+                                   'file_writer_thread': 'False'}})
+    self.ft = PKIFileTree(cp)
+    self.assertTrue(self.ft.load())
+    self.archiver = PKIArchiver(cp, self.ft)
+    self.assertTrue(self.archiver.load())
+    self.assertFalse(self.archiver.enabled)
+    row = self.certificate(1, datetime.datetime(2020, 1, 15))
+    self.assertEqual(self.archiver.run([row]), 0)
+    self.assertTrue(os.path.exists(self.path(1, 'crt')))
+    self.assertFalse(os.path.exists(os.path.join(self.directory, 'archives')))
@@ -0,0 +1,222 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the CRL publication"""
+
+# System imports
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_crl import PKICRLBuilder, PKICRLDirectory
+from OpenVPNUAM.revocation import RevokedSerialSet
+
+
+def buildCA():
+  """Build a self signed certificate authority
+
+  @return [tuple] the (X509, PKey) of the authority
+  """
+  key = ec.generate_private_key(ec.SECP256R1())
+  name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test-ca')])
+  now = datetime.datetime.utcnow()
+  cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+          .public_key(key.public_key()).serial_number(1)
+          .not_valid_before(now).not_valid_after(now +
+                                                 datetime.timedelta(days=1))
+          .sign(key, hashes.SHA256()))
+  return (crypto.X509.from_cryptography(cert),
+          crypto.PKey.from_cryptography_key(key))
+
+
+class TestPKICRLBuilder(unittest.TestCase):
+  """Publish base and delta CRLs"""
+
+  @classmethod
+  def setUpClass(cls):
+    (cls.ca, cls.ca_key) = buildCA()
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'crl.pem')
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'crl_file': self.path,
+                                   'crl_base_interval': '24',
+                                   'crl_validity': '48'}})
+    self.crl = PKICRLBuilder(cp)
+    self.assertTrue(self.crl.load(self.ca, self.ca_key, 'sha256'))
+    self.now = datetime.datetime(2030, 1, 1, 12, 0, 0)
+    self.revoked = RevokedSerialSet()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def row(self, serial, reason=None, end_days=365):
+    return {'id': serial,
+            'revoked_time': self.now - datetime.timedelta(hours=1),
+            'revoked_reason': reason,
+            'certificate_end_time': self.now +
+            datetime.timedelta(days=end_days)}
+
+  def readCRL(self, path):
+    with open(path, 'rb') as f:
+      return x509.load_pem_x509_crl(f.read())
+
+  def getNumber(self, crl):
+    extension = crl.extensions.get_extension_for_class(x509.CRLNumber)
+    return extension.value.crl_number
+
+  def testBase(self):
+    self.revoked.update([self.row(5, 'keyCompromise'), self.row(6),
+                         self.row(7, end_days=-1)])
+    self.assertEqual(self.crl.update(self.revoked, self.now), ([5, 6], []))
+    crl = self.readCRL(self.path)
+    # the expired certificate is left out of the CRL
+    self.assertEqual(sorted([r.serial_number for r in crl]), [5, 6])
+    entry = crl.get_revoked_certificate_by_serial_number(5)
+    # the stored times are UTC times
+    self.assertEqual(entry.revocation_date,
+                     self.now - datetime.timedelta(hours=1))
+    self.assertEqual(entry.extensions.get_extension_for_class(x509.CRLReason)
+                     .value.reason, x509.ReasonFlags.key_compromise)
+    self.assertTrue(crl.is_signature_valid(
+        self.ca.to_cryptography().public_key()))
+    self.assertTrue(self.crl.isRevoked(6))
+    self.assertFalse(self.crl.isRevoked(7))
+
+  def testDelta(self):
+    delta_path = os.path.join(self.directory, 'crl-delta.pem')
+    self.revoked.update([self.row(5)])
+    self.crl.update(self.revoked, self.now)
+    base_number = self.getNumber(self.readCRL(self.path))
+    mtime = os.stat(delta_path).st_mtime_ns
+
+    # nothing is signed while the set keeps its generation
+    self.assertEqual(self.crl.update(self.revoked, self.now +
+                                     datetime.timedelta(hours=1)), ([], []))
+    self.assertEqual(os.stat(delta_path).st_mtime_ns, mtime)
+
+    self.revoked.update([self.row(8)])
+    self.assertEqual(self.crl.update(self.revoked, self.now +
+                                     datetime.timedelta(hours=2)), ([8], []))
+    delta = self.readCRL(delta_path)
+    self.assertEqual([r.serial_number for r in delta], [8])
+    self.assertEqual(delta.extensions.get_extension_for_class(
+        x509.DeltaCRLIndicator).value.crl_number, base_number)
+    self.assertEqual(self.getNumber(self.readCRL(self.path)), base_number)
+
+    # an un-revoked certificate makes a new base
+    self.revoked.update([self.row(8)], full=True)
+    self.assertEqual(self.crl.update(self.revoked, self.now +
+                                     datetime.timedelta(hours=3)), ([], [5]))
+    base = self.readCRL(self.path)
+    self.assertEqual([r.serial_number for r in base], [8])
+    self.assertGreater(self.getNumber(base), base_number)
+    self.assertEqual(len(list(self.readCRL(delta_path))), 0)
+
+  def testBaseInterval(self):
+    delta_path = os.path.join(self.directory, 'crl-delta.pem')
+    self.revoked.update([self.row(5)])
+    self.crl.update(self.revoked, self.now)
+    base_number = self.getNumber(self.readCRL(self.path))
+    self.revoked.update([self.row(8)])
+    self.crl.update(self.revoked, self.now + datetime.timedelta(hours=2))
+
+    # the base is signed again on schedule, with the delta serials
+    later = self.now + datetime.timedelta(hours=24)
+    self.assertEqual(self.crl.update(self.revoked, later), ([], []))
+    base = self.readCRL(self.path)
+    self.assertEqual(sorted([r.serial_number for r in base]), [5, 8])
+    self.assertGreater(self.getNumber(base), base_number)
+    self.assertEqual(base.last_update, later)
+    self.assertEqual(base.next_update,
+                     later + datetime.timedelta(hours=48))
+    delta = self.readCRL(delta_path)
+    self.assertEqual(len(list(delta)), 0)
+    self.assertEqual(delta.extensions.get_extension_for_class(
+        x509.DeltaCRLIndicator).value.crl_number, self.getNumber(base))
+
+  def testRestart(self):
+    self.revoked.update([self.row(5)])
+    self.crl.update(self.revoked, self.now)
+    base_number = self.getNumber(self.readCRL(self.path))
+    # CRL numbers keep increasing with a new builder
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'crl_file': self.path}})
+    crl = PKICRLBuilder(cp)
+    self.assertTrue(crl.load(self.ca, self.ca_key, 'sha256'))
+    crl.update(self.revoked, self.now)
+    self.assertGreater(self.getNumber(self.readCRL(self.path)), base_number)
+
+  def testDisabled(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {}})
+    crl = PKICRLBuilder(cp)
+    self.assertTrue(crl.load(self.ca, self.ca_key, 'sha256'))
+    self.assertFalse(crl.enabled)
+    self.revoked.update([self.row(5)])
+    # the revoked serials are still known
+    self.assertEqual(crl.update(self.revoked, self.now), ([5], []))
+    self.assertTrue(crl.isRevoked(5))
+    self.assertEqual(os.listdir(self.directory), [])
+
+
+class TestPKICRLDirectory(unittest.TestCase):
+  """Publish revocations as a directory of files"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'crl')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def newDirectory(self):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'crl_directory': self.path}})
+    crl_directory = PKICRLDirectory(cp)
+    self.assertTrue(crl_directory.load())
+    return crl_directory
+
+  def testUpdate(self):
+    crl_directory = self.newDirectory()
+    self.assertEqual(crl_directory.update([3, 4]), (2, 0))
+    self.assertEqual(crl_directory.update([4, 9]), (1, 1))
+    self.assertEqual(sorted(os.listdir(self.path)), ['4', '9'])
+    # the existing files are known after a restart
+    crl_directory = self.newDirectory()
+    self.assertEqual(crl_directory.update([4, 9]), (0, 0))
+    self.assertEqual(crl_directory.update([]), (0, 2))
+    self.assertEqual(os.listdir(self.path), [])
@@ -0,0 +1,185 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the certificate extensions"""
+
+# System imports
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_manager import PublicKeyInfrastructure
+from OpenVPNUAM import models as Model
+
+
+class FakeDatabase(object):
+  """Give an id to each inserted certificate"""
+
+  def __init__(self):
+    self.last_id = 0
+
+  def insert(self, obj, parent=None, realtime=True):
+    self.last_id += 1
+    obj.load({'id': self.last_id})
+    return True
+
+
+def buildCA(directory):
+  """Build a self signed certificate authority into files
+
+  @param directory [str] the directory to write the files into
+  @return [tuple] the (certificate, key) paths of the authority
+  """
+  key = ec.generate_private_key(ec.SECP256R1())
+  name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test-ca')])
+  now = datetime.datetime.utcnow()
+  cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+          .public_key(key.public_key()).serial_number(1)
+          .not_valid_before(now).not_valid_after(now +
+                                                 datetime.timedelta(days=1))
+          .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                         critical=True)
+          .add_extension(
+              x509.SubjectKeyIdentifier.from_public_key(key.public_key()),
+              critical=False)
+          .sign(key, hashes.SHA256()))
+  paths = (os.path.join(directory, 'ca.crt'), os.path.join(directory, 'ca.key'))
+  with open(paths[0], 'wb') as f:
+    f.write(crypto.dump_certificate(crypto.FILETYPE_PEM,
+                                    crypto.X509.from_cryptography(cert)))
+  with open(paths[1], 'wb') as f:
+    f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM,
+                                   crypto.PKey.from_cryptography_key(key)))
+  return paths
+
+
+class TestExtensions(unittest.TestCase):
+  """Parse the extension sections once and apply them to each certificate"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    (self.ca_path, self.ca_key_path) = buildCA(self.directory)
+    self.cp = OVPNUAMConfigParser()
+    self.cp.read_dict({
+        self.cp.PKI_SECTION: {
+            'cert_directory': os.path.join(self.directory, 'certs'),
+            'file_writer_thread': 'False',
+            'ca': self.ca_path,
+            'ca_key': self.ca_key_path,
+            'key_type': PublicKeyInfrastructure.KEY_TYPE_EC_P256,
+            'client_extensions': 'client_exts',
+            'server_extensions': 'server_exts'},
+        'client_exts': {
+            'keyUsage': 'critical,digitalSignature',
+            'basicConstraints': 'CA:FALSE',
+            'extendedKeyUsage': 'critical,clientAuth',
+            'subjectKeyIdentifier': 'hash',
+            'authorityKeyIdentifier': 'keyid,issuer:always'},
+        'server_exts': {
+            'extendedKeyUsage': 'critical,serverAuth'}})
+    self.pki = PublicKeyInfrastructure(self.cp)
+    self.db = FakeDatabase()
+
+  def tearDown(self):
+    self.pki.stop()
+    shutil.rmtree(self.directory)
+
+  def issue(self, hostname_id):
+    """Issue a certificate for a new hostname
+
+    @param hostname_id [int] the id of the hostname
+    @return [cryptography.x509.Certificate] the signed certificate
+    """
+    user = Model.User('jdoe', 'jdoe@example.org')
+    user.load({'id': 1})
+    hostname = Model.Hostname('host' + str(hostname_id))
+    hostname.load({'id': hostname_id, 'period_days': 30, 'is_enabled': True})
+    hostname.db = self.db
+    self.pki.generateUserCertificate(user, hostname)
+    m_cert = hostname.getLatestCertificate()
+    self.assertIsNotNone(m_cert)
+    path = os.path.join(self.directory, 'certs', '1', str(hostname_id),
+                        str(m_cert.id) + '.crt')
+    return PublicKeyInfrastructure.loadCertificate(path).to_cryptography()
+
+  def testClientExtensions(self):
+    self.assertTrue(self.pki.load())
+    ca = PublicKeyInfrastructure.loadCertificate(self.ca_path)
+    ca_ski = ca.to_cryptography().extensions.get_extension_for_class(
+        x509.SubjectKeyIdentifier).value
+    l_ski = []
+    for hostname_id in [2, 3]:
+      cert = self.issue(hostname_id)
+      exts = cert.extensions
+      self.assertTrue(
+          exts.get_extension_for_class(x509.KeyUsage).critical)
+      self.assertFalse(
+          exts.get_extension_for_class(x509.BasicConstraints).value.ca)
+      self.assertEqual(
+          list(exts.get_extension_for_class(x509.ExtendedKeyUsage).value),
+          [ExtendedKeyUsageOID.CLIENT_AUTH])
+      # the key identifiers are computed for each certificate
+      ski = exts.get_extension_for_class(x509.SubjectKeyIdentifier).value
+      self.assertEqual(
+          ski,
+          x509.SubjectKeyIdentifier.from_public_key(cert.public_key()))
+      aki = exts.get_extension_for_class(x509.AuthorityKeyIdentifier).value
+      self.assertEqual(aki.key_identifier, ca_ski.digest)
+      self.assertEqual(aki.authority_cert_serial_number, 1)
+      l_ski.append(ski)
+    self.assertNotEqual(l_ski[0], l_ski[1])
+
+  def testInvalidExtension(self):
+    self.cp.set('server_exts', 'keyUsage', 'notAUsage')
+    self.assertFalse(self.pki.load())
+
+  def testMissingSection(self):
+    self.cp.remove_section('client_exts')
+    self.assertTrue(self.pki.load())
+    cert = self.issue(2)
+    self.assertEqual(len(cert.extensions), 0)
+
+  def testLazySection(self):
+    self.assertTrue(self.pki.load())
+    self.cp.read_dict({'other_exts': {'basicConstraints': 'CA:FALSE',
+                                      'subjectKeyIdentifier': 'hash'}})
+    cert = crypto.X509()
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 1024)
+    cert.set_pubkey(key)
+    self.pki.loadExtensionFromSection(cert, 'other_exts')
+    l_name = [cert.get_extension(i).get_short_name()
+              for i in range(cert.get_extension_count())]
+    self.assertEqual(l_name, [b'basicConstraints', b'subjectKeyIdentifier'])
@@ -0,0 +1,313 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests of the certificate directory layout"""
+
+# System imports
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_filetree import PKIFileTree
+from OpenVPNUAM.pki.pki_manifest import PKIManifest, ManifestEntry
+
+
+class TestMigrateTree(unittest.TestCase):
+  """Move user directories between fan-out layouts"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def newFileTree(self, levels):
+    """Build a file tree with the given number of hashed levels
+
+    @param levels [int] the fan-out of the tree
+    @return [PKIFileTree] the loaded file tree
+    """
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'cert_directory': self.directory,
+                                   'cert_directory_fanout': str(levels),
+                                   'file_writer_thread': 'False',
+                                   'manifest_file': ''}})
+    ft = PKIFileTree(cp)
+    self.assertTrue(ft.load())
+    return ft
+
+  def buildTree(self, levels, l_user_id):
+    """Create one certificate file for each user in a tree
+
+    @param levels [int] the fan-out of the tree
+    @param l_user_id [list<int>] the ids of the users
+    """
+    ft = self.newFileTree(levels)
+    for user_id in l_user_id:
+      path = ft.getPKIUserDirectory(user_id) + '10/'
+      os.makedirs(path)
+      with open(path + '5.crt', 'w') as f:
+        f.write(str(user_id))
+
+  def checkTree(self, levels, l_user_id):
+    """Check that the tree contains exactly the files of the users
+
+    @param levels [int] the fan-out of the tree
+    @param l_user_id [list<int>] the ids of the users
+    """
+    ft = self.newFileTree(levels)
+    l_file = []
+    for (path, l_dir, l_name) in os.walk(self.directory):
+      l_file += [os.path.join(path, name) for name in l_name]
+    l_expected = [ft.getPKIUserDirectory(user_id) + '10/5.crt'
+                  for user_id in l_user_id]
+    self.assertEqual(sorted(l_file), sorted(l_expected))
+    for user_id in l_user_id:
+      with open(ft.getPKIUserDirectory(user_id) + '10/5.crt') as f:
+        self.assertEqual(f.read(), str(user_id))
+
+  def migrate(self, src_levels, dst_levels, l_user_id):
+    """Migrate a tree and check the result
+
+    @param src_levels [int] the fan-out of the existing tree
+    @param dst_levels [int] the fan-out to migrate to
+    @param l_user_id [list<int>] the ids of the users
+    """
+    ft = self.newFileTree(dst_levels)
+    self.assertEqual(ft.migrateTree(src_levels), len(l_user_id))
+    self.checkTree(dst_levels, l_user_id)
+
+  def collidingIds(self, levels):
+    """Return user ids whose name is the hashed prefix of another one
+
+    @param levels [int] the fan-out of the tree
+    @return [list<int>] the ids of colliding users
+    """
+    ft = self.newFileTree(levels)
+    l_user_id = []
+    for user_id in range(1, 1000):
+      prefix = ft.getFanoutPrefix(user_id).split('/')[0]
+      if prefix.isdigit() and int(prefix) != user_id:
+        l_user_id += [user_id, int(prefix)]
+      if len(l_user_id) >= 8:
+        break
+    return l_user_id
+
+  def testColliding(self):
+    # the prefix of each of these users is the id of the other one
+    self.buildTree(0, [22, 12])
+    self.migrate(0, 1, [22, 12])
+    shutil.rmtree(self.directory)
+    self.buildTree(0, [3, 77])
+    self.migrate(0, 1, [3, 77])
+
+  def testCollidingBackward(self):
+    self.buildTree(1, [22, 12, 3, 77])
+    self.migrate(1, 0, [22, 12, 3, 77])
+
+  def testManyColliding(self):
+    l_user_id = self.collidingIds(1)
+    self.buildTree(0, l_user_id)
+    self.migrate(0, 1, l_user_id)
+    self.migrate(1, 3, l_user_id)
+    self.migrate(3, 0, l_user_id)
+
+  def testSameLayout(self):
+    self.buildTree(1, [22, 12])
+    self.assertEqual(self.newFileTree(1).migrateTree(1), 0)
+    self.checkTree(1, [22, 12])
+
+  def testInterrupted(self):
+    # a user directory left at its staging name is moved again
+    self.buildTree(0, [22, 12])
+    os.rename(os.path.join(self.directory, '12'),
+              os.path.join(self.directory, PKIFileTree.MIGRATE_PREFIX + '12'))
+    self.assertEqual(self.newFileTree(1).migrateTree(0), 2)
+    self.checkTree(1, [22, 12])
+
+
+class TestManifestSeed(unittest.TestCase):
+  """Enable the manifest on an existing certificate directory"""
+
+  Model = collections.namedtuple('Model', ['id'])
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def newFileTree(self, manifest):
+    """Build a file tree without fan-out
+
+    @param manifest [str] the name of the manifest file, empty to disable it
+    @return [PKIFileTree] the loaded file tree
+    """
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'cert_directory': self.directory,
+                                   'file_writer_thread': 'False',
+                                   'manifest_file': manifest}})
+    ft = PKIFileTree(cp)
+    self.assertTrue(ft.load())
+    return ft
+
+  def testSeed(self):
+    (user, hostname) = (self.Model(3), self.Model(10))
+    ft = self.newFileTree('')
+    for serial in [5, 6]:
+      ft.storePKIUserFile(user, hostname, self.Model(serial), 'key', b'key')
+    ft.stop()
+
+    ft = self.newFileTree('.manifest')
+    self.assertEqual(len(ft.manifest), 2)
+    self.assertEqual(ft.manifest.getHostnameSerials(10), [5, 6])
+    self.assertTrue(ft.hasPKIUserFile(user, hostname, self.Model(5), 'key'))
+    self.assertFalse(ft.hasPKIUserFile(user, hostname, self.Model(5), 'crt'))
+    self.assertEqual(ft.checkManifest(), [])
+    ft.stop()
+
+    # the manifest is only seeded once
+    os.remove(ft.getPKIUserFilePath(user, hostname, self.Model(6), 'key'))
+    ft = self.newFileTree('.manifest')
+    self.assertEqual(len(ft.manifest), 2)
+    self.assertEqual(len(ft.checkManifest()), 1)
+    ft.stop()
+
+  def testSeedAfterMigration(self):
+    (user, hostname) = (self.Model(12), self.Model(10))
+    ft = self.newFileTree('')
+    ft.storePKIUserFile(user, hostname, self.Model(5), 'key', b'key')
+    ft.stop()
+
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'cert_directory': self.directory,
+                                   'cert_directory_fanout': '1',
+                                   'file_writer_thread': 'False'}})
+    ft = PKIFileTree(cp)
+    self.assertTrue(ft.load(seed_manifest=False))
+    self.assertEqual(len(ft.manifest), 0)
+    self.assertEqual(ft.migrateTree(0), 1)
+    self.assertEqual(ft.manifest.getHostnameSerials(10), [5])
+    self.assertEqual(ft.checkManifest(), [])
+    ft.stop()
+
+
+class TestManifest(unittest.TestCase):
+  """Record the stored files"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {}})
+    self.manifest = PKIManifest(cp)
+    self.assertTrue(self.manifest.load(self.directory))
+    self.path = os.path.join(self.directory, '.manifest')
+
+  def tearDown(self):
+    self.manifest.close()
+    shutil.rmtree(self.directory)
+
+  def entry(self, serial):
+    return ManifestEntry(1, 2, serial, 'crt', 10, 'digest')
+
+  def countLines(self):
+    with open(self.path) as f:
+      return len(f.readlines())
+
+  def testRecordFailure(self):
+    self.assertTrue(self.manifest.record([(PKIManifest.OP_ADD,
+                                           self.entry(1))]))
+    with mock.patch('os.fsync', side_effect=OSError('disk full')):
+      self.assertFalse(self.manifest.record([(PKIManifest.OP_ADD,
+                                              self.entry(2))]))
+    # the index only contains the written changes
+    self.assertIsNotNone(self.manifest.getEntry(1, 'crt'))
+    self.assertIsNone(self.manifest.getEntry(2, 'crt'))
+
+  def testCompact(self):
+    self.manifest.COMPACT_MIN_LINES = 6
+    self.manifest.record([(PKIManifest.OP_ADD, self.entry(i))
+                          for i in range(3)])
+    self.manifest.record([(PKIManifest.OP_REMOVE, self.entry(0))])
+    self.manifest.record([(PKIManifest.OP_REMOVE, self.entry(1))])
+    self.assertEqual(self.countLines(), 5)
+    # the sixth line makes five dead lines on six
+    self.manifest.record([(PKIManifest.OP_ADD, self.entry(2))])
+    self.assertEqual(self.countLines(), 1)
+    self.assertEqual(len(self.manifest), 1)
+
+    # the compacted manifest is replayed with the same entries
+    self.manifest.record([(PKIManifest.OP_ADD, self.entry(3))])
+    self.manifest.close()
+    self.assertTrue(self.manifest.load(self.directory))
+    self.assertEqual(sorted([entry.serial for entry in self.manifest]),
+                     [2, 3])
+
+
+class TestFileWriter(unittest.TestCase):
+  """Read the files written by the background writer"""
+
+  Model = collections.namedtuple('Model', ['id'])
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'cert_directory': self.directory,
+                                   'manifest_file': ''}})
+    self.ft = PKIFileTree(cp)
+    self.assertTrue(self.ft.load())
+    self.ft.start()
+
+  def tearDown(self):
+    self.ft.stop()
+    shutil.rmtree(self.directory)
+
+  def testPendingPath(self):
+    (user, hostname) = (self.Model(3), self.Model(10))
+    (pending, other) = (self.Model(5), self.Model(6))
+    self.ft.storePKIUserFile(user, hostname, other, 'key', b'other')
+    self.ft.flush()
+    release = threading.Event()
+    with mock.patch('os.fsync', side_effect=lambda fd: release.wait(10)):
+      self.ft.storePKIUserFile(user, hostname, pending, 'key', b'pending')
+      # the files without pending write are read without waiting the writer
+      start = time.monotonic()
+      self.assertTrue(self.ft.hasPKIUserFile(user, hostname, other, 'key'))
+      self.assertEqual(self.ft.readPKIUserFile(user, hostname, other, 'key'),
+                       b'other')
+      self.assertLess(time.monotonic() - start, 5)
+      release.set()
+      self.assertEqual(self.ft.readPKIUserFile(user, hostname, pending,
+                                               'key'), b'pending')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,193 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the certificate issuance for each key type"""
+
+# System imports
+import collections
+import datetime
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_filetree import PKIFileTree
+from OpenVPNUAM.pki.pki_manager import PublicKeyInfrastructure
+from OpenVPNUAM import models as Model
+
+
+class FakeDatabase(object):
+  """Give an id to each inserted certificate"""
+
+  def __init__(self):
+    self.last_id = 0
+
+  def insert(self, obj, parent=None, realtime=True):
+    self.last_id += 1
+    obj.load({'id': self.last_id})
+    return True
+
+
+def buildCA(directory):
+  """Build a self signed certificate authority into files
+
+  @param directory [str] the directory to write the files into
+  @return [tuple] the (certificate, key) paths of the authority
+  """
+  key = ec.generate_private_key(ec.SECP256R1())
+  name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test-ca')])
+  now = datetime.datetime.utcnow()
+  cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+          .public_key(key.public_key()).serial_number(1)
+          .not_valid_before(now).not_valid_after(now +
+                                                 datetime.timedelta(days=1))
+          .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                         critical=True)
+          .sign(key, hashes.SHA256()))
+  paths = (os.path.join(directory, 'ca.crt'), os.path.join(directory, 'ca.key'))
+  with open(paths[0], 'wb') as f:
+    f.write(crypto.dump_certificate(crypto.FILETYPE_PEM,
+                                    crypto.X509.from_cryptography(cert)))
+  with open(paths[1], 'wb') as f:
+    f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM,
+                                   crypto.PKey.from_cryptography_key(key)))
+  return paths
+
+
+class TestIssuance(unittest.TestCase):
+  """Generate, sign and reload a certificate for each key type"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    (self.ca_path, self.ca_key_path) = buildCA(self.directory)
+    self.cp = OVPNUAMConfigParser()
+    self.cp.read_dict({self.cp.PKI_SECTION: {
+        'cert_directory': os.path.join(self.directory, 'certs'),
+        'file_writer_thread': 'False',
+        'ca': self.ca_path,
+        'ca_key': self.ca_key_path,
+        'new_cert_key_size': '1024',
+        'keep_certificate_request': 'True'}})
+    self.l_service = []
+
+  def tearDown(self):
+    for service in self.l_service:
+      service.stop()
+    shutil.rmtree(self.directory)
+
+  def issue(self, key_type, hostname_key_type=None):
+    """Issue a certificate with the given global and hostname key types
+
+    @param key_type [str] the key type of the PKI
+    @param hostname_key_type [str] OPTIONNAL : the key type of the hostname
+    @return [tuple] the (PKI, user, hostname, certificate model, file tree)
+    """
+    self.cp.set(self.cp.PKI_SECTION, 'key_type', key_type)
+    pki = PublicKeyInfrastructure(self.cp)
+    self.l_service.append(pki)
+    self.assertTrue(pki.load())
+    user = Model.User('jdoe', 'jdoe@example.org')
+    user.load({'id': 1})
+    hostname = Model.Hostname('laptop')
+    hostname.load({'id': 2, 'period_days': 30, 'is_enabled': True,
+                   'key_type': hostname_key_type})
+    hostname.db = FakeDatabase()
+    pki.generateUserCertificate(user, hostname)
+    m_cert = hostname.getLatestCertificate()
+    self.assertIsNotNone(m_cert)
+    ft = PKIFileTree(self.cp)
+    self.assertTrue(ft.load())
+    self.l_service.append(ft)
+    return (pki, user, hostname, m_cert, ft)
+
+  def checkIssuance(self, key_type, hostname_key_type=None):
+    """Check the stored files of a certificate
+
+    @param key_type [str] the key type of the PKI
+    @param hostname_key_type [str] OPTIONNAL : the key type of the hostname
+    @return [bool] True if a certificate request has been stored
+    """
+    (pki, user, hostname, m_cert, ft) = self.issue(key_type, hostname_key_type)
+    expected = hostname_key_type or key_type
+    cert = PublicKeyInfrastructure.loadCertificate(
+        ft.getPKIUserFilePath(user, hostname, m_cert, 'crt'))
+    key = PublicKeyInfrastructure.loadPrivateKey(
+        ft.getPKIUserFilePath(user, hostname, m_cert, 'key'))
+    self.assertIsNotNone(cert)
+    self.assertIsNotNone(key)
+    self.assertEqual(cert.get_serial_number(), m_cert.id)
+    self.assertEqual(
+        pki.getPublicKeyType(cert.get_pubkey()), expected)
+    # the certificate certifies the stored key
+    self.assertEqual(
+        crypto.dump_publickey(crypto.FILETYPE_PEM, cert.get_pubkey()),
+        crypto.dump_publickey(crypto.FILETYPE_PEM, key))
+    # and is signed by the authority
+    store = crypto.X509Store()
+    store.add_cert(PublicKeyInfrastructure.loadCertificate(self.ca_path))
+    crypto.X509StoreContext(store, cert).verify_certificate()
+
+    req_path = ft.getPKIUserFilePath(user, hostname, m_cert, 'csr')
+    if not os.path.exists(req_path):
+      return False
+    with open(req_path, 'rb') as f:
+      req = crypto.load_certificate_request(crypto.FILETYPE_PEM, f.read())
+    self.assertTrue(req.verify(key))
+    return True
+
+  def testRSA(self):
+    self.assertTrue(self.checkIssuance(PublicKeyInfrastructure.KEY_TYPE_RSA))
+
+  def testECP256(self):
+    self.assertTrue(
+        self.checkIssuance(PublicKeyInfrastructure.KEY_TYPE_EC_P256))
+
+  def testECP384(self):
+    self.assertTrue(
+        self.checkIssuance(PublicKeyInfrastructure.KEY_TYPE_EC_P384))
+
+  def testED25519(self):
+    # no request can be signed by an ed25519 key
+    self.assertFalse(
+        self.checkIssuance(PublicKeyInfrastructure.KEY_TYPE_ED25519))
+
+  def testHostnameED25519(self):
+    self.assertFalse(
+        self.checkIssuance(PublicKeyInfrastructure.KEY_TYPE_RSA,
+                           PublicKeyInfrastructure.KEY_TYPE_ED25519))
+
+  def testHostnameECP256(self):
+    self.assertTrue(
+        self.checkIssuance(PublicKeyInfrastructure.KEY_TYPE_ED25519,
+                           PublicKeyInfrastructure.KEY_TYPE_EC_P256))
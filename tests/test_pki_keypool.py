@@ -0,0 +1,146 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the private key pool"""
+
+# System imports
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cryptography.hazmat.primitives.asymmetric import ec
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_keypool import PKIKeyPool
+
+
+class KeyGenerator(object):
+  """A generator of small keys which can be made to fail
+  """
+
+  def __init__(self):
+    self.calls = 0
+    self.failures = 0
+
+  def __call__(self):
+    self.calls += 1
+    if self.failures > 0:
+      self.failures -= 1
+      raise ValueError('no entropy')
+    return crypto.PKey.from_cryptography_key(
+        ec.generate_private_key(ec.SECP256R1()))
+
+
+class TestPKIKeyPool(unittest.TestCase):
+  """Keep a reservoir of private keys"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.generator = KeyGenerator()
+    self.l_pool = []
+
+  def tearDown(self):
+    for pool in self.l_pool:
+      pool.stop()
+    shutil.rmtree(self.directory)
+
+  def newPool(self, password='secret', low_watermark='2'):
+    cp = OVPNUAMConfigParser()
+    section = {'key_pool_size': '4',
+               'key_pool_low_watermark': low_watermark,
+               'key_pool_directory': self.directory}
+    if password is not None:
+      section['key_pool_password'] = password
+    cp.read_dict({cp.PKI_SECTION: section})
+    pool = PKIKeyPool(cp)
+    self.l_pool.append(pool)
+    return pool
+
+  def waitSize(self, pool, size):
+    deadline = time.monotonic() + 10
+    while len(pool) != size and time.monotonic() < deadline:
+      time.sleep(0.01)
+    self.assertEqual(len(pool), size)
+
+  def listKeys(self):
+    return os.listdir(os.path.join(self.directory, 'ec'))
+
+  def testWatermarks(self):
+    pool = self.newPool()
+    self.assertTrue(pool.load('ec', self.generator))
+    pool.start()
+    self.waitSize(pool, 4)
+    self.assertIsNotNone(pool.takeKey())
+    # the pool is still over its low watermark
+    time.sleep(0.1)
+    self.assertEqual(len(pool), 3)
+    self.assertIsNotNone(pool.takeKey())
+    self.waitSize(pool, 4)
+    self.assertEqual(self.generator.calls, 6)
+    self.assertEqual(len(self.listKeys()), 4)
+
+  def testRestartReuse(self):
+    pool = self.newPool()
+    self.assertTrue(pool.load('ec', self.generator))
+    pool.start()
+    self.waitSize(pool, 4)
+    pool.stop()
+
+    pool = self.newPool()
+    self.assertTrue(pool.load('ec', self.generator))
+    self.assertEqual(len(pool), 4)
+    self.assertEqual(self.generator.calls, 4)
+
+  def testRandomPasswordDiscard(self):
+    pool = self.newPool(password=None)
+    self.assertTrue(pool.load('ec', self.generator))
+    pool.start()
+    self.waitSize(pool, 4)
+    pool.stop()
+
+    # the keys encrypted with the previous random password are removed
+    pool = self.newPool(password=None)
+    self.assertTrue(pool.load('ec', self.generator))
+    self.assertEqual(len(pool), 0)
+    self.assertEqual(self.listKeys(), [])
+
+  def testGeneratorFailure(self):
+    pool = self.newPool()
+    pool.RETRY_DELAY = 0.01
+    self.generator.failures = 3
+    self.assertTrue(pool.load('ec', self.generator))
+    pool.start()
+    self.waitSize(pool, 4)
+    self.assertEqual(self.generator.calls, 7)
+
+  def testInvalidLowWatermark(self):
+    self.assertFalse(self.newPool(low_watermark='').load('ec',
+                                                          self.generator))
+    self.assertFalse(self.newPool(low_watermark='4').load('ec',
+                                                           self.generator))
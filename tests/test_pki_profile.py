@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the client profiles"""
+
+# System imports
+import collections
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_filetree import PKIFileTree
+from OpenVPNUAM.pki.pki_profile import PKIProfileBuilder
+
+# A client configuration template
+TEMPLATE = """client
+remote vpn.example.org 1194
+# ${common_name}
+${ca}
+${cert}
+${key}
+"""
+
+
+def buildCertificate(name, issuer=None, issuer_key=None):
+  """Build a certificate and its key
+
+  @param name [str] the common name of the certificate
+  @param issuer [X509] OPTIONNAL : the issuer, self signed if None
+  @param issuer_key [PKey] OPTIONNAL : the key of the issuer
+  @return [tuple] the (X509, PKey) of the certificate
+  """
+  key = ec.generate_private_key(ec.SECP256R1())
+  subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+  now = datetime.datetime.utcnow()
+  builder = (x509.CertificateBuilder().subject_name(subject)
+             .public_key(key.public_key()).serial_number(7)
+             .not_valid_before(now)
+             .not_valid_after(now + datetime.timedelta(days=1)))
+  if issuer is None:
+    cert = builder.issuer_name(subject).sign(key, hashes.SHA256())
+  else:
+    cert = builder.issuer_name(issuer.to_cryptography().subject).sign(
+        issuer_key.to_cryptography_key(), hashes.SHA256())
+  return (crypto.X509.from_cryptography(cert),
+          crypto.PKey.from_cryptography_key(key))
+
+
+class TestPKIProfileBuilder(unittest.TestCase):
+  """Build the deliverables of a new certificate"""
+
+  Model = collections.namedtuple('Model', ['id'])
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    template = os.path.join(self.directory, 'client.ovpn')
+    with open(template, 'w') as f:
+      f.write(TEMPLATE)
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {
+        'cert_directory': os.path.join(self.directory, 'certs'),
+        'file_writer_thread': 'False',
+        'profile_template': template,
+        'profile_pkcs12': 'True'}})
+    self.ft = PKIFileTree(cp)
+    self.assertTrue(self.ft.load())
+    (self.ca, self.ca_key) = buildCertificate('test-ca')
+    self.profile = PKIProfileBuilder(cp, self.ft)
+    self.assertTrue(self.profile.load(self.ca))
+
+  def tearDown(self):
+    self.ft.stop()
+    shutil.rmtree(self.directory)
+
+  def testBuild(self):
+    (user, hostname, m_cert) = (self.Model(3), self.Model(10), self.Model(7))
+    (cert, key) = buildCertificate('jdoe_laptop', self.ca, self.ca_key)
+    key_pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+    self.assertTrue(self.profile.enabled)
+    self.profile.build(user, hostname, m_cert, cert, key, key_pem, 'secret')
+
+    profile = self.ft.readPKIUserFile(user, hostname, m_cert,
+                                      PKIProfileBuilder.EXT_PROFILE).decode()
+    self.assertIn('# jdoe_laptop\n', profile)
+    self.assertIn('<ca>\n' + crypto.dump_certificate(
+        crypto.FILETYPE_PEM, self.ca).decode() + '</ca>', profile)
+    self.assertIn('<cert>\n' + crypto.dump_certificate(
+        crypto.FILETYPE_PEM, cert).decode() + '</cert>', profile)
+    self.assertIn('<key>\n' + key_pem.decode() + '</key>', profile)
+
+    bundle = pkcs12.load_pkcs12(
+        self.ft.readPKIUserFile(user, hostname, m_cert,
+                                PKIProfileBuilder.EXT_PKCS12), b'secret')
+    self.assertEqual(bundle.cert.certificate, cert.to_cryptography())
+    self.assertEqual([c.certificate for c in bundle.additional_certs],
+                     [self.ca.to_cryptography()])
+
+  def testWithoutKey(self):
+    (user, hostname, m_cert) = (self.Model(3), self.Model(10), self.Model(8))
+    (cert, key) = buildCertificate('jdoe_laptop', self.ca, self.ca_key)
+    # a certificate without its private key has no profile
+    self.profile.build(user, hostname, m_cert, cert, None, None, None)
+    self.assertFalse(self.ft.hasPKIUserFile(user, hostname, m_cert,
+                                            PKIProfileBuilder.EXT_PROFILE))
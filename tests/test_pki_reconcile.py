@@ -0,0 +1,113 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Tests of the certificate directory reconciliation"""
+
+# System imports
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_filetree import PKIFileTree
+from OpenVPNUAM.pki.pki_reconcile import PKIReconciler
+
+
+class TestReconcile(unittest.TestCase):
+  """Compare a certificate directory with certificates rows"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {'cert_directory': self.directory,
+                                   'file_writer_thread': 'False',
+                                   'manifest_file': '',
+                                   'reconcile_workers': '1',
+                                   'reconcile_repair': 'True'}})
+    self.ft = PKIFileTree(cp)
+    self.assertTrue(self.ft.load())
+    # the certificates files are never parsed
+    self.reconciler = PKIReconciler(cp, self.ft, lambda path: None)
+    self.assertTrue(self.reconciler.load())
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def writeFile(self, serial, extension, mtime=None):
+    """Create a certificate file of the hostname 2 of the user 1
+
+    @param serial [int] the serial of the certificate
+    @param extension [str] the extension of the file
+    @param mtime [float] OPTIONNAL : the modification time of the file
+    @return [str] the path of the file
+    """
+    path = self.ft.getPKIUserDirectory(1) + '2/'
+    os.makedirs(path, exist_ok=True)
+    path += str(serial) + '.' + extension
+    with open(path, 'w') as f:
+      f.write(str(serial))
+    if mtime is not None:
+      os.utime(path, (mtime, mtime))
+    return path
+
+  def row(self, serial):
+    """Return the row of a certificate of the hostname 2 of the user 1
+
+    @param serial [int] the serial of the certificate
+    @return [dict] the certificate row
+    """
+    return {'id': serial, 'user_id': 1, 'hostname_id': 2,
+            'certificate_begin_time': None, 'certificate_end_time': None}
+
+  def testRepairOption(self):
+    path = self.writeFile(7, 'key')
+    l_issue = self.reconciler.run([])
+    self.assertEqual([issue.kind for issue in l_issue],
+                     [PKIReconciler.ISSUE_ORPHAN_FILE])
+    self.assertFalse(os.path.exists(path))
+    self.assertTrue(os.path.isfile(os.path.join(
+        self.directory, 'orphans', os.path.relpath(path, self.directory))))
+
+  def testNoRepair(self):
+    path = self.writeFile(7, 'key')
+    l_issue = self.reconciler.run([], False)
+    self.assertEqual(len(l_issue), 1)
+    self.assertTrue(os.path.isfile(path))
+
+  def testSkipRecent(self):
+    since = time.time()
+    self.writeFile(5, 'key', since - 60)
+    # written after the snapshot, with or without their rows
+    self.writeFile(5, 'crt', since + 1)
+    path = self.writeFile(7, 'key', since + 1)
+    self.assertEqual(self.reconciler.run([self.row(5)], True, since), [])
+    self.assertTrue(os.path.isfile(path))
+
+    l_issue = self.reconciler.run([self.row(5)], False)
+    self.assertEqual(sorted([issue.kind for issue in l_issue]),
+                     [PKIReconciler.ISSUE_ORPHAN_FILE,
+                      PKIReconciler.ISSUE_UNREADABLE_FILE])
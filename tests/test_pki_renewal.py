@@ -0,0 +1,179 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the private key reuse by renewals"""
+
+# System imports
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_manager import PublicKeyInfrastructure
+from OpenVPNUAM import models as Model
+
+
+class FakeDatabase(object):
+  """Give an id to each inserted certificate"""
+
+  def __init__(self):
+    self.last_id = 0
+    self.last = None
+
+  def insert(self, obj, parent=None, realtime=True):
+    self.last_id += 1
+    obj.load({'id': self.last_id})
+    self.last = obj
+    return True
+
+
+def buildCA(directory):
+  """Build a self signed certificate authority into files
+
+  @param directory [str] the directory to write the files into
+  @return [tuple] the (certificate, key) paths of the authority
+  """
+  key = ec.generate_private_key(ec.SECP256R1())
+  name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'test-ca')])
+  now = datetime.datetime.utcnow()
+  cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+          .public_key(key.public_key()).serial_number(1)
+          .not_valid_before(now).not_valid_after(now +
+                                                 datetime.timedelta(days=1))
+          .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                         critical=True)
+          .sign(key, hashes.SHA256()))
+  paths = (os.path.join(directory, 'ca.crt'), os.path.join(directory, 'ca.key'))
+  with open(paths[0], 'wb') as f:
+    f.write(crypto.dump_certificate(crypto.FILETYPE_PEM,
+                                    crypto.X509.from_cryptography(cert)))
+  with open(paths[1], 'wb') as f:
+    f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM,
+                                   crypto.PKey.from_cryptography_key(key)))
+  return paths
+
+
+class TestKeyReuse(unittest.TestCase):
+  """Certify again the key of the latest certificate"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    (self.ca_path, self.ca_key_path) = buildCA(self.directory)
+    self.cp = OVPNUAMConfigParser()
+    self.cp.read_dict({self.cp.PKI_SECTION: {
+        'cert_directory': os.path.join(self.directory, 'certs'),
+        'file_writer_thread': 'False',
+        'ca': self.ca_path,
+        'ca_key': self.ca_key_path,
+        'key_type': PublicKeyInfrastructure.KEY_TYPE_EC_P256,
+        'renew_reuse_key': 'True',
+        'key_lifetime_days': '90'}})
+    self.pki = None
+    self.user = Model.User('jdoe', 'jdoe@example.org')
+    self.user.load({'id': 1, 'certificate_password': 'secret'})
+    self.hostname = Model.Hostname('laptop')
+    self.hostname.load({'id': 2, 'period_days': 30, 'is_enabled': True})
+    self.hostname.db = FakeDatabase()
+
+  def tearDown(self):
+    if self.pki is not None:
+      self.pki.stop()
+    shutil.rmtree(self.directory)
+
+  def loadPKI(self):
+    self.pki = PublicKeyInfrastructure(self.cp)
+    self.assertTrue(self.pki.load())
+
+  def path(self, m_cert, extension):
+    return os.path.join(self.directory, 'certs', '1', '2',
+                        str(m_cert.id) + '.' + extension)
+
+  def issue(self):
+    """Issue a new certificate for the hostname
+
+    @return [tuple] the (Certificate, X509) of the new certificate
+    """
+    self.pki.generateUserCertificate(self.user, self.hostname)
+    m_cert = self.hostname.db.last
+    return (m_cert,
+            PublicKeyInfrastructure.loadCertificate(self.path(m_cert, 'crt')))
+
+  def publicKey(self, cert):
+    return crypto.dump_publickey(crypto.FILETYPE_PEM, cert.get_pubkey())
+
+  def testReuse(self):
+    self.loadPKI()
+    (m_first, first) = self.issue()
+    (m_second, second) = self.issue()
+    self.assertEqual(self.publicKey(first), self.publicKey(second))
+    # the key keeps its creation time and its passphrase
+    self.assertEqual(m_second.key_creation_time, m_first.key_creation_time)
+    self.assertTrue(m_second.is_password)
+    # and its file is shared by both certificates
+    first_stat = os.stat(self.path(m_first, 'key'))
+    second_stat = os.stat(self.path(m_second, 'key'))
+    self.assertEqual(first_stat.st_ino, second_stat.st_ino)
+    self.assertEqual(second_stat.st_nlink, 2)
+
+  def testCopyFallback(self):
+    self.loadPKI()
+    (m_first, first) = self.issue()
+    with mock.patch('os.link', side_effect=OSError('cross-device link')):
+      (m_second, second) = self.issue()
+    self.assertEqual(self.publicKey(first), self.publicKey(second))
+    first_path = self.path(m_first, 'key')
+    second_path = self.path(m_second, 'key')
+    self.assertNotEqual(os.stat(first_path).st_ino,
+                        os.stat(second_path).st_ino)
+    with open(first_path, 'rb') as f_first:
+      with open(second_path, 'rb') as f_second:
+        self.assertEqual(f_first.read(), f_second.read())
+
+  def testLifetime(self):
+    # the renewed certificate would outlive the key
+    self.cp.set(self.cp.PKI_SECTION, 'key_lifetime_days', '20')
+    self.loadPKI()
+    (m_first, first) = self.issue()
+    (m_second, second) = self.issue()
+    self.assertNotEqual(self.publicKey(first), self.publicKey(second))
+    self.assertEqual(os.stat(self.path(m_second, 'key')).st_nlink, 1)
+
+  def testDisabled(self):
+    self.cp.set(self.cp.PKI_SECTION, 'renew_reuse_key', 'False')
+    self.loadPKI()
+    (m_first, first) = self.issue()
+    (m_second, second) = self.issue()
+    self.assertNotEqual(self.publicKey(first), self.publicKey(second))
+    self.assertEqual(os.stat(self.path(m_second, 'key')).st_nlink, 1)
@@ -0,0 +1,126 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the certificate serial allocator"""
+
+# System imports
+import datetime
+import os
+import tempfile
+import unittest
+
+# Project imports
+from OpenVPNUAM import models as Model
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_serial import PKISerialAllocator
+
+
+class FakeDatabase(object):
+  """A database which only knows its greatest certificate id
+  """
+
+  def __init__(self, last_id):
+    self.last_id = last_id
+    self.l_reserve = []
+
+  def getLastCertificateId(self):
+    return self.last_id
+
+  def reserveSerialRange(self, count):
+    if self.last_id is None:
+      return None
+    self.l_reserve.append(count)
+    first = self.last_id + 1
+    self.last_id += count
+    return first
+
+
+class TestPKISerialAllocator(unittest.TestCase):
+  """Reserve serial numbers ahead of time"""
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'serial')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def makeAllocator(self, size, path=None):
+    cp = OVPNUAMConfigParser()
+    section = {'serial_lease_size': str(size)}
+    if path is not None:
+      section['serial_file'] = path
+    cp.read_dict({cp.PKI_SECTION: section})
+    allocator = PKISerialAllocator(cp)
+    self.assertTrue(allocator.load())
+    return allocator
+
+  def makeCertificates(self, count):
+    now = datetime.datetime.utcnow()
+    return [Model.Certificate(now, now + datetime.timedelta(days=1))
+            for i in range(count)]
+
+  def testDisabled(self):
+    allocator = self.makeAllocator(0)
+    self.assertFalse(allocator.enabled)
+    l_cert = self.makeCertificates(1)
+    self.assertFalse(allocator.assignSerials(FakeDatabase(0), l_cert))
+    self.assertIsNone(l_cert[0].id)
+
+  def testDatabaseLease(self):
+    allocator = self.makeAllocator(4)
+    db = FakeDatabase(10)
+    l_cert = self.makeCertificates(3)
+    self.assertTrue(allocator.assignSerials(db, l_cert))
+    self.assertEqual([cert.id for cert in l_cert], [11, 12, 13])
+    # the end of the lease is used before a new one is taken
+    l_cert = self.makeCertificates(2)
+    self.assertTrue(allocator.assignSerials(db, l_cert))
+    self.assertEqual([cert.id for cert in l_cert], [14, 15])
+    self.assertEqual(db.l_reserve, [4, 4])
+
+  def testFileCounterInitialization(self):
+    allocator = self.makeAllocator(5, self.path)
+    db = FakeDatabase(41)
+    l_cert = self.makeCertificates(2)
+    self.assertTrue(allocator.assignSerials(db, l_cert))
+    self.assertEqual([cert.id for cert in l_cert], [42, 43])
+    # the serial_sequence table is never used with a counter file
+    self.assertEqual(db.l_reserve, [])
+    with open(self.path) as f:
+      self.assertEqual(f.read().strip(), '47')
+
+    # a restarted allocator continues after the stored counter
+    allocator = self.makeAllocator(5, self.path)
+    l_cert = self.makeCertificates(1)
+    self.assertTrue(allocator.assignSerials(FakeDatabase(None), l_cert))
+    self.assertEqual(l_cert[0].id, 47)
+
+  def testLeaseFailure(self):
+    allocator = self.makeAllocator(5, self.path)
+    l_cert = self.makeCertificates(2)
+    self.assertFalse(allocator.assignSerials(FakeDatabase(None), l_cert))
+    self.assertEqual([cert.id for cert in l_cert], [None, None])
+    self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,155 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the subject of issued certificates"""
+
+# System imports
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.pki.pki_manager import PublicKeyInfrastructure
+from OpenVPNUAM import models as Model
+
+
+class FakeDatabase(object):
+  """Give an id to each inserted certificate"""
+
+  def __init__(self):
+    self.last_id = 0
+
+  def insert(self, obj, parent=None, realtime=True):
+    self.last_id += 1
+    obj.load({'id': self.last_id})
+    return True
+
+
+def buildCA(directory, name):
+  """Build a self signed certificate authority into files
+
+  @param directory [str] the directory to write the files into
+  @param name [x509.Name] the subject of the authority
+  @return [tuple] the (certificate, key) paths of the authority
+  """
+  key = ec.generate_private_key(ec.SECP256R1())
+  now = datetime.datetime.utcnow()
+  cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+          .public_key(key.public_key()).serial_number(1)
+          .not_valid_before(now).not_valid_after(now +
+                                                 datetime.timedelta(days=1))
+          .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                         critical=True)
+          .sign(key, hashes.SHA256()))
+  paths = (os.path.join(directory, 'ca.crt'), os.path.join(directory, 'ca.key'))
+  with open(paths[0], 'wb') as f:
+    f.write(crypto.dump_certificate(crypto.FILETYPE_PEM,
+                                    crypto.X509.from_cryptography(cert)))
+  with open(paths[1], 'wb') as f:
+    f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM,
+                                   crypto.PKey.from_cryptography_key(key)))
+  return paths
+
+
+class TestSubjectTemplate(unittest.TestCase):
+  """Copy the subject template of the CA into each certificate"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    # the state and the locality are not set
+    (self.ca_path, self.ca_key_path) = buildCA(self.directory, x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, 'FR'),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, 'Example'),
+        x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, 'VPN'),
+        x509.NameAttribute(NameOID.COMMON_NAME, 'test-ca')]))
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.PKI_SECTION: {
+        'cert_directory': os.path.join(self.directory, 'certs'),
+        'file_writer_thread': 'False',
+        'ca': self.ca_path,
+        'ca_key': self.ca_key_path,
+        'key_type': PublicKeyInfrastructure.KEY_TYPE_EC_P256,
+        'keep_certificate_request': 'True'}})
+    self.pki = PublicKeyInfrastructure(cp)
+    self.assertTrue(self.pki.load())
+    self.db = FakeDatabase()
+
+  def tearDown(self):
+    self.pki.stop()
+    shutil.rmtree(self.directory)
+
+  def issue(self, cuid, hostname_name, hostname_id):
+    """Issue a certificate for a new hostname
+
+    @param cuid [str] the user identifier
+    @param hostname_name [str] the name of the hostname
+    @param hostname_id [int] the id of the hostname
+    @return [tuple] the (X509, X509Req, Certificate) of the new certificate
+    """
+    user = Model.User(cuid, cuid + '@example.org')
+    user.load({'id': 1})
+    hostname = Model.Hostname(hostname_name)
+    hostname.load({'id': hostname_id, 'period_days': 30, 'is_enabled': True})
+    hostname.db = self.db
+    self.pki.generateUserCertificate(user, hostname)
+    m_cert = hostname.getLatestCertificate()
+    self.assertIsNotNone(m_cert)
+    path = os.path.join(self.directory, 'certs', '1', str(hostname_id),
+                        str(m_cert.id))
+    cert = PublicKeyInfrastructure.loadCertificate(path + '.crt')
+    with open(path + '.csr', 'rb') as f:
+      req = crypto.load_certificate_request(crypto.FILETYPE_PEM, f.read())
+    return (cert, req, m_cert)
+
+  def testSubject(self):
+    ca = PublicKeyInfrastructure.loadCertificate(self.ca_path)
+    for (cuid, hostname_name, hostname_id) in [('jdoe', 'laptop', 2),
+                                               ('asmith', 'phone', 3)]:
+      (cert, req, m_cert) = self.issue(cuid, hostname_name, hostname_id)
+      name = cuid + '_' + hostname_name
+      # unset fields of the CA are not copied
+      self.assertEqual(cert.get_subject().get_components(), [
+          (b'C', b'FR'),
+          (b'O', b'Example'),
+          (b'OU', b'VPN'),
+          (b'CN', name.encode()),
+          (b'emailAddress', (cuid + '@example.org').encode()),
+          (b'name', (name + '_' +
+                     str(m_cert.certificate_begin_time)).encode())])
+      self.assertEqual(cert.get_issuer(), ca.get_subject())
+      self.assertEqual(cert.get_version(),
+                       PublicKeyInfrastructure.CERTIFICATE_VERSION)
+      # the request describes the same subject
+      self.assertEqual(req.get_subject().get_components(),
+                       cert.get_subject().get_components())
@@ -0,0 +1,74 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the revoked certificates serials set"""
+
+# System imports
+import datetime
+import unittest
+
+# Project imports
+from OpenVPNUAM.revocation import RevokedSerialSet
+
+
+class TestRevokedSerialSet(unittest.TestCase):
+  """Fill the set incrementally and completely"""
+
+  def setUp(self):
+    self.time = datetime.datetime(2020, 1, 1)
+    self.revoked = RevokedSerialSet()
+
+  def row(self, serial, hours):
+    return {'id': serial,
+            'revoked_time': self.time + datetime.timedelta(hours=hours)}
+
+  def testIncremental(self):
+    self.assertIsNone(self.revoked.last_time)
+    self.assertEqual(self.revoked.update([self.row(1, 1), self.row(2, 3)]), 2)
+    self.assertEqual(self.revoked.update([self.row(3, 2),
+                                          {'id': 4, 'revoked_time': None}]),
+                     1)
+    self.assertEqual(sorted(self.revoked), [1, 2, 3])
+    self.assertIn(3, self.revoked)
+    self.assertNotIn(4, self.revoked)
+    self.assertEqual(self.revoked.last_time,
+                     self.time + datetime.timedelta(hours=3))
+
+  def testFull(self):
+    self.revoked.update([self.row(1, 1), self.row(2, 3)])
+    # an un-revoked certificate is forgotten by a complete read
+    self.revoked.update([self.row(1, 1)], full=True)
+    self.assertEqual(sorted(self.revoked), [1])
+    self.assertEqual(self.revoked.last_time,
+                     self.time + datetime.timedelta(hours=1))
+
+  def testGeneration(self):
+    generation = self.revoked.generation
+    self.revoked.update([self.row(1, 1)])
+    self.assertEqual(self.revoked.generation, generation + 1)
+    # reading the same revocations again is not a change
+    self.revoked.update([self.row(1, 1)])
+    self.revoked.update([self.row(1, 1)], full=True)
+    self.assertEqual(self.revoked.generation, generation + 1)
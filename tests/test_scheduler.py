@@ -0,0 +1,145 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the periodic tasks scheduler"""
+
+# System imports
+import unittest
+
+# Project imports
+from OpenVPNUAM.config import OVPNUAMConfigParser
+from OpenVPNUAM.scheduler import ScheduledTask, Scheduler
+
+
+class TestScheduledTask(unittest.TestCase):
+  """Apply the missed runs policies"""
+
+  def runUntil(self, task, now):
+    """Run the task as the main loop would do until it is not due
+
+    @return [list<float>] the times of the occurrences which have run
+    """
+    l_run = []
+    while task.next_time <= now:
+      if not task.start(now):
+        continue
+      l_run.append(task.next_time)
+      task.finish(now, now)
+    return l_run
+
+  def testOnTime(self):
+    task = ScheduledTask('t', None, 10.0)
+    task.schedule(100.0)
+    self.assertEqual(self.runUntil(task, 100.0), [100.0])
+    self.assertEqual(task.next_time, 110.0)
+    self.assertEqual(task.metrics.skipped, 0)
+
+  def testSkip(self):
+    task = ScheduledTask('t', None, 10.0, missed=ScheduledTask.MISSED_SKIP)
+    task.schedule(100.0)
+    self.assertEqual(self.runUntil(task, 135.0), [])
+    self.assertEqual(task.next_time, 140.0)
+    self.assertEqual(task.metrics.skipped, 4)
+    self.assertEqual(task.metrics.runs, 0)
+
+  def testRunOnce(self):
+    task = ScheduledTask('t', None, 10.0,
+                         missed=ScheduledTask.MISSED_RUN_ONCE)
+    task.schedule(100.0)
+    self.assertEqual(len(self.runUntil(task, 135.0)), 1)
+    self.assertEqual(task.next_time, 140.0)
+    self.assertEqual(task.metrics.skipped, 3)
+    self.assertEqual(task.metrics.runs, 1)
+
+  def testCatchUp(self):
+    task = ScheduledTask('t', None, 10.0,
+                         missed=ScheduledTask.MISSED_CATCH_UP)
+    task.schedule(100.0)
+    self.assertEqual(len(self.runUntil(task, 135.0)), 4)
+    self.assertEqual(task.next_time, 140.0)
+    self.assertEqual(task.metrics.skipped, 0)
+
+  def testCatchUpLimit(self):
+    task = ScheduledTask('t', None, 10.0,
+                         missed=ScheduledTask.MISSED_CATCH_UP)
+    task.schedule(0.0)
+    self.assertEqual(len(self.runUntil(task, 1000.0)),
+                     ScheduledTask.CATCH_UP_LIMIT + 1)
+    self.assertEqual(task.metrics.skipped, 100 - ScheduledTask.CATCH_UP_LIMIT)
+    self.assertEqual(task.next_time, 1010.0)
+
+  def testOverlap(self):
+    task = ScheduledTask('t', None, 10.0)
+    task.schedule(100.0)
+    self.assertTrue(task.start(100.0))
+    # the run lasted over two next occurrences
+    task.finish(100.0, 125.0)
+    self.assertEqual(task.metrics.overlaps, 2)
+    self.assertEqual(task.next_time, 130.0)
+    self.assertEqual(task.metrics.last_duration, 25.0)
+
+
+class TestScheduler(unittest.TestCase):
+  """Run the registered tasks"""
+
+  def makeScheduler(self, section=None):
+    cp = OVPNUAMConfigParser()
+    cp.read_dict({cp.SCHEDULER_SECTION: section or {}})
+    scheduler = Scheduler(cp)
+    return scheduler
+
+  def testOverride(self):
+    scheduler = self.makeScheduler({'poll_interval': '2',
+                                    'poll_missed': 'skip',
+                                    'flush_interval': '0'})
+    task = scheduler.addTask('poll', None, 5.0)
+    self.assertEqual(task.interval, 2.0)
+    self.assertEqual(task.missed, ScheduledTask.MISSED_SKIP)
+    self.assertFalse(scheduler.addTask('flush', None, 5.0))
+    self.assertIsNone(scheduler.getTask('flush'))
+
+  def testInvalidPolicy(self):
+    scheduler = self.makeScheduler({'poll_missed': 'never'})
+    self.assertIsNone(scheduler.addTask('poll', None, 5.0))
+
+  def testFailureAndStop(self):
+    scheduler = self.makeScheduler()
+    l_call = []
+
+    def fail():
+      l_call.append('fail')
+      raise ValueError('broken')
+
+    def stop():
+      l_call.append('stop')
+      scheduler.stop()
+
+    scheduler.addTask('fail', fail, 60.0, delay=0.0)
+    scheduler.addTask('stop', stop, 60.0, delay=0.01)
+    # run returns after the task which stopped the loop
+    scheduler.run()
+    self.assertEqual(l_call, ['fail', 'stop'])
+    self.assertEqual(scheduler.getMetrics()['fail'].failures, 1)
+    self.assertEqual(scheduler.getMetrics()['stop'].runs, 1)
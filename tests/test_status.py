@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+
+# This file is a part of OpenVPN-UAM
+#
+# Copyright (c) 2015 Pierre GINDRAUD
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Tests of the OpenVPN status file reader"""
+
+# System imports
+import os
+import shutil
+import tempfile
+import unittest
+
+# Project imports
+from OpenVPNUAM.status import StatusClient, StatusFileReader
+
+# A status file of --status-version 1
+STATUS_V1 = """OpenVPN CLIENT LIST
+Updated,Thu Jun 18 08:12:15 2015
+Common Name,Real Address,Bytes Received,Bytes Sent,Connected Since
+jdoe_laptop,10.0.0.1:1194,100,200,Thu Jun 18 04:23:03 2015
+ROUTING TABLE
+Virtual Address,Common Name,Real Address,Last Ref
+10.8.0.6,jdoe_laptop,10.0.0.1:1194,Thu Jun 18 08:12:09 2015
+GLOBAL STATS
+Max bcast/mcast queue length,0
+END
+"""
+
+# A status file of --status-version 2 written by OpenVPN 2.3, which has no
+# IPv6 address column
+STATUS_V2 = """TITLE,OpenVPN 2.3.10 x86_64-pc-linux-gnu
+TIME,Thu Jun 18 08:12:15 2015,1434615135
+HEADER,CLIENT_LIST,Common Name,Real Address,Virtual Address,Bytes Received,\
+Bytes Sent,Connected Since,Connected Since (time_t),Username
+CLIENT_LIST,jdoe_laptop,10.0.0.1:1194,10.8.0.6,100,200,\
+Thu Jun 18 04:23:03 2015,1434601383,UNDEF
+HEADER,ROUTING_TABLE,Virtual Address,Common Name,Real Address,Last Ref,\
+Last Ref (time_t)
+ROUTING_TABLE,10.8.0.6,jdoe_laptop,10.0.0.1:1194,Thu Jun 18 08:12:09 2015,\
+1434615129
+GLOBAL_STATS,Max bcast/mcast queue length,0
+END
+"""
+
+# A status file of --status-version 3 written by OpenVPN 2.5, the phone
+# session only has an address in the routing table
+STATUS_V3 = """TITLE\tOpenVPN 2.5.1 x86_64-pc-linux-gnu
+TIME\tThu Jun 18 08:12:15 2015\t1434615135
+HEADER\tCLIENT_LIST\tCommon Name\tReal Address\tVirtual Address\t\
+Virtual IPv6 Address\tBytes Received\tBytes Sent\tConnected Since\t\
+Connected Since (time_t)\tUsername\tClient ID\tPeer ID\tData Channel Cipher
+CLIENT_LIST\tjdoe_laptop\t10.0.0.1:1194\t10.8.0.6\t\t100\t200\t\
+Thu Jun 18 04:23:03 2015\t1434601383\tUNDEF\t0\t0\tAES-256-GCM
+CLIENT_LIST\tjdoe_phone\t10.0.0.2:1194\t\t\t300\t400\t\
+Thu Jun 18 04:23:20 2015\t1434601400\tUNDEF\t1\t1\tAES-256-GCM
+HEADER\tROUTING_TABLE\tVirtual Address\tCommon Name\tReal Address\t\
+Last Ref\tLast Ref (time_t)
+ROUTING_TABLE\t10.8.0.6\tjdoe_laptop\t10.0.0.1:1194\t\
+Thu Jun 18 08:12:09 2015\t1434615129
+ROUTING_TABLE\t52:54:00:12:34:56\tjdoe_phone\t10.0.0.2:1194\t\
+Thu Jun 18 08:12:10 2015\t1434615130
+GLOBAL_STATS\tMax bcast/mcast queue length\t0
+END
+"""
+
+
+class TestStatusFileReader(unittest.TestCase):
+  """Read the sessions of the three status formats"""
+
+  LAPTOP_V1 = StatusClient('jdoe_laptop', '10.0.0.1:1194', '10.8.0.6', 100,
+                           200, 'Thu Jun 18 04:23:03 2015')
+  LAPTOP = StatusClient('jdoe_laptop', '10.0.0.1:1194', '10.8.0.6', 100, 200,
+                        1434601383)
+  PHONE = StatusClient('jdoe_phone', '10.0.0.2:1194', '52:54:00:12:34:56',
+                       300, 400, 1434601400)
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'status.log')
+    self.reader = StatusFileReader(self.path)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self, content):
+    with open(self.path, 'w') as f:
+      f.write(content)
+
+  def testVersion1(self):
+    self.write(STATUS_V1)
+    self.assertEqual(self.reader.read(), ([self.LAPTOP_V1], []))
+
+  def testVersion2(self):
+    self.write(STATUS_V2)
+    self.assertEqual(self.reader.read(), ([self.LAPTOP], []))
+
+  def testVersion3(self):
+    self.write(STATUS_V3)
+    (l_connect, l_disconnect) = self.reader.read()
+    self.assertEqual(sorted(l_connect), [self.LAPTOP, self.PHONE])
+    self.assertEqual(l_disconnect, [])
+    # an unchanged file is not read again
+    self.assertIsNone(self.reader.read())
+
+  def testTruncated(self):
+    self.write(STATUS_V3[:STATUS_V3.index('END')])
+    self.assertIsNone(self.reader.read())
+    self.assertEqual(self.reader.clients, dict())
+    self.write(STATUS_V3)
+    self.assertEqual(len(self.reader.read()[0]), 2)
+
+  def testDisconnect(self):
+    self.write(STATUS_V3)
+    self.reader.read()
+    self.write(STATUS_V2)
+    self.assertEqual(self.reader.read(), ([], [self.PHONE]))